@@ -0,0 +1,9 @@
+// https://neo4j.com/docs/labs/apoc/current/import/load-csv/#_transaction_batching
+// pypi_dependencies_resolved.csv is written by `resolve_dependencies.py`: every
+// row names a project that exists by its ID, once per version and project
+CALL apoc.periodic.iterate(
+    'CALL apoc.load.csv("pypi_dependencies_resolved.csv", {ignore:["ID","Project_Name","Project_ID","Version_Number","Dependency_Name","Dependency_Requirements"]}) yield map return map',
+    'MATCH (v:Version {ID: toInteger(map["Version_ID"])}) MATCH (proj:Project {ID: toInteger(map["Dependency_Project_ID"])}) MERGE (proj)<-[d:DEPENDS_ON]-(v) ON CREATE SET d.kind=map["Dependency_Kind"], d.optional=apoc.convert.toBoolean(map["Optional_Dependency"])',
+     {batchSize:2000, iterateList:true, parallel:true}
+)
+;
@@ -0,0 +1,8 @@
+// schema.cypher for a graph built by `neo4j-admin import` from the files of
+// `write_import_files.py`: versions are imported by ID, many of them sharing a
+// number, so `Version.number` is not constrained to be unique
+CREATE CONSTRAINT ON (platform:Platform) ASSERT platform.name IS UNIQUE;
+CREATE CONSTRAINT ON (project:Project) ASSERT project.name IS UNIQUE;
+CREATE CONSTRAINT ON (project:Project) ASSERT project.ID IS UNIQUE;
+CREATE CONSTRAINT ON (language:Language) ASSERT language.name IS UNIQUE;
+CREATE CONSTRAINT ON (c:Contributor) ASSERT c.uuid IS UNIQUE;
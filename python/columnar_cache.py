@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" A typed, columnar cache of the Pypi subset CSVs, so that analyses can
+reload them in seconds instead of parsing hundreds of MB of text (and
+converting every field) each time.
+
+Each CSV becomes a directory with one file per column and a `meta.json`
+describing them:
+  - integer columns (IDs, counts; see `INTEGER`) are 64-bit integers, with
+  `NULL` where the field is empty or not an integer
+  - categorical columns (see `CATEGORICAL`) are 32-bit codes into the list of
+  their categories in `meta.json`, -1 where the field is empty
+  - boolean columns (see `BOOLEAN`) are 8-bit 1, 0 or -1 where empty
+  - every other column is a UTF-8 blob of all its values, with the 64-bit
+  offset of each value in another file
+Only the standard library is used: columns are written with `array` and read
+by memory-mapping their files and casting them with `memoryview`, so that a
+reader only touches the pages of the columns it asks for.
+"""
+
+from argparse import ArgumentParser
+from array import array
+import csv
+import json
+import logging
+from mmap import mmap, ACCESS_READ
+import os
+import sys
+from typing import Dict, Iterator, List
+
+from logger import return_logger
+
+VERSION = 1
+INTEGER = frozenset(('ID', 'Project_ID', 'Version_ID', 'Dependency_Project_ID',
+                     'Repository_ID', 'Package_Manager_ID', 'SourceRank',
+                     'Versions_Count', 'Dependent_Projects_Count',
+                     'Dependent_Repositories_Count'))
+CATEGORICAL = frozenset(('Dependency_Kind', 'Language', 'Status'))
+BOOLEAN = frozenset(('Optional_Dependency',))
+# The value of an integer column where the field is empty or not an integer
+NULL = -2 ** 63
+# Column type: (file suffix, array typecode)
+TYPES = {'int': ('.i64', 'q'), 'category': ('.codes', 'i'),
+         'bool': ('.i8', 'b'), 'str': ('.offsets', 'Q')}
+logger = logging.getLogger(__name__)
+
+
+def column_type(column: str) -> str:
+    """ Return the type, one of `TYPES`, in which `column` is stored """
+    if column in INTEGER:
+        return 'int'
+    elif column in CATEGORICAL:
+        return 'category'
+    elif column in BOOLEAN:
+        return 'bool'
+    return 'str'
+
+
+def to_int(value: str) -> int:
+    try:
+        return int(value)
+    except ValueError:
+        return NULL
+
+
+def to_bool(value: str) -> int:
+    if not value:
+        return -1
+    return 0 if value.strip().lower() in ('false', 'f', 'no', 'n', '0') else 1
+
+
+def table_name(path: str) -> str:
+    """ Return the name of the table of the CSV at `path` """
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def source_stamp(path: str) -> Dict:
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size,
+            'mtime': stat.st_mtime}
+
+
+def is_fresh(path: str, directory: str) -> bool:
+    """ Return whether `directory` holds the cache of the CSV at `path`, as
+    it is now
+    """
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    stamp = source_stamp(path)
+    return meta.get('version') == VERSION and \
+        meta.get('byteorder') == sys.byteorder and \
+        all(meta['source'].get(key) == stamp[key] for key in ('size', 'mtime'))
+
+
+def write_table(path: str, directory: str) -> int:
+    """ Convert the CSV at `path` into columns in `directory`, in one pass
+    Returns:
+        (int): the number of rows converted
+    """
+    csv.field_size_limit(2 ** 31 - 1)
+    os.makedirs(directory, exist_ok=True)
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = csv.reader(f)
+        header: List[str] = next(rows)
+        types: List[str] = [column_type(column) for column in header]
+        values: List[array] = [array(TYPES[type_][1]) for type_ in types]
+        categories: List[Dict[str, int]] = [{} for _ in header]
+        blobs = {i: open(os.path.join(directory, f"{column}.utf8"), 'wb')
+                 for i, column in enumerate(header) if types[i] == 'str'}
+        for i in blobs:
+            values[i].append(0)
+        n = 0
+        try:
+            for row in rows:
+                row += [''] * (len(header) - len(row))
+                for i, type_ in enumerate(types):
+                    value = row[i]
+                    if type_ == 'int':
+                        values[i].append(to_int(value))
+                    elif type_ == 'category':
+                        values[i].append(categories[i].setdefault(
+                            value, len(categories[i])) if value else -1)
+                    elif type_ == 'bool':
+                        values[i].append(to_bool(value))
+                    else:
+                        encoded = value.encode('utf-8')
+                        blobs[i].write(encoded)
+                        values[i].append(values[i][-1] + len(encoded))
+                n += 1
+        finally:
+            for blob in blobs.values():
+                blob.close()
+    for i, column in enumerate(header):
+        with open(os.path.join(directory, column + TYPES[types[i]][0]),
+                  'wb') as f:
+            values[i].tofile(f)
+    meta = {'version': VERSION, 'byteorder': sys.byteorder, 'rows': n,
+            'source': source_stamp(path),
+            'columns': [{'name': column, 'type': types[i],
+                         'categories': list(categories[i]) or None}
+                        for i, column in enumerate(header)]}
+    # meta.json is written last, so that a cache is only ever read whole
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    return n
+
+
+class StringColumn(object):
+    """ The values of a string column, decoded as they are read """
+    def __init__(self, offsets: memoryview, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].decode('utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+
+class CategoryColumn(object):
+    """ The values of a categorical column: its `codes` (-1 where empty) and
+    the `categories` they index
+    """
+    def __init__(self, codes: memoryview, categories: List[str]):
+        self.codes = codes
+        self.categories = categories
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i: int) -> str:
+        code = self.codes[i]
+        return None if code < 0 else self.categories[code]
+
+    def __iter__(self) -> Iterator[str]:
+        for code in self.codes:
+            yield None if code < 0 else self.categories[code]
+
+
+class ColumnarTable(object):
+    """ A table of the cache in `directory`, the files of whose columns are
+    only memory-mapped when first asked for. Integer and boolean columns are
+    `memoryview`s; see also `StringColumn` and `CategoryColumn`.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta['byteorder'] != sys.byteorder:
+            raise ValueError(f"{directory} was written on a "
+                             f"{self.meta['byteorder']}-endian machine")
+        self.columns: Dict[str, Dict] = {c['name']: c
+                                         for c in self.meta['columns']}
+        self._maps: List[mmap] = []
+        self._views: List[memoryview] = []
+        self._loaded: Dict[str, object] = {}
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def _map(self, name: str):
+        with open(os.path.join(self.directory, name), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b''
+            m = mmap(f.fileno(), 0, access=ACCESS_READ)
+        self._maps.append(m)
+        return m
+
+    def _view(self, name: str, typecode: str) -> memoryview:
+        view = memoryview(self._map(name)).cast(typecode)
+        self._views.append(view)
+        return view
+
+    def column(self, name: str):
+        """ Return the column `name`, mapping its files if need be """
+        if name not in self._loaded:
+            meta = self.columns[name]
+            suffix, typecode = TYPES[meta['type']]
+            values = self._view(name + suffix, typecode)
+            if meta['type'] == 'str':
+                blob = self._map(name + '.utf8')
+                values = StringColumn(values, blob)
+            elif meta['type'] == 'category':
+                values = CategoryColumn(values, meta['categories'] or [])
+            self._loaded[name] = values
+        return self._loaded[name]
+
+    __getitem__ = column
+
+    def rows(self, *names: str) -> Iterator[tuple]:
+        """ Yield the values of the columns `names` of each row, in order """
+        return zip(*(self.column(name) for name in names))
+
+    def close(self) -> None:
+        for view in self._views:
+            view.release()
+        for m in self._maps:
+            m.close()
+        self._views, self._maps, self._loaded = [], [], {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load(path: str, cache: str, force: bool = False) -> ColumnarTable:
+    """ Return the table of the CSV at `path` in the directory `cache`,
+    converting the CSV first if it is not cached, or has changed since, or
+    if `force`
+    """
+    directory = os.path.join(cache, table_name(path))
+    if force or not is_fresh(path, directory):
+        logger.info(f"Converting {path} into columns in {directory}")
+        rows = write_table(path, directory)
+        logger.info(f"{rows} rows converted")
+    return ColumnarTable(directory)
+
+
+def return_parser() -> ArgumentParser:
+    p = ArgumentParser(
+        description='Convert the Pypi subset CSVs into typed columns that '
+        'reload without parsing, unless they are cached already.')
+    p.add_argument('CSV', type=str, nargs='+',
+                   help='The subset CSVs, e.g. pypi_projects.csv')
+    p.add_argument('--cache', type=str, default='columnar_cache',
+                   help='The directory in which to cache the columns; '
+                   'default: %(default)s')
+    p.add_argument('--force', action='store_true',
+                   help='Convert the CSVs even if their cache is fresh')
+    p.add_argument("-l", "--log", dest="log_level", default='INFO',
+                   choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                   help="Set the logging level; default: %(default)s")
+    p.add_argument('--logfile', type=str, required=False,
+                   help='The log file to which to write logging')
+    p.add_argument('--logfile_level', type=str, required=False,
+                   default='DEBUG',
+                   help='The level of logging to write to `logfile`')
+    return p
+
+
+def main(argv=None):
+    if argv is None:
+        argv: List = sys.argv
+
+    args = return_parser().parse_args(argv[1:])
+    return_logger(__name__, args.log_level, args.logfile, args.logfile_level)
+    for path in args.CSV:
+        with load(path, args.cache, args.force) as table:
+            logger.info(f"{table_name(path)}: {len(table)} rows; "
+                        + ", ".join(f"{name} ({column['type']})" for name,
+                                    column in table.columns.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
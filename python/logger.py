@@ -15,10 +15,21 @@ def return_logger(name, loglevel, logfile, logfile_level='DEBUG'):
     Returns:
         (logging.logger) instance
     """
-    logging.basicConfig(level=logging.getLevelName(logfile_level),
+    if logfile is None:
+        # basicConfig logs to stderr, at `loglevel`, so that DEBUG messages
+        # are not even formatted unless asked for
+        logging.basicConfig(level=logging.getLevelName(loglevel),
+                            format='%(name)-12s: %(levelname)-8s %(message)s')
+        return logging.getLogger(name)
+    # The root logger passes on the records of the lower of the two levels,
+    # each handler keeping only those of its own; n.b. DEBUG messages are
+    # formatted whenever either level is DEBUG, e.g. by default with a logfile
+    file_handler = logging.FileHandler(logfile, mode='w')
+    file_handler.setLevel(logging.getLevelName(logfile_level))
+    logging.basicConfig(level=min(logging.getLevelName(loglevel),
+                                  logging.getLevelName(logfile_level)),
                         format='[%(asctime)s] {%(filename)s:%(lineno)d} %(levelname)-8s %(message)s',
-                        filename=logfile,
-                        filemode='w')
+                        handlers=[file_handler])
     console = logging.StreamHandler()
     console.setLevel(logging.getLevelName(loglevel))
     console.setFormatter(logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s'))
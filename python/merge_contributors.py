@@ -1,19 +1,50 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+from argparse import ArgumentParser
 import itertools as it
-import json
+import logging
 import os
 import sys
+import threading
+import time
 from collections import defaultdict
-from typing import ByteString, Dict, Generator, Iterator, List, Text, Tuple
+from collections import namedtuple
+from contextlib import contextmanager
+from sqlite3 import Row
+from typing import Dict, Iterator, List, Set, Tuple
 
-from py2neo import Graph, Node, Relationship
-from py2neo.database import Cursor
+from py2neo import Graph, Node
+from py2neo.database import Cursor, TransientError
 
-from utils.utils import chunk, connect, Row
+from logger import return_logger
+from utils.batch_sizing import BatchSizer
+from utils.contributor_codec import decode_contributors
+from utils.merge_progress import MergeProgress, PENDING_TABLE
+from utils.parallel_merge import GridWriter
+from utils.progress import ProgressReporter
+from utils.utils import chunk, connect, merge_join
 
 GRAPHDBPASS = 'GRAPHDBPASS'
+MERGE_CONTRIBUTORS_UNWIND: str = \
+    """UNWIND $rows AS row
+    MERGE (c:Contributor {uuid: row.uuid})
+    SET c.name = row.name, c.github_id = row.github_id, c.login = row.login,
+    c.host_type = row.host_type"""
+MERGE_CONTRIBUTES_TO_UNWIND: str = \
+    """UNWIND $rows AS row
+    MATCH (p:Project) WHERE id(p) = row.project_id
+    MATCH (c:Contributor {uuid: row.uuid})
+    MERGE (c)-[:CONTRIBUTES_TO]->(p)"""
+SET_MERGED_CONTRIBUTORS_UNWIND: str = \
+    """UNWIND $rows AS row
+    MATCH (p:Project) WHERE id(p) = row.project_id
+    SET p.merged_contributors = row.count"""
+# Lightweight stand-ins for the py2neo Nodes of projects and contributors
+project = namedtuple("Project", ["identity", "name"])
+contributor = namedtuple("Contributor",
+                         ["uuid", "name", "github_id", "login", "host_type"])
+logger = logging.getLogger(__name__)
 
 
 def get_graph_password(env_variable_name: str = GRAPHDBPASS) -> str:
@@ -59,95 +90,351 @@ def create_contributor_node(d: Dict, label: str = "Contributor") -> Node:
     return contributor
 
 
+def to_contributor(d: Dict) -> contributor:
+    """ Return the `contributor` record of the properties in `d`, as
+    `create_contributor_node` would set them, without building a Node
+    """
+    return contributor(int(d.get('uuid', -1)), d.get('name'),
+                       d.get('github_id'), d.get('login'), d.get('host_type'))
+
+
+@contextmanager
+def transaction(g: Graph):
+    """ Begin a transaction of `g` and commit it, or, if anything raises, roll
+    it back before re-raising, so that no transaction is left open on the
+    session when the work is retried
+    """
+    tx = g.begin(autocommit=False)
+    try:
+        yield tx
+        tx.commit()
+    except BaseException:
+        try:
+            tx.rollback()
+        except Exception as e:
+            logger.debug(f"Rolling back raised {e!r}")
+        raise
+
+
+def split_batch(batch: Tuple[Tuple[project, contributor]],
+                merged: Set[int]) -> Tuple[List[Dict], List[Dict]]:
+    """ Return the rows of the contributors of `batch` not yet in `merged`,
+    each uuid once, and the rows of every relationship of `batch`
+    """
+    contributors: Dict[int, Dict] = {}
+    relationships: List[Dict] = []
+    for p, c in batch:
+        if c.uuid not in merged and c.uuid not in contributors:
+            contributors[c.uuid] = c._asdict()
+        relationships.append({'project_id': p.identity, 'uuid': c.uuid})
+    return list(contributors.values()), relationships
+
+
+def count_projects(batch: Tuple[Tuple[project, contributor]],
+                   projects: Dict[project, int]) -> None:
+    """ Count the contributors of each project of `batch`, once it has been
+    committed, in `projects`
+    """
+    for p, _ in batch:
+        projects[p] += 1
+
+
+def merge_batch(g: Graph, batch: Tuple[Tuple[project, contributor]],
+                projects: Dict[project, int], merged: Set[int]) -> None:
+    """ MERGE each contributor of `batch` not yet MERGEd this run, and each
+    relationship to its project, to `g` one statement at a time, in a single
+    transaction, adding the contributors MERGEd to `merged`
+    """
+    contributors, relationships = split_batch(batch, merged)
+    debug: bool = logger.isEnabledFor(logging.DEBUG)
+    with transaction(g) as tx:
+        for row in contributors:
+            if debug:
+                logger.debug("MERGEing contributor %s: %s", row['uuid'],
+                             row['name'])
+            tx.run(MERGE_CONTRIBUTORS_UNWIND, rows=[row])
+        for row in relationships:
+            if debug:
+                logger.debug("MERGEing relationship of contributor %s to "
+                             "project %s", row['uuid'], row['project_id'])
+            tx.run(MERGE_CONTRIBUTES_TO_UNWIND, rows=[row])
+    merged.update(row['uuid'] for row in contributors)
+    count_projects(batch, projects)
+
+
+def merge_batch_unwind(g: Graph, batch: Tuple[Tuple[project, contributor]],
+                       projects: Dict[project, int], merged: Set[int]) -> None:
+    """ MERGE every contributor of `batch` not yet MERGEd this run to `g`
+    with one parameterized `UNWIND` statement, and every relationship to its
+    project with another, in a single transaction, adding the contributors
+    MERGEd to `merged`
+    """
+    contributors, relationships = split_batch(batch, merged)
+    with transaction(g) as tx:
+        if contributors:
+            tx.run(MERGE_CONTRIBUTORS_UNWIND, rows=contributors)
+        tx.run(MERGE_CONTRIBUTES_TO_UNWIND, rows=relationships)
+    merged.update(row['uuid'] for row in contributors)
+    count_projects(batch, projects)
+    logger.debug("MERGEd %d new contributors and %d relationships",
+                 len(contributors), len(relationships))
+
+
+def merge_window_in_parallel(g: Graph, window: Tuple[Tuple[project, contributor]],
+                             projects: Dict[project, int], merged: Set[int],
+                             writer: GridWriter, batch_size: int) -> None:
+    """ MERGE the contributors of `window` not yet MERGEd this run to `g`,
+    `batch_size` at a time, retrying transient errors as `writer` does, then
+    MERGE its relationships in parallel with `writer`, adding the
+    contributors MERGEd to `merged`
+    """
+    def merge_contributors(rows: List[Dict]) -> None:
+        with transaction(g) as tx:
+            tx.run(MERGE_CONTRIBUTORS_UNWIND, rows=rows)
+
+    contributors, relationships = split_batch(window, merged)
+    for batch in chunk(contributors, batch_size):
+        writer.write_with_retries(list(batch), merge_contributors)
+    merged.update(row['uuid'] for row in contributors)
+    writer.run(relationships)
+    count_projects(window, projects)
+    logger.debug("MERGEd %d new contributors and %d relationships with %d "
+                 "workers (%d retries so far)", len(contributors),
+                 len(relationships), writer.workers, writer.retried)
+
+
+def return_relationship_writer(workers: int, sizer: BatchSizer) -> GridWriter:
+    """ Return a GridWriter of CONTRIBUTES_TO relationships, each of whose
+    `workers` threads has a Graph (and so a connection) of its own, sizing
+    its transactions with `sizer`
+    """
+    local = threading.local()
+
+    def write(rows: List[Dict]) -> None:
+        if getattr(local, 'graph', None) is None:
+            local.graph = Graph(password=get_graph_password())
+        with transaction(local.graph) as tx:
+            tx.run(MERGE_CONTRIBUTES_TO_UNWIND, rows=rows)
+
+    return GridWriter(write, lambda row: (row['project_id'], row['uuid']),
+                      workers, transient=(TransientError,), sizer=sizer)
+
+
+def set_merged_contributors(g: Graph, projects: Dict[project, int],
+                            batch_size: int) -> None:
+    """ Set the `merged_contributors` property of each of `projects` to its
+    count of contributors, `batch_size` projects per transaction
+    """
+    rows: Iterator[Dict] = ({'project_id': p.identity, 'count': count}
+                            for p, count in projects.items())
+    for batch in chunk(rows, batch_size):
+        logger.debug("Updating 'merged_contributors' property for %d "
+                     "Project nodes", len(batch))
+        with transaction(g) as tx:
+            tx.run(SET_MERGED_CONTRIBUTORS_UNWIND, rows=list(batch))
+
+
+def checkpoint(g: Graph, progress: MergeProgress, projects: Dict[project, int],
+               last: project = None, batch_size: int = 1000,
+               set_property: bool = False) -> int:
+    """ Record every project counted in `projects` but `last`, the
+    contributors of which may go on in the next batch, as MERGEd in
+    `progress`, in one transaction, and forget them
+    Args:
+        g (py2neo.Graph): the graph, to set `merged_contributors` on too
+        progress (MergeProgress): the checkpoint of the run
+        projects (dict): project: number of contributors MERGEd so far
+        last (project): the last project of the batch just committed
+        batch_size (int): the number of projects per transaction, when
+            setting `merged_contributors`
+        set_property (bool): also set the `merged_contributors` property of
+            the Project nodes to their count of contributors
+    Returns:
+        (int): the number of projects recorded
+    """
+    done: Dict[project, int] = {p: count for p, count in projects.items()
+                                if p != last}
+    if set_property:
+        set_merged_contributors(g, done, batch_size)
+    for p in done:
+        del projects[p]
+    return progress.commit({p.name: count for p, count in done.items()})
+
+
+def return_parser() -> ArgumentParser:
+    p = ArgumentParser(
+        description='This script MERGEs the contributors stored in SQLite '
+        'to the Python projects on Pypi in Neo4j, in order of name, '
+        'checkpointing its progress in the `merge_progress` table of SQLite '
+        'so that it only MERGEs the projects not MERGEd yet, or fetched '
+        'again since.',
+        epilog='N.b. to avoid being prompted for Graph DB password, set the '
+        'ENV variable `GRAPHDBPASS`'
+    )
+    p.add_argument('DB', type=str,
+                   help='The sqlite DB containing the contributors requested '
+                   'from the Libraries.io API')
+    p.add_argument('merged_contributors', type=int, nargs='?',
+                   help='Only MERGE contributors to the Project nodes with '
+                   'this value of the `merged_contributors` property, and '
+                   'set it to their count of contributors (as set by '
+                   '`set_merged_contributors_property.cypher`); '
+                   'default: every project, leaving the property alone')
+    p.add_argument('batch_size', type=int,
+                   help='The number of contributors to MERGE per transaction '
+                   '(to start from, with `--target_seconds`)')
+    p.add_argument('--target_seconds', type=float, required=False,
+                   help='Grow or shrink the number of contributors per '
+                   'transaction so that each commits in about this long (s), '
+                   'reporting the size settled on at the end')
+    p.add_argument('--unwind', action='store_true',
+                   help='MERGE each batch with one `UNWIND` statement for the '
+                   'contributors and one for the relationships, instead of '
+                   'one statement per contributor and relationship')
+    p.add_argument('--workers', type=int, default=1,
+                   help='The number of transactions MERGEing relationships '
+                   'at once; if more than 1, the relationships are '
+                   'partitioned so that no two of them lock the same node; '
+                   'default: %(default)s')
+    p.add_argument('--restart', action='store_true',
+                   help='Forget the progress checkpointed by previous runs '
+                   '(with the same `merged_contributors`) and MERGE every '
+                   'project again')
+    p.add_argument("-l", "--log", dest="log_level", default='INFO',
+                   choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                   help="Set the logging level; DEBUG logs every contributor "
+                   "and relationship MERGEd; default: %(default)s")
+    p.add_argument('--logfile', type=str, required=False,
+                   help='The log file to which to write logging')
+    p.add_argument('--logfile_level', type=str, required=False,
+                   default='DEBUG',
+                   help='The level of logging to write to `logfile`')
+    p.add_argument('--report_seconds', type=int, default=60,
+                   help='How often (s) to log progress; default: %(default)s')
+    return p
+
+
 def main(argv=None):
     if argv is None:
         argv: List = sys.argv
 
-    DB, merged_contributors, batch_size = argv[1:]
+    args = return_parser().parse_args(argv[1:])
+    return_logger(__name__, args.log_level, args.logfile, args.logfile_level)
+    DB, merged_contributors, batch_size = \
+        args.DB, args.merged_contributors, args.batch_size
     g: Graph = Graph(password=get_graph_password())
     python_projects_on_pypi_query: str = \
-        """MATCH (:Language {name: 'Python'})
-        <-[:IS_WRITTEN_IN]-(p:Project {merged_contributors: %d})
+        """MATCH (p:Project) %s
+        MATCH (:Language {name: 'Python'})<-[:IS_WRITTEN_IN]-(p)
         <-[:HOSTS]-(:Platform {name: 'Pypi'})
-        return p order by p.name"""
+        return id(p) as identity, p.name as name order by p.name"""
+    # One scan of the primary key, in the same order as the projects
     select_contributors_query: str = \
-        """select contributors from project_names
+        f"""select project_name, contributors from project_names
         where api_has_been_queried=1 and api_query_succeeded=1
-        and project_name=?"""
-
-    # Phase 1: get all project_names from Neo4j the contributors of which have
-    # not tried to be merged yet; this means getting the `contributors` field
-    # from SQLite
-    print("Querying Neo4j for nodes representing Python projects on Pypi\n",
-          file=sys.stderr)
-    projects_cursor: Cursor = execute_cypher_statement(
-        g, python_projects_on_pypi_query % int(merged_contributors)
-    )
-
-    print("Converting py2neo Cursor into iterable of dicts\n", file=sys.stderr)
-    projects_nodes: Iterator[Node] = map(lambda r: r.get('p'), projects_cursor)
+        and project_name in (select project_name from {PENDING_TABLE})
+        order by project_name, page"""
+    set_property: bool = merged_contributors is not None
 
     with connect(DB) as conn:
         conn.row_factory = Row
-        nodes_and_execute_args: Generator[Tuple[Node, Tuple[Text, Tuple[Text]]]] = \
-            ((node, (select_contributors_query, (node.get("name"),)))
-             for node in projects_nodes)
-
-        nodes_and_contributors_cursors: Iterator[Tuple[Node, Cursor]] = \
-            map(lambda tup: (tup[0], conn.execute(*tup[1])), nodes_and_execute_args)
-
-        nodes_and_contributors_generators: Iterator[Tuple[Node, Generator[ByteString]]] = \
-            map(lambda tup: (tup[0], (row[0] for row in tup[1])), nodes_and_contributors_cursors)
-
-        nodes_and_contributors_dict_iterators: Iterator[Tuple[Node, Iterator[List[Dict]]]] = \
-            map(lambda tup: (tup[0], map(json.loads, tup[1])), nodes_and_contributors_generators)
-
-        nodes_and_contributors_iterables: Iterator[Tuple[Node, Iterator[Dict]]] = \
-            map(lambda tup: (tup[0], it.chain.from_iterable(tup[1])),
-                nodes_and_contributors_dict_iterators)
-
-        node_and_contributor_pairs: Iterator[Iterator[Tuple[Node, Dict]]] = \
-            map(lambda tup: zip(it.repeat(tup[0]), tup[1]), nodes_and_contributors_iterables)
-
-        all_nodes_and_contributors: Iterator[Tuple[Node, Dict]] = \
-            it.chain.from_iterable(node_and_contributor_pairs)
-
-        project_nodes__contributor_nodes: Iterator[Tuple[Node, Node]] = \
-            map(lambda tup: (tup[0], create_contributor_node(tup[1])),
-                all_nodes_and_contributors)
-
-        batches = chunk(project_nodes__contributor_nodes, int(batch_size))
-        projects = defaultdict(int)
-        for batch in batches:
-            tx = g.begin(autocommit=False)
-            for pnode_cnode in batch:
-                pnode, cnode = pnode_cnode
-                projects[pnode] += 1
-                if projects[pnode] == 1:
-                    print("MERGEing contributors to Neo4j for project "
-                          f"{pnode['name']}", file=sys.stderr)
-                print(f"\tMERGEing contributor {projects[pnode]}: "
-                      "{cnode.get('name')}", file=sys.stderr)
-                tx.merge(cnode, "Contributor", "uuid")
-                print("\t\tMERGEing relationship to contributor "
-                      f"{projects[pnode]}: {cnode.get('name')}",
-                      file=sys.stderr)
-                rel = Relationship(cnode, "CONTRIBUTES_TO", pnode)
-                tx.merge(rel)
-            else:
-                tx.commit()
-
-        for project, count in projects.items():
-            tx = g.begin(autocommit=False)
-            print("Upating 'merged_contributors' property for Project node "
-                  f"{project} with value {count}", file=sys.stderr)
-            project.update(merged_contributors=count)
-            tx.push(project)
-            tx.commit()
+        progress = MergeProgress(
+            conn, f"merged_contributors={merged_contributors}"
+            if set_property else '').create()
+        if args.restart:
+            progress.restart()
+        merged_before: int = len(progress)
+        pending: Set[str] = progress.pending()
+        if merged_before:
+            logger.info(f"{merged_before} projects MERGEd by previous runs; "
+                        f"{len(pending)} projects pending")
+
+        # Phase 1: get the project names from Neo4j the contributors of which
+        # have not been merged yet; this means getting the `contributors`
+        # field from SQLite
+        logger.info("Querying Neo4j for nodes representing Python projects "
+                    "on Pypi")
+        projects_cursor: Cursor = execute_cypher_match_statement(
+            g, python_projects_on_pypi_query %
+            ("WHERE p.merged_contributors = $merged_contributors"
+             if set_property else ""),
+            merged_contributors=merged_contributors)
+
+        # Neo4j and SQLite may order some names differently, so the pending
+        # projects are sorted as SQLite sorts them (by code point) before
+        # being joined
+        projects_records: List[project] = sorted(
+            (project(r['identity'], r['name']) for r in projects_cursor
+             if r['name'] in pending),
+            key=lambda p: p.name)
+
+        projects_and_rows: Iterator[Tuple[project, Row]] = \
+            merge_join(projects_records,
+                       conn.execute(select_contributors_query),
+                       lambda p: p.name, lambda row: row[0])
+
+        project_and_contributor_pairs: Iterator[Iterator[Tuple[project, Dict]]] = \
+            map(lambda tup: zip(it.repeat(tup[0]), decode_contributors(tup[1][1])),
+                projects_and_rows)
+
+        all_projects_and_contributors: Iterator[Tuple[project, Dict]] = \
+            it.chain.from_iterable(project_and_contributor_pairs)
+
+        projects__contributors: Iterator[Tuple[project, contributor]] = \
+            map(lambda tup: (tup[0], to_contributor(tup[1])),
+                all_projects_and_contributors)
+
+        projects: Dict[project, int] = defaultdict(int)
+        merged: Set[int] = set()
+        sizer = BatchSizer(batch_size, args.target_seconds,
+                           max_failures=None if args.workers > 1 else 5)
+        reporter = ProgressReporter(
+            logger, 'pairs', args.report_seconds,
+            total=len(projects_records), total_of='projects',
+            context=lambda: f"{len(merged)} contributors MERGEd; batch size "
+            f"{sizer.size}")
+        logger.info(f"MERGEing the contributors of {len(projects_records)} "
+                    "projects")
+        if args.workers > 1:
+            writer = return_relationship_writer(args.workers, sizer)
+            # Enough rows for every cell of the grid to fill a transaction
+            windows = iter(lambda: tuple(it.islice(
+                projects__contributors, sizer.size * args.workers ** 2)), ())
+            for window in windows:
+                began = time.monotonic()
+                merge_window_in_parallel(g, window, projects, merged, writer,
+                                         sizer.size)
+                reporter.update(len(window), time.monotonic() - began,
+                                projects=checkpoint(
+                                    g, progress, projects, window[-1][0],
+                                    batch_size, set_property))
         else:
-            del g
-        print("\nFinished.", file=sys.stderr)
+            merge = merge_batch_unwind if args.unwind else merge_batch
+            for batch in sizer.batches(projects__contributors):
+                began = time.monotonic()
+                try:
+                    merge(g, batch, projects, merged)
+                except TransientError as e:
+                    logger.warning(f"Batch of {len(batch)} pairs raised "
+                                   f"{e!r}; retrying")
+                    reporter.update(errors=1)
+                    sizer.failed(batch)
+                else:
+                    seconds: float = time.monotonic() - began
+                    sizer.record(len(batch), seconds)
+                    reporter.update(len(batch), seconds, projects=checkpoint(
+                        g, progress, projects, batch[-1][0], batch_size,
+                        set_property))
+        if args.target_seconds is not None:
+            logger.info(f"Settled on batch size {sizer.settled}; pass it as "
+                        "`batch_size` to start from it next time")
 
+        reporter.update(projects=checkpoint(g, progress, projects, None,
+                                            batch_size, set_property))
+        reporter.report()
+        logger.info(f"{len(progress)} projects MERGEd in all")
+        del g
+        logger.info("Finished.")
 
 if __name__ == "__main__":
     main()
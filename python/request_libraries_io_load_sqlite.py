@@ -4,124 +4,352 @@
 """ This is the main runner script for querying the Libraries.io
 API, project contributors endpoint and loading the response (and error, if any)
 to sqlite. As the API rate limits to 60 per minute, 60 or fewer API calls
-will be made in that time period, managed by the `ratelimit` module.
+will be made in that time period per API key, managed by a rate governor per
+key that follows the rate limit headers of the API's responses. When run with
+`--async`, a pool of concurrent requests shares the keys. Pages that have
+been stored before are requested conditionally on their having changed, using
+the `ETag` and `Last-Modified` headers they were stored with.
+
+With `--record ARCHIVE`, every response is also written to a compressed
+archive, from which `--replay ARCHIVE` stores the same pages again, without
+sending any request (nor waiting on any rate limit).
 """
 
+import asyncio
+from contextlib import ExitStack
 from functools import partial
 import itertools as it
-from typing import Callable, Iterator, Generator, List, Tuple, Union
+import logging
+import signal
+import sys
+import time
+from typing import Callable, Dict, Iterator, List, Set
 
-from backoff import on_exception, expo
-from ratelimit import limits, RateLimitException
-from requests import PreparedRequest, Request, Response, Session
+from requests import Session
+from requests.exceptions import RequestException
 
 from logger import return_logger
+from utils.api_keys import APIKeyPool, NoAPIKeyAvailable, TOO_MANY_REQUESTS
+from utils.async_fetch import fetch_contributors, iterate_async
+from utils.contributor_codec import encoder
+from utils.http_cache import is_not_modified, response_validators, \
+    ValidatorCache
 from utils.libraries_io_project_contributors_endpoint import \
-    build_get_request, content_and_error, parse_request_response_content, URL
-from utils.utils import (connect, craft_sqlite_project_names_update,
-                         craft_sqlite_project_names_insert, partition,
-                         return_parser, execute_sqlite_query, Binary, Row)
+    build_get_request, classify_failure, count_pages, fetched_page, \
+    parse_request_response_content, PERMANENT, response_status, THROTTLED, \
+    TRANSIENT, URL
+from utils.progress import ProgressReporter
+from utils.response_archive import ResponseArchive
+from utils.sqlite_writer import configure_connection, ContributorsWriter, \
+    has_normalized_tables, page_record
+from utils.utils import connect, return_parser
+from utils.work_queue import WorkQueue
+
+# When pages of a project fail in different ways, the most severe is recorded
+SEVERITY = {THROTTLED: 0, TRANSIENT: 1, PERMANENT: 2}
+# The status recorded for a project some of whose pages could not be written
+WRITE_FAILED = 'write failed'
+
+
+def send_request(session, keys, request):
+    """ Call `session`.send() on `request`, signed with whichever of `keys`
+    can send soonest, once the rate limit of that key allows. Requests that
+    are throttled with 429 are sent again, after the pause that the key's
+    rate governor imposes.
+
+    Args:
+        session (requests.Session): session in which to send requests
+        keys (utils.api_keys.APIKeyPool): the API keys to send requests with
+        request (requests.Request): request without an API key
+    Returns:
+        (requests.Response): the first response that was not a 429
+    """
+    while True:
+        key = keys.wait()
+        request.params["api_key"] = key
+        response = session.send(session.prepare_request(request))
+        keys.report(key, response.status_code, response.headers)
+        if response.status_code != TOO_MANY_REQUESTS:
+            return response
+        response.close()
 
 
-@on_exception(expo, RateLimitException, max_tries=10)
-@limits(calls=59, period=59)
-def request_with_session(session, project_name, prepared_request):
-    """ Call `session`.send() on `prepared_request` object, yielding
-    requests.Response object. If the Response object has a 'next' link,
-    get the link and prepare a GET request with it: then pass the prepared
-    request back to the function.
+def request_with_session(session, keys, project_name, per_page=100,
+                         validators=None):
+    """ Request page 1 of the contributors of `project_name`, then each of
+    the remaining pages that page 1 says there are, yielding the response to
+    each request in turn. Given `validators`, requests for pages that have
+    been stored before are conditional on the page having changed.
 
     Args:
         session (requests.Session): session in which to send requests
+        keys (utils.api_keys.APIKeyPool): the API keys to send requests with
         project_name (str): the name of the project that is being requested
-        prepared_request (requests.PreparedRequest): request ready to send
+        per_page (int): the number of contributors to request per page
+        validators (utils.http_cache.ValidatorCache): the stored validators
     Yields:
-        (requests.Response): the response from prepared_request.url
+        (fetched_page): (project_name, page, requests.Response), the response
+        being the exception raised if the request could not be sent
     """
-    response = session.send(prepared_request)
-    page = int(next(filter(
-        lambda param: param if param.startswith('page') else None,
-        response.request.url.split('&')))[-1])
-    logger.info(f"Sent request for project '{project_name}', page {page}")
-    yield (project_name, page, response)
-    next_page = response.links.get('next', None)
-    if next_page is not None:
-        request = build_get_request(next_page['url'], get_api_key=False)
-        prepared_request = session.prepare_request(request)
-        yield from request_with_session(session, project_name, prepared_request)
+    page, num_pages = 1, 1
+    while page <= num_pages:
+        headers = None if validators is None else \
+            validators.conditional_headers(project_name, page)
+        request = build_get_request(URL % project_name, False, per_page, page,
+                                    headers=headers)
+        try:
+            response = send_request(session, keys, request)
+        except RequestException as e:
+            logger.warning(f"Request for project '{project_name}', page "
+                           f"{page} raised {e!r}")
+            yield fetched_page(project_name, page, e)
+            return
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Sent request for project '{project_name}', page "
+                         f"{page}")
+        yield fetched_page(project_name, page, response)
+        if page == 1 and response.ok and validators is not None:
+            num_pages = validators.count_pages(response, project_name,
+                                               per_page) or num_pages
+        elif page == 1 and response.ok:
+            num_pages = count_pages(response, per_page) or num_pages
+        if page == num_pages and response.links.get('next', None) is not None:
+            num_pages += 1
+        page += 1
 
 
-def main():
-    args = return_parser().parse_args()
-    global logger
-    logger = return_logger(__file__, args.log_level, args.logfile)
+def fetch_pages(session, keys, project_names, args, loop, validators=None):
+    """ Return the iterator of every page of contributors of each of
+    `project_names`, requested concurrently on `loop` if `args.asynchronous`,
+    or one at a time otherwise. Either way, at most `args.concurrency` pages
+    (or one page) that have been fetched are held until they are consumed.
+    """
+    if args.asynchronous:
+        return iterate_async(
+            fetch_contributors(session, project_names, keys, args.concurrency,
+                               validators=validators),
+            loop)
+    request_: Callable = partial(request_with_session, session, keys,
+                                 validators=validators)
+    return it.chain.from_iterable(map(request_, project_names))
+
+
+def store_pages(pages, writer, throughput=None, failures=None, archive=None):
+    """ Write each of `pages` with `writer` as it arrives, in a single pass,
+    so that no page is held after it has been handed to `writer`. A page that
+    has not changed since it was stored is only counted.
+    Args:
+        pages (iterable): of `fetched_page`s
+        writer (utils.sqlite_writer.ContributorsWriter): the writer to use
+        throughput (utils.progress.ProgressReporter): counter to update with
+            each page and failure, if any
+        failures (dict): to which to add project name: (kind of failure,
+            status) for each project a page of which failed, if given
+        archive (utils.response_archive.ResponseArchive): the archive in
+            which to record each page as it was fetched, if any
+    Returns:
+        (int): the number of records written
+    """
+    for page in pages:
+        if archive is not None:
+            archive.record(page)
+        kind = classify_failure(page.response)
+        if kind is not None and throughput is not None:
+            throughput.update(errors=1)
+        if kind is not None and failures is not None:
+            failure = (kind, response_status(page.response))
+            previous = failures.setdefault(page.project_name, failure)
+            if SEVERITY[kind] > SEVERITY[previous[0]]:
+                failures[page.project_name] = failure
+        if is_not_modified(page.response):
+            page.response.close()
+            writer.unchanged += 1
+        else:
+            writer.write(page_record(page.project_name, page.page,
+                                     parse_request_response_content(
+                                         page.response)),
+                         response_validators(page.response))
+        if throughput is not None:
+            throughput.update(1)
+    writer.flush()
+    return writer.written
 
-    query = f"""select project_name as name from {args.table}
-        where api_has_been_queried is null group by project_name
-        LIMIT {args.batch_size}"""
 
-    with connect(args.DB) as conn:
-        conn.row_factory = Row
-        cur = conn.cursor()
-        logger.info(f"Executing\n{query}\nto {args.DB}")
-        project_names: List[str] = [row['name'] for row in cur.execute(query)]
+class Shutdown(object):
+    """ Flag that is set when the process receives SIGTERM, so that the
+    current batch can finish the projects it has started and stop cleanly
+    """
+    def __init__(self):
+        self.requested = False
+        signal.signal(signal.SIGTERM, self.request)
 
-    with Session() as s:
-        request_: Callable = partial(request_with_session, s)
-        project_names_and_requests: Generator[Tuple[str, Request]] = \
-            ((p_n, build_get_request(URL % p_n, True, 100, 1)) for p_n in project_names)
+    def request(self, signum, frame):
+        logger.warning("Received SIGTERM; finishing the projects in progress")
+        self.requested = True
 
-        project_names_and_prepared_requests: Iterator[Tuple[str, PreparedRequest]] = \
-            map(lambda tup: (tup[0], s.prepare_request(tup[1])), project_names_and_requests)
+    def __bool__(self):
+        return self.requested
 
-        project_names_pages_responses_gens: Iterator[Generator[Tuple[str, int, Response]]] = \
-            map(lambda tup: request_(*tup), project_names_and_prepared_requests)
 
-        project_names_pages_responses: Iterator[Tuple[str, int, Response]] = \
-            it.chain.from_iterable(project_names_pages_responses_gens)
+def run_batch(session, conn, keys, queue, args, loop, shutdown, throughput,
+              validators, archive=None):
+    """ Lease a batch of `args.batch_size` projects from `queue`, request
+    their contributors and store them, then mark the projects done. The lease
+    on each project is renewed as it is started, and a project whose lease
+    was lost to another worker is left to it. Projects of the batch not yet
+    started when `shutdown` is requested are released, and those that failed
+    are scheduled to be retried, unless the failure is permanent, as are
+    those some of whose pages could not be written.
+    Returns:
+        (tuple): the names of the projects leased, of those completed and of
+        those that failed, the number of records written and the number of
+        pages unchanged
+    """
+    began = time.monotonic()
+    project_names: List[str] = queue.claim(args.batch_size)
+    started: List[str] = []
+    failures: Dict[str, tuple] = {}
 
-        project_names_pages_content_and_errors: Iterator[Tuple[str, int, content_and_error]] = \
-            map(lambda tup: (tup[0], tup[1], parse_request_response_content(tup[2])),
-                project_names_pages_responses)
+    def until_shutdown(names):
+        for name in names:
+            if shutdown:
+                return
+            if not queue.renew(name):
+                continue
+            started.append(name)
+            yield name
 
-    # Add `api_has_been_queried` field as 1 for all records
-    project_names_pages_ahbq_content_and_errors: Iterator[Iterator[str, int, int, content_and_error]] = \
-        map(lambda tup: (tup[0], tup[1], 1, tup[2]), project_names_pages_content_and_errors)
+    pages: Iterator[fetched_page] = \
+        fetch_pages(session, keys, until_shutdown(project_names), args, loop,
+                    validators)
+    try:
+        with ContributorsWriter(conn, args.table, args.write_batch_size,
+                                args.max_buffer_mb * 2 ** 20, validators,
+                                encoder(args.storage),
+                                has_normalized_tables(conn)) as writer:
+            written: int = store_pages(pages, writer, throughput, failures,
+                                       archive)
+    except BaseException:
+        queue.release(project_names)
+        raise
+    for name in writer.failed_projects:
+        previous = failures.get(name, (THROTTLED, None))
+        if SEVERITY[TRANSIENT] > SEVERITY[previous[0]]:
+            failures[name] = (TRANSIENT, WRITE_FAILED)
+    completed: List[str] = [name for name in started if name not in failures]
+    queue.complete(completed)
+    queue.fail(failures)
+    queue.release(set(project_names) - set(started))
+    throughput.update(seconds=time.monotonic() - began,
+                      projects=len(started))
+    return project_names, completed, list(failures), written, writer.unchanged
 
-    # Add `api_query_succeeded` field as 1 or 0, depending on content_and_error
-    project_names_pages_ahbq_aqs_content_and_errors: Iterator[Tuple[str, int, int, int, content_and_error]] = \
-        map(lambda tup: (tup[0], tup[1], tup[2], 1 if tup[3].error is None else 0, tup[3]),
-            project_names_pages_ahbq_content_and_errors)
 
-    page_1_records, page_ge_2_records = \
-        partition(lambda tup: tup[1] == 1, project_names_pages_ahbq_aqs_content_and_errors)
-    # Iterator[Tuple[str, int, int, int, content_and_error]]
+def replay(args):
+    """ Store every page in the archive `args.replay` as if it had just been
+    fetched, marking the projects stored without failure done in the work
+    queue, if there is one, so that they are not requested again
+    Returns:
+        (int): the exit code; 1 if the archive held no pages
+    """
+    replayed: Set[str] = set()
+    failures: Dict[str, tuple] = {}
 
+    def tracked(pages):
+        for page in pages:
+            replayed.add(page.project_name)
+            yield page
 
-    page_1_record_update_queries_parameters: Iterator[Tuple[str, Tuple[Union[None, str], Union[None, Binary]]]] = \
-        map(lambda tup: (craft_sqlite_project_names_update(*tup[:-1]),
-            (tup[-1].error, Binary(tup[-1].content) if tup[-1].content is not None else None)),
-            page_1_records)
+    with connect(args.DB) as conn, ResponseArchive(args.replay) as archive:
+        configure_connection(conn, synchronous=args.synchronous)
+        logger.info(f"Replaying {len(archive.create())} responses from "
+                    f"{args.replay}")
+        with ContributorsWriter(conn, args.table, args.write_batch_size,
+                                args.max_buffer_mb * 2 ** 20,
+                                ValidatorCache(conn).create(),
+                                encoder(args.storage),
+                                has_normalized_tables(conn)) as writer:
+            written: int = store_pages(tracked(archive.replay()), writer,
+                                       failures=failures)
+        queue = WorkQueue(conn)
+        if queue.exists():
+            done: int = queue.mark_done(
+                replayed - set(failures) - writer.failed_projects)
+            logger.info(f"{done} projects replayed marked done in the work "
+                        "queue")
+    logger.info(f"{written} records successfully inserted/updated; "
+                f"{writer.unchanged} pages unchanged; {writer.failed} failed")
+    return 0 if written or writer.unchanged else 1
 
-    page_ge_2_record_insert_queries_parameters: Iterator[Tuple[str, Tuple[str, int, int, Union[None, str], Union[None, Binary]]]] = \
-        map(lambda tup: (craft_sqlite_project_names_insert(),
-                         (tup[0], tup[1], tup[2], tup[3], tup[4].error,
-                          Binary(tup[4].content) if tup[4].content is not None else None)),
-            page_ge_2_records)
 
-    queries_and_parameters: Iterator[Tuple] = it.chain(
-            page_1_record_update_queries_parameters,
-            page_ge_2_record_insert_queries_parameters
-    )
+def main():
+    args = return_parser().parse_args()
+    global logger
+    logger = return_logger(__file__, args.log_level, args.logfile)
+    if args.replay:
+        return replay(args)
 
-    with connect(args.DB) as conn:
-        execute_: Callable = partial(execute_sqlite_query, conn)
-        return_codes: Iterator[Union[int, None]] = \
-            it.starmap(execute_, queries_and_parameters)
-        successes: int = sum(map(lambda rc: rc == 0, return_codes))
+    keys = APIKeyPool.from_environment()
+    logger.info(f"Sending requests with {len(keys)} API key(s)")
+    shutdown = Shutdown()
+    throughput = ProgressReporter(
+        logger, 'pages', args.report_seconds,
+        context=lambda: f"sending at {keys.rate * 60:.1f} requests per "
+        f"minute, having waited {keys.waited:.1f}s on the rate limit")
+    leased_any, rejected = False, False
+    with ExitStack() as stack:
+        s = stack.enter_context(Session())
+        conn = stack.enter_context(connect(args.DB))
+        loop = asyncio.new_event_loop()
+        stack.callback(loop.close)
+        # Closed first, so that what is buffered is written whatever happens
+        archive = stack.enter_context(ResponseArchive(args.record).create()) \
+            if args.record else None
+        configure_connection(conn, synchronous=args.synchronous)
+        validators = ValidatorCache(conn).create()
+        queue = WorkQueue(conn, worker_id=args.worker_id,
+                          lease_seconds=args.lease_seconds,
+                          max_attempts=args.max_attempts,
+                          retry_seconds=args.retry_seconds).ensure(args.table)
+        if args.refresh:
+            queue.refresh()
+        try:
+            while not shutdown:
+                leased, completed, failed, written, unchanged = run_batch(
+                    s, conn, keys, queue, args, loop, shutdown, throughput,
+                    validators, archive)
+                leased_any = leased_any or bool(leased)
+                logger.info(f"{len(completed)} projects completed; {written} "
+                            "records successfully inserted/updated; "
+                            f"{unchanged} pages unchanged")
+                if failed:
+                    logger.warning(f"{len(failed)} projects failed: "
+                                   + ", ".join(failed[:10])
+                                   + (", ..." if len(failed) > 10 else ""))
+                if not (args.daemon or args.until_empty):
+                    break
+                elif not leased and args.until_empty:
+                    logger.info("The work queue is empty")
+                    break
+                elif not leased:
+                    logger.debug(f"The work queue is empty; polling again in "
+                                 f"{args.poll_seconds}s")
+                    deadline = time.monotonic() + args.poll_seconds
+                    while not shutdown and time.monotonic() < deadline:
+                        time.sleep(1)
+        except NoAPIKeyAvailable:
+            logger.error("Every API key has been rejected by the API: "
+                         + ", ".join(map(repr, keys.revoked()))
+                         + "; stopping, having released the projects leased")
+            rejected = True
+    if archive is not None:
+        logger.info(f"Recorded {archive.recorded} responses to {args.record}")
 
-    logger.info(f"{successes} records successfully inserted/updated")
+    throughput.report()
+    if rejected:
+        return 2
+    return 0 if leased_any else 1
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Resolve the `Dependency_Name` of each row of `pypi_dependencies.csv` to
+the ID of the project it names before the graph is loaded, so that
+`dependencies_by_id_apoc.cypher` only MATCHes projects by ID, and only for
+rows that resolve.
+
+The names and IDs of `pypi_projects.csv` are read into memory first. A
+dependency names its project as it was written in a requirement, which pip
+compares by the normalized name of PEP 503 (case-insensitive, with runs of
+`-`, `_` and `.` all alike), so a name that matches no project exactly is
+looked up by its normalized name, unless several projects share it. The
+dependencies are then streamed: each row is written with the resolved
+`Dependency_Project_ID`, once per (version, project) pair, while rows that
+do not resolve are left out and, if asked for, written to a report.
+"""
+
+from argparse import ArgumentParser
+import csv
+import logging
+import re
+import sys
+from typing import Dict, Iterator, List, Set, Tuple
+
+from logger import return_logger
+
+RESOLVED_COLUMN = 'Dependency_Project_ID'
+logger = logging.getLogger(__name__)
+
+
+def normalize(name: str) -> str:
+    """ Return the normalized form of the project `name`, as of PEP 503 """
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+class ProjectIDs(object):
+    """ The IDs of projects by name, exact or normalized """
+    def __init__(self):
+        self.exact: Dict[str, int] = {}
+        self.normalized: Dict[str, int] = {}
+        self.ambiguous: Set[str] = set()
+
+    def add(self, name: str, id_: int) -> None:
+        if name in self.exact:
+            return
+        self.exact[name] = id_
+        key = normalize(name)
+        if key in self.normalized and self.normalized[key] != id_:
+            self.ambiguous.add(key)
+        self.normalized.setdefault(key, id_)
+
+    def resolve(self, name: str):
+        """ Return the ID of the project `name`, or None if there is no such
+        project or several projects have its normalized name
+        """
+        id_ = self.exact.get(name)
+        if id_ is not None:
+            return id_
+        key = normalize(name)
+        return None if key in self.ambiguous else self.normalized.get(key)
+
+    def __len__(self):
+        return len(self.exact)
+
+
+def read_project_ids(rows: Iterator[Dict]) -> ProjectIDs:
+    """ Return the `ProjectIDs` of the rows of `pypi_projects.csv` """
+    projects = ProjectIDs()
+    for row in rows:
+        try:
+            projects.add(row['Name'], int(row['ID']))
+        except (KeyError, TypeError, ValueError):
+            continue
+    return projects
+
+
+def resolve_rows(rows: Iterator[Dict], projects: ProjectIDs,
+                 counts: Dict[str, int]) -> Iterator[Tuple[bool, Dict]]:
+    """ Yield (whether it resolved, row) for each of the dependencies `rows`,
+    with `RESOLVED_COLUMN` set to the ID of the project it names, skipping
+    those whose (version, project) pair was yielded already, and counting
+    the rows 'resolved', 'unresolved' and 'duplicate' in `counts`
+    """
+    pairs: Set[Tuple[str, int]] = set()
+    for row in rows:
+        id_ = projects.resolve(row.get('Dependency_Name') or '')
+        if id_ is None:
+            counts['unresolved'] += 1
+            yield False, row
+            continue
+        pair = (row.get('Version_ID'), id_)
+        if pair in pairs:
+            counts['duplicate'] += 1
+            continue
+        pairs.add(pair)
+        counts['resolved'] += 1
+        row[RESOLVED_COLUMN] = id_
+        yield True, row
+
+
+def return_parser() -> ArgumentParser:
+    p = ArgumentParser(
+        description='Rewrite pypi_dependencies.csv with the ID of the '
+        'project each row depends on, once per version and project, leaving '
+        'out the rows that name no project.')
+    p.add_argument('projects', type=str, help='The path to pypi_projects.csv')
+    p.add_argument('dependencies', type=str,
+                   help='The path to pypi_dependencies.csv')
+    p.add_argument('out', type=str,
+                   help='The path to which to write the resolved '
+                   'dependencies, e.g. pypi_dependencies_resolved.csv')
+    p.add_argument('--unresolved', type=str, required=False,
+                   help='The path to which to write the rows that name no '
+                   'project; default: only count them')
+    p.add_argument("-l", "--log", dest="log_level", default='INFO',
+                   choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                   help="Set the logging level; default: %(default)s")
+    p.add_argument('--logfile', type=str, required=False,
+                   help='The log file to which to write logging')
+    p.add_argument('--logfile_level', type=str, required=False,
+                   default='DEBUG',
+                   help='The level of logging to write to `logfile`')
+    return p
+
+
+def main(argv=None):
+    if argv is None:
+        argv: List = sys.argv
+
+    args = return_parser().parse_args(argv[1:])
+    return_logger(__name__, args.log_level, args.logfile, args.logfile_level)
+    with open(args.projects, newline='', encoding='utf-8') as f:
+        projects: ProjectIDs = read_project_ids(csv.DictReader(f))
+    logger.info(f"{len(projects)} projects read from {args.projects}; "
+                f"{len(projects.ambiguous)} normalized names are ambiguous")
+
+    counts: Dict[str, int] = {'resolved': 0, 'unresolved': 0, 'duplicate': 0}
+    with open(args.dependencies, newline='', encoding='utf-8') as f, \
+            open(args.out, 'w', newline='', encoding='utf-8') as out:
+        rows = csv.DictReader(f)
+        fieldnames: List[str] = list(rows.fieldnames or [])
+        if RESOLVED_COLUMN not in fieldnames:
+            fieldnames.append(RESOLVED_COLUMN)
+        writer = csv.DictWriter(out, fieldnames, lineterminator='\n')
+        writer.writeheader()
+        report = None
+        if args.unresolved:
+            report_file = open(args.unresolved, 'w', newline='',
+                               encoding='utf-8')
+            report = csv.DictWriter(report_file, fieldnames,
+                                    lineterminator='\n')
+            report.writeheader()
+        try:
+            for resolved, row in resolve_rows(rows, projects, counts):
+                if resolved:
+                    writer.writerow(row)
+                elif report is not None:
+                    report.writerow(row)
+        finally:
+            if report is not None:
+                report_file.close()
+    logger.info(f"{counts['resolved']} dependencies resolved and written to "
+                f"{args.out}; {counts['duplicate']} duplicates of a version "
+                f"and project and {counts['unresolved']} naming no project "
+                "left out")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Subset the Libraries.io Open Data to Pypi straight from its `.tar.gz`,
+in place of untarring it and running `mlr` over each CSV (see
+`data/pypi_subsetting.md`).
+
+The archive is read as a stream, one member after another, so that nothing
+but the subset is written to disk: as the projects, versions and dependencies
+CSVs go by, their headers are renamed as the `mlr rename` commands rename
+them, the rows of the platform are kept, the platform columns are cut, and
+the rows are written to `pypi_projects.csv`, `pypi_versions.csv` and
+`pypi_dependencies.csv`. Every other member is skipped without being parsed.
+To decompress on another core, pipe the archive in, e.g.
+`pigz -dc Libraries.io-open-data-1.4.0.tar.gz | subset_pypi.py -`.
+
+CSVs that have already been extracted are instead filtered by a pool of
+processes, each taking a byte range of the file. Ranges must begin and end
+between records, but a newline may just as well be inside a quoted field, so
+the quotes in each range are counted first (in parallel), which tells whether
+the start of every range is inside quotes; each range then begins after the
+first newline outside quotes that follows it. Within a range, a record is
+only parsed if the platform occurs in it at all, which most of the records
+of other platforms are rejected by without parsing. The subsets of the
+ranges are written in order. This relies on quotes only occurring in quoted
+fields, doubled, as in the Open Data CSVs.
+"""
+
+from argparse import ArgumentParser
+from collections import namedtuple
+import codecs
+import csv
+import io
+import itertools as it
+import logging
+from multiprocessing import Pool
+import os
+import sys
+import tarfile
+from typing import Dict, Iterator, List, Tuple
+
+from logger import return_logger
+
+# The prefix of the name of the member, the file to write its subset to
+# (after the prefix of the platform), the columns that must equal the
+# platform, and the columns to cut
+subset = namedtuple("subset", ["prefix", "output", "filters", "cut"])
+SUBSETS: Tuple[subset, ...] = (
+    subset('projects-', 'projects.csv', ('Platform',), ('Platform',)),
+    subset('versions-', 'versions.csv', ('Platform',), ('Platform',)),
+    subset('dependencies-', 'dependencies.csv',
+           ('Platform', 'Dependency_Platform'),
+           ('Platform', 'Dependency_Platform')),
+)
+# Renames other than replacing spaces with underscores
+RENAMES: Dict[str, str] = {'Last synced Timestamp': 'Last_Synced_Timestamp'}
+QUOTE = b'"'
+BLOCK_SIZE = 2 ** 20
+logger = logging.getLogger(__name__)
+
+
+def rename(column: str) -> str:
+    """ Return the name of `column` in the subset CSVs """
+    return RENAMES.get(column, column.replace(' ', '_'))
+
+
+def subset_of(member: tarfile.TarInfo):
+    """ Return the `subset` that `member` of the archive is written to, or
+    None if it is not subsetted
+    """
+    if not member.isfile():
+        return None
+    return subset_of_name(member.name)
+
+
+def subset_of_name(path: str):
+    """ Return the `subset` that the CSV at `path` is written to, or None """
+    name = os.path.basename(path)
+    if not name.endswith('.csv'):
+        return None
+    return next((s for s in SUBSETS if name.startswith(s.prefix)), None)
+
+
+def subset_rows(rows: Iterator[List[str]], filters: Tuple[str, ...],
+                cut: Tuple[str, ...], platform: str) -> Iterator[List[str]]:
+    """ Yield the renamed header of `rows`, then each row whose `filters`
+    columns all equal `platform`, without the `cut` columns
+    Args:
+        rows (iterable): the rows of a CSV, its header first
+        filters (tuple): the (renamed) columns that must equal `platform`
+        cut (tuple): the (renamed) columns to leave out
+        platform (str): e.g. 'Pypi'
+    """
+    header: List[str] = [rename(column) for column in next(rows)]
+    filter_indices: List[int] = [header.index(column) for column in filters]
+    keep: List[int] = [i for i, column in enumerate(header)
+                       if column not in cut]
+    yield [header[i] for i in keep]
+    for row in rows:
+        if all(i < len(row) and row[i] == platform for i in filter_indices):
+            yield [row[i] for i in keep]
+
+
+def subset_member(f, out, filters, cut, platform) -> int:
+    """ Write the subset of the CSV `f` (a binary file) to the file `out`
+    Returns:
+        (int): the number of rows written, not counting the header
+    """
+    # Members of an archive read as a stream cannot be wrapped in a
+    # TextIOWrapper, which needs to know whether they are seekable
+    rows = csv.reader(codecs.iterdecode(f, 'utf-8'))
+    writer = csv.writer(out, lineterminator='\n')
+    written = -1
+    for written, row in enumerate(subset_rows(rows, filters, cut, platform)):
+        writer.writerow(row)
+    return written
+
+
+def count_quotes(path: str, start: int, end: int) -> int:
+    """ Return the number of quotes in bytes [`start`, `end`) of `path` """
+    quotes = 0
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while start < end:
+            block = f.read(min(BLOCK_SIZE, end - start))
+            if not block:
+                break
+            quotes += block.count(QUOTE)
+            start += len(block)
+    return quotes
+
+
+def end_of_record(f, offset: int, in_quotes: bool) -> int:
+    """ Return the offset just after the first newline outside quotes at or
+    after `offset` of the binary file `f`, `offset` being inside quotes if
+    `in_quotes`, or the size of `f` if there is none
+    """
+    f.seek(offset)
+    for line in f:
+        offset += len(line)
+        in_quotes ^= line.count(QUOTE) % 2 == 1
+        if not in_quotes and line.endswith(b'\n'):
+            return offset
+    return offset
+
+
+def record_boundaries(path: str, start: int, ranges: int,
+                      starmap=it.starmap) -> List[int]:
+    """ Split bytes [`start`, end of file) of the CSV at `path`, `start` being
+    between records, into about `ranges` ranges that begin and end between
+    records, counting the quotes in each with `starmap`
+    Returns:
+        (list): the offsets at which the ranges begin, then the size of `path`
+    """
+    size = os.path.getsize(path)
+    step = max(1, -(-(size - start) // ranges))
+    offsets = list(range(start, size, step))
+    quotes = list(starmap(count_quotes, [
+        (path, offset, end) for offset, end in zip(offsets, offsets[1:] + [size])
+    ]))
+    boundaries, in_quotes = [start], False
+    with open(path, 'rb') as f:
+        for offset, count in zip(offsets[1:], quotes):
+            in_quotes ^= count % 2 == 1
+            boundary = end_of_record(f, offset, in_quotes)
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+    if boundaries[-1] < size:
+        boundaries.append(size)
+    return boundaries
+
+
+def records(path: str, start: int, end: int) -> Iterator[bytes]:
+    """ Yield each record, physical lines and all, in bytes [`start`, `end`)
+    of `path`, both of which are between records
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        record, in_quotes = [], False
+        for line in f:
+            start += len(line)
+            record.append(line)
+            in_quotes ^= line.count(QUOTE) % 2 == 1
+            if not in_quotes:
+                yield b''.join(record)
+                record = []
+            if start >= end:
+                break
+        if record:
+            yield b''.join(record)
+
+
+def subset_range(path: str, filters: List[int], keep: List[int],
+                 platform: str, start: int, end: int) -> Tuple[str, int]:
+    """ Return the subset of the records in bytes [`start`, `end`) of the CSV
+    at `path`: those whose `filters` columns all equal `platform`, without
+    the columns not in `keep`
+    Returns:
+        (tuple): the subset, as CSV, and the number of rows in it
+    """
+    csv.field_size_limit(2 ** 31 - 1)
+    token = platform.encode('utf-8')
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator='\n')
+    written = 0
+    for record in records(path, start, end):
+        # Most records are rejected here, without being parsed
+        if token not in record:
+            continue
+        for row in csv.reader(io.StringIO(record.decode('utf-8'),
+                                          newline='')):
+            if all(i < len(row) and row[i] == platform for i in filters):
+                writer.writerow([row[i] for i in keep])
+                written += 1
+    return out.getvalue(), written
+
+
+def _subset_range(args) -> Tuple[str, int]:
+    return subset_range(*args)
+
+
+def subset_csv(path: str, directory: str, platform: str = 'Pypi',
+               prefix: str = 'pypi_', workers: int = None) -> Tuple[str, int]:
+    """ Write the subset of the (uncompressed) CSV at `path`, one of
+    `SUBSETS`, to `directory`, filtering byte ranges of it in a pool of
+    `workers` processes (default: one per core)
+    Returns:
+        (tuple): the name of the file written, the number of rows in it
+    """
+    s = subset_of_name(path)
+    if s is None:
+        raise ValueError(f"{path} is not one of the CSVs to subset")
+    csv.field_size_limit(2 ** 31 - 1)
+    workers = workers or os.cpu_count() or 1
+    with open(path, 'rb') as f:
+        header_end = end_of_record(f, 0, False)
+        f.seek(0)
+        header: List[str] = [rename(column) for column in next(csv.reader(
+            io.StringIO(f.read(header_end).decode('utf-8-sig'),
+                        newline='')))]
+    filters: List[int] = [header.index(column) for column in s.filters]
+    keep: List[int] = [i for i, column in enumerate(header)
+                       if column not in s.cut]
+    output = prefix + s.output
+    logger.info(f"Subsetting {path} to {output} with {workers} processes")
+    with Pool(workers) as pool, open(os.path.join(directory, output), 'w',
+                                     newline='', encoding='utf-8') as out:
+        # Several ranges per process, so that they finish at about once
+        boundaries = record_boundaries(path, header_end, workers * 4,
+                                       pool.starmap)
+        csv.writer(out, lineterminator='\n').writerow(
+            [header[i] for i in keep])
+        written = 0
+        for subset_, rows in pool.imap(_subset_range, [
+                (path, filters, keep, platform, start, end)
+                for start, end in zip(boundaries, boundaries[1:])]):
+            out.write(subset_)
+            written += rows
+    logger.info(f"{written} rows written to {output}")
+    return output, written
+
+
+def subset_archive(archive, directory: str, platform: str = 'Pypi',
+                   prefix: str = 'pypi_') -> Dict[str, int]:
+    """ Write the subset of each member of `SUBSETS` in the tar archive (read
+    as a stream, compressed or not) at the path, or in the binary file,
+    `archive` to `directory`, in a single pass over it
+    Args:
+        archive (str or file): the Open Data archive
+        directory (str): the directory in which to write the subsets
+        platform (str): the platform to subset to
+        prefix (str): the prefix of the names of the files written
+    Returns:
+        (dict): the name of each file written: the number of rows in it
+    """
+    csv.field_size_limit(2 ** 31 - 1)
+    opened = tarfile.open(archive, mode='r|*') if isinstance(archive, str) \
+        else tarfile.open(fileobj=archive, mode='r|*')
+    written: Dict[str, int] = {}
+    with opened as tar:
+        for member in tar:
+            s = subset_of(member)
+            if s is None:
+                logger.debug(f"Skipping {member.name}")
+                continue
+            output = prefix + s.output
+            logger.info(f"Subsetting {member.name} ({member.size} bytes) to "
+                        f"{output}")
+            with open(os.path.join(directory, output), 'w', newline='',
+                      encoding='utf-8') as out:
+                written[output] = subset_member(tar.extractfile(member), out,
+                                                s.filters, s.cut, platform)
+            logger.info(f"{written[output]} rows written to {output}")
+    return written
+
+
+def return_parser() -> ArgumentParser:
+    p = ArgumentParser(
+        description='Write the Pypi subset of the projects, versions and '
+        'dependencies CSVs of the Libraries.io Open Data, reading them '
+        'straight from the .tar.gz, without extracting it.')
+    p.add_argument('archive', type=str, nargs='+',
+                   help='The path to the Open Data .tar.gz, or - to read '
+                   'the archive (compressed or not) from stdin, or the paths '
+                   'to CSVs already extracted from it, to filter in parallel')
+    p.add_argument('--workers', type=int, required=False,
+                   help='The number of processes filtering each extracted '
+                   'CSV; default: one per core')
+    p.add_argument('--out', type=str, default='.',
+                   help='The directory in which to write the subset CSVs; '
+                   'default: %(default)s')
+    p.add_argument('--platform', type=str, default='Pypi',
+                   help='The platform to subset to; default: %(default)s')
+    p.add_argument("-l", "--log", dest="log_level", default='INFO',
+                   choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                   help="Set the logging level; default: %(default)s")
+    p.add_argument('--logfile', type=str, required=False,
+                   help='The log file to which to write logging')
+    p.add_argument('--logfile_level', type=str, required=False,
+                   default='DEBUG',
+                   help='The level of logging to write to `logfile`')
+    return p
+
+
+def main(argv=None):
+    if argv is None:
+        argv: List = sys.argv
+
+    args = return_parser().parse_args(argv[1:])
+    return_logger(__name__, args.log_level, args.logfile, args.logfile_level)
+    os.makedirs(args.out, exist_ok=True)
+    prefix: str = f"{args.platform.lower()}_"
+    if all(path.endswith('.csv') for path in args.archive):
+        unknown: List[str] = [path for path in args.archive
+                              if subset_of_name(path) is None]
+        if unknown:
+            logger.error(f"Not one of the CSVs to subset: {', '.join(unknown)}")
+            return 1
+        for path in args.archive:
+            subset_csv(path, args.out, args.platform, prefix, args.workers)
+        return 0
+    elif len(args.archive) > 1:
+        logger.error("Pass either one archive or one or more CSVs")
+        return 1
+
+    archive = sys.stdin.buffer if args.archive[0] == '-' else args.archive[0]
+    written: Dict[str, int] = subset_archive(archive, args.out, args.platform,
+                                             prefix)
+    missing: List[str] = [s.prefix for s in SUBSETS
+                          if prefix + s.output not in written]
+    if missing:
+        logger.error(f"No member of {args.archive[0]} starts with "
+                     f"{', '.join(missing)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,13 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Stand-ins shared by the tests """
+
+
+class FakeClock(object):
+    """ A clock that only moves when `now` is set """
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
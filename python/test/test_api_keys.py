@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+
+from hypothesis import given, strategies as st
+import pytest as pt
+
+from utils.api_keys import APIKeyPool, NoAPIKeyAvailable, APIKEY, APIKEYS
+from fakes import FakeClock
+
+
+def test_api_key_pool__no_keys_raises_ValueError():
+    with pt.raises(ValueError):
+        APIKeyPool([])
+
+
+def test_api_key_pool__from_environment_APIKEYS(monkeypatch):
+    monkeypatch.setenv(APIKEYS, 'foo, bar,baz')
+    monkeypatch.setenv(APIKEY, 'qux')
+    assert list(APIKeyPool.from_environment().keys) == ['foo', 'bar', 'baz']
+
+
+def test_api_key_pool__from_environment_APIKEY(monkeypatch):
+    monkeypatch.delenv(APIKEYS, raising=False)
+    monkeypatch.setenv(APIKEY, 'qux')
+    assert list(APIKeyPool.from_environment().keys) == ['qux']
+
+
+def test_api_key_pool__from_environment_not_set_exits_1(monkeypatch, capsys):
+    monkeypatch.delenv(APIKEYS, raising=False)
+    monkeypatch.delenv(APIKEY, raising=False)
+    with pt.raises(SystemExit):
+        APIKeyPool.from_environment()
+    _, err = capsys.readouterr()
+    assert err == f"Neither '{APIKEYS}' nor '{APIKEY}' is among environment variables!\n"
+
+
+@given(st.integers(min_value=1, max_value=10), st.integers(min_value=1, max_value=10))
+def test_api_key_pool__spreads_requests_evenly(num_keys, rounds):
+    pool = APIKeyPool([f'key{i}' for i in range(num_keys)], clock=FakeClock())
+    chosen = Counter()
+    for _ in range(num_keys * rounds):
+        api_key = pool.choose()
+        api_key.bucket.reserve()
+        chosen[api_key.key] += 1
+    assert set(chosen.values()) == {rounds}
+
+
+def test_api_key_pool__401_drops_key_for_good():
+    clock = FakeClock()
+    pool = APIKeyPool(['foo', 'bar'], clock=clock)
+    pool.report('foo', 401)
+    clock.now = 1e6
+    assert [k.key for k in pool.available()] == ['bar']
+    pool.report('bar', 401)
+    with pt.raises(NoAPIKeyAvailable):
+        pool.choose()
+
+
+def test_api_key_pool__429_routes_around_key():
+    clock = FakeClock()
+    pool = APIKeyPool(['foo', 'bar'], period=60, clock=clock)
+    pool.report('foo', 429, {'Retry-After': '30'})
+    assert pool.choose().key == 'bar'
+    clock.now = 29.
+    assert pool.choose().key == 'bar'
+    clock.now = 31.
+    assert pool.choose().key == 'foo'
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+from urllib.parse import parse_qs, urlparse
+
+import pytest as pt
+from requests import Session
+import responses
+
+from utils.api_keys import APIKeyPool, NoAPIKeyAvailable
+from utils.async_fetch import fetch_contributors, iterate_async
+from utils.libraries_io_project_contributors_endpoint import URL
+
+
+@pt.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+def fetch_all(project_names, loop, concurrency=4):
+    keys = APIKeyPool(['foo'], calls=1000, period=1)
+    with Session() as s:
+        return list(iterate_async(
+            fetch_contributors(s, project_names, keys, concurrency), loop))
+
+
+@responses.activate
+def test_fetch_contributors__one_page_per_project(loop):
+    names = [f'project{i}' for i in range(10)]
+    for name in names:
+        responses.add(responses.GET, URL % name, status=200, json=[])
+    results = fetch_all(names, loop)
+    assert sorted((name, page) for name, page, _ in results) == \
+        [(name, 1) for name in sorted(names)]
+    assert all(r.status_code == 200 for _, _, r in results)
+
+
+def paginated(num_pages, last_link=True):
+    """ Return a `responses` callback serving `num_pages` pages of a project,
+    each linking to the next and, if `last_link`, to the last
+    """
+    def callback(request):
+        page = int(parse_qs(urlparse(request.url).query)['page'][0])
+        url = request.url.split('?')[0]
+        links = []
+        if page < num_pages:
+            links.append(f'<{url}?page={page + 1}&per_page=100>; rel="next"')
+            if last_link:
+                links.append(f'<{url}?page={num_pages}&per_page=100>; rel="last"')
+        return 200, {'Link': ', '.join(links)} if links else {}, '[]'
+    return callback
+
+
+@responses.activate
+def test_fetch_contributors__follows_next_link(loop):
+    responses.add_callback(responses.GET, URL % 'foobar',
+                           callback=paginated(3, last_link=False))
+    results = fetch_all(['foobar'], loop)
+    assert [(name, page) for name, page, _ in results] == \
+        [('foobar', 1), ('foobar', 2), ('foobar', 3)]
+
+
+@responses.activate
+def test_fetch_contributors__fans_out_to_last_page(loop):
+    responses.add_callback(responses.GET, URL % 'foobar',
+                           callback=paginated(25))
+    responses.add(responses.GET, URL % 'baz', status=200, json=[])
+    results = fetch_all(['foobar', 'baz'], loop)
+    assert sorted((name, page) for name, page, _ in results) == \
+        [('baz', 1)] + [('foobar', page) for page in range(1, 26)]
+    assert len(responses.calls) == 26
+
+
+@responses.activate
+def test_fetch_contributors__exception_takes_place_of_response(loop):
+    responses.add(responses.GET, URL % 'foobar', body=ConnectionError('...'))
+    results = fetch_all(['foobar'], loop)
+    assert len(results) == 1
+    assert isinstance(results[0][2], Exception)
+
+
+def test_fetch_contributors__no_projects(loop):
+    assert fetch_all([], loop) == []
+
+
+@responses.activate
+def test_fetch_contributors__raises_when_every_key_is_rejected(loop):
+    names = [f'project{i}' for i in range(10)]
+    for name in names:
+        responses.add(responses.GET, URL % name, status=401)
+    with pt.raises(NoAPIKeyAvailable):
+        fetch_all(names, loop)
+
+
+@responses.activate
+def test_fetch_contributors__throttled_page_is_sent_again(loop):
+    responses.add(responses.GET, URL % 'foobar', status=429,
+                  headers={'Retry-After': '0'})
+    responses.add(responses.GET, URL % 'foobar', status=200, json=[])
+    results = fetch_all(['foobar'], loop)
+    assert [(name, page, r.status_code) for name, page, r in results] == \
+        [('foobar', 1, 200)]
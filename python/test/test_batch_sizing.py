@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest as pt
+
+from utils.batch_sizing import BatchSizer, TooManyFailures
+
+
+def test_batch_sizer__fixed_size_without_target():
+    sizer = BatchSizer(10)
+    batches = list(sizer.batches(range(25)))
+    for batch in batches:
+        sizer.record(len(batch), 100.0)
+    assert [len(batch) for batch in batches] == [10, 10, 5]
+    assert sizer.size == 10
+
+
+def test_batch_sizer__grows_toward_target_at_most_doubling():
+    sizer = BatchSizer(100, target_seconds=1.0)
+    sizer.record(100, 0.01)  # 10,000 rows/s
+    assert sizer.size == 200
+    for _ in range(20):
+        sizer.record(sizer.size, sizer.size / 10000)
+    assert 9000 <= sizer.size <= 10000
+
+
+def test_batch_sizer__shrinks_toward_target_at_most_halving():
+    sizer = BatchSizer(1000, target_seconds=1.0, smoothing=1.0)
+    sizer.record(1000, 100.0)
+    assert sizer.size == 500
+
+
+def test_batch_sizer__ignores_partial_batches_and_bounds():
+    sizer = BatchSizer(100, target_seconds=1.0, maximum=150)
+    sizer.record(10, 0.001)
+    assert sizer.size == 100
+    sizer.record(100, 0.001)
+    assert sizer.size == 150
+
+
+def test_batch_sizer__failed_batch_is_handed_out_again_at_half_size():
+    sizer = BatchSizer(10, target_seconds=1.0)
+    batches = sizer.batches(range(30))
+    first = next(batches)
+    sizer.failed(first)
+    assert sizer.size == 5
+    rest = list(batches)
+    assert rest[:2] == [first[:5], first[5:]]
+    assert sorted(row for batch in rest for row in batch) == list(range(30))
+
+
+def test_batch_sizer__raises_after_too_many_failures_in_a_row():
+    sizer = BatchSizer(8, max_failures=2)
+    sizer.failed()
+    sizer.record(8, 1.0)
+    sizer.failed()
+    sizer.failed()
+    assert sizer.size == 8
+    with pt.raises(TooManyFailures):
+        sizer.failed()
+
+
+def test_batch_sizer__settled_is_median_of_recent_sizes():
+    sizer = BatchSizer(10, history=3)
+    assert sizer.settled == 10
+    for rows in (1, 50, 40, 30):
+        sizer.record(rows, 1.0)
+    assert sizer.settled == 40
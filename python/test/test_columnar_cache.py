@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import csv
+import os
+
+import pytest as pt
+
+from columnar_cache import ColumnarTable, is_fresh, load, main, NULL
+
+DEPENDENCIES = [['ID', 'Project_Name', 'Version_ID', 'Dependency_Name',
+                 'Dependency_Kind', 'Optional_Dependency'],
+                ['1', 'foo', '10', 'bär', 'runtime', 'false'],
+                ['2', 'foo', '', 'baz\n"quoted"', 'test', 'true'],
+                ['3', 'bar', 'x', '', '', ''],
+                ['4', 'bar', '12', 'foo', 'runtime']]
+
+
+@pt.fixture(scope="function")
+def dependencies(tmpdir):
+    path = str(tmpdir.join('pypi_dependencies.csv'))
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerows(DEPENDENCIES)
+    return path
+
+
+def test_load__typed_columns(tmpdir, dependencies):
+    with load(dependencies, str(tmpdir.join('cache'))) as table:
+        assert len(table) == 4
+        assert list(table['ID']) == [1, 2, 3, 4]
+        assert table['ID'].format == 'q'
+        assert list(table['Version_ID']) == [10, NULL, NULL, 12]
+        assert list(table['Dependency_Name']) == \
+            ['bär', 'baz\n"quoted"', '', 'foo']
+        assert table['Dependency_Name'][-1] == 'foo'
+        assert list(table['Dependency_Kind']) == \
+            ['runtime', 'test', None, 'runtime']
+        assert table['Dependency_Kind'].categories == ['runtime', 'test']
+        assert list(table['Optional_Dependency']) == [0, 1, -1, -1]
+        assert list(table.rows('ID', 'Project_Name'))[:2] == \
+            [(1, 'foo'), (2, 'foo')]
+
+
+def test_load__only_maps_columns_asked_for(tmpdir, dependencies):
+    with load(dependencies, str(tmpdir.join('cache'))) as table:
+        table['ID']
+        assert len(table._maps) == 1
+
+
+def test_load__reuses_fresh_cache_and_converts_changed_csv(tmpdir,
+                                                           dependencies):
+    cache = str(tmpdir.join('cache'))
+    load(dependencies, cache).close()
+    directory = os.path.join(cache, 'pypi_dependencies')
+    assert is_fresh(dependencies, directory)
+    with open(dependencies, 'a', newline='') as f:
+        csv.writer(f).writerow(['5', 'baz', '13', 'foo', 'runtime', 'false'])
+    assert not is_fresh(dependencies, directory)
+    with load(dependencies, cache) as table:
+        assert len(table) == 5 and table['ID'][4] == 5
+
+
+def test_main__converts_empty_csv(tmpdir):
+    path = str(tmpdir.join('pypi_versions.csv'))
+    with open(path, 'w') as f:
+        f.write('ID,Number\n')
+    cache = str(tmpdir.join('cache'))
+    assert main([__name__, path, '--cache', cache]) == 0
+    with ColumnarTable(os.path.join(cache, 'pypi_versions')) as table:
+        assert len(table) == 0 and list(table['Number']) == []
+        assert list(table['ID']) == []
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+import pytest as pt
+
+from utils.contributor_codec import decode_contributors, encode_compact, \
+    encoder, FIELDS
+from utils.create_sqlite_db import main as create_sqlite_db
+from utils.libraries_io_project_contributors_endpoint import content_and_error
+from utils.sqlite_writer import ContributorsWriter, page_record
+from utils.utils import connect
+
+CONTRIBUTORS = [{'uuid': str(i), 'name': f'name{i}', 'github_id': str(i),
+                 'login': f'login{i}', 'host_type': 'GitHub',
+                 'email': None, 'company': 'ACME', 'location': 'Earth',
+                 'bio': 'x' * 100, 'blog': 'https://example.com',
+                 'created_at': '2020-01-01T00:00:00.000Z'}
+                for i in range(100)]
+
+
+def test_encode_compact__keeps_only_fields_read_downstream():
+    content = json.dumps(CONTRIBUTORS).encode('utf-8')
+    compact = encode_compact(content)
+    assert len(compact) < len(content) / 10
+    assert decode_contributors(compact) == \
+        [{field: c[field] for field in FIELDS} for c in CONTRIBUTORS]
+
+
+def test_decode_contributors__reads_raw_pages():
+    content = json.dumps(CONTRIBUTORS).encode('utf-8')
+    assert decode_contributors(content) == CONTRIBUTORS
+    assert decode_contributors(memoryview(content)) == CONTRIBUTORS
+
+
+def test_encode_compact__content_that_is_not_contributors_is_kept():
+    assert encode_compact(b'{"error": "not found"}') == \
+        b'{"error": "not found"}'
+    assert encode_compact(b'not json') == b'not json'
+
+
+def test_encoder__unknown_storage():
+    assert encoder('raw') is None
+    with pt.raises(ValueError):
+        encoder('xml')
+
+
+def test_contributors_writer__stores_compact_pages():
+    create_sqlite_db([__name__, 'test_codec.db'])
+    conn = connect('test_codec.db')
+    content = json.dumps(CONTRIBUTORS).encode('utf-8')
+    with ContributorsWriter(conn, encode=encoder('compact')) as writer:
+        writer.write(page_record('foo', 1, content_and_error(content, None)))
+    blob, = conn.execute("select contributors from project_names").fetchone()
+    conn.close()
+    os.remove('test_codec.db')
+    assert [c['uuid'] for c in decode_contributors(blob)] == \
+        [c['uuid'] for c in CONTRIBUTORS]
@@ -45,3 +45,18 @@ def test_main_sqlite_table():
         tables = cur.fetchall()
     assert 'project_names' in [row[0] for row in tables]
     os.remove(argv[1])
+
+
+def test_main_normalized_tables(capsys):
+    argv = [__name__, 'test.db', '--normalized']
+    return_value = main(argv)
+    _, err = capsys.readouterr()
+    query = """SELECT name FROM sqlite_master WHERE type in ('table', 'index')"""
+    with connect(argv[1]) as conn:
+        names = [row[0] for row in conn.execute(query)]
+    os.remove(argv[1])
+    assert return_value == 0
+    assert err == "Normalized tables created successfully\n" \
+        "Table created successfully\n"
+    assert {'project_names', 'contributors', 'project_contributors',
+            'project_contributors_uuid'} <= set(names)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+
+import pytest as pt
+from requests import get, Session
+import responses
+
+import request_libraries_io_load_sqlite
+from request_libraries_io_load_sqlite import request_with_session, store_pages
+from utils.api_keys import APIKeyPool
+from utils.create_sqlite_db import main as create_sqlite_db
+from utils.http_cache import response_validators, ValidatorCache
+from utils.libraries_io_project_contributors_endpoint import \
+    content_and_error, URL
+from utils.sqlite_writer import ContributorsWriter, page_record
+from utils.utils import connect
+
+
+@pt.fixture(scope="function")
+def project_names_db(monkeypatch):
+    # The script's logger is only set up by its `main`
+    monkeypatch.setattr(request_libraries_io_load_sqlite, 'logger',
+                        logging.getLogger(__name__), raising=False)
+    create_sqlite_db([__name__, 'test_cache.db'])
+    conn = connect('test_cache.db')
+    yield conn
+    conn.close()
+    os.remove('test_cache.db')
+
+
+def not_modified_unless_changed(etag):
+    """ Return a `responses` callback that answers 304 to requests that send
+    `etag` in `If-None-Match` and 200, with `etag`, to any other
+    """
+    def callback(request):
+        if request.headers.get('If-None-Match', None) == etag:
+            return 304, {'ETag': etag}, ''
+        return 200, {'ETag': etag}, '[]'
+    return callback
+
+
+def fetch_and_store(conn, validators, project_name='foobar'):
+    keys = APIKeyPool(['foo'], calls=1000, period=1)
+    with Session() as s, \
+            ContributorsWriter(conn, validators=validators) as writer:
+        store_pages(request_with_session(s, keys, project_name,
+                                         validators=validators), writer)
+    return writer
+
+
+@responses.activate
+def test_validator_cache__second_fetch_is_conditional(project_names_db):
+    responses.add_callback(responses.GET, URL % 'foobar',
+                           callback=not_modified_unless_changed('"v1"'))
+    validators = ValidatorCache(project_names_db).create()
+    first = fetch_and_store(project_names_db, validators)
+    assert (first.written, first.unchanged) == (1, 0)
+    assert validators.conditional_headers('foobar', 1) == \
+        {'If-None-Match': '"v1"'}
+
+    second = fetch_and_store(project_names_db, validators)
+    assert (second.written, second.unchanged) == (0, 1)
+    assert responses.calls[1].request.headers['If-None-Match'] == '"v1"'
+
+
+def test_validator_cache__failed_page_clears_validators(project_names_db):
+    validators = ValidatorCache(project_names_db).create()
+    with ContributorsWriter(project_names_db, validators=validators) as writer:
+        writer.write(page_record('foo', 1, content_and_error(b'[]', None)),
+                     ('"v1"', 'Mon, 01 Jun 2020 00:00:00 GMT'))
+    assert validators.conditional_headers('foo', 1) == \
+        {'If-None-Match': '"v1"',
+         'If-Modified-Since': 'Mon, 01 Jun 2020 00:00:00 GMT'}
+    with ContributorsWriter(project_names_db, validators=validators) as writer:
+        writer.write(page_record('foo', 1, content_and_error(None, '{}')))
+    assert validators.conditional_headers('foo', 1) == {}
+
+
+@responses.activate
+def test_validator_cache__304_without_page_count_uses_stored_pages(project_names_db):
+    validators = ValidatorCache(project_names_db).create()
+    with ContributorsWriter(project_names_db, validators=validators) as writer:
+        for page in (1, 2, 3):
+            writer.write(page_record('foo', page,
+                                     content_and_error(b'[]', None)),
+                         ('"v1"', None))
+    responses.add(responses.GET, URL % 'foo', status=304)
+    responses.add(responses.GET, URL % 'bar', status=304)
+    assert validators.count_pages(get(URL % 'foo'), 'foo') == 3
+    assert validators.count_pages(get(URL % 'bar'), 'bar') == 1
+
+
+@responses.activate
+def test_response_validators__only_of_successful_responses():
+    responses.add(responses.GET, URL % 'foo', status=200,
+                  headers={'ETag': '"v1"'})
+    responses.add(responses.GET, URL % 'bar', status=500,
+                  headers={'ETag': '"v1"'})
+    assert response_validators(get(URL % 'foo')) == ('"v1"', None)
+    assert response_validators(get(URL % 'bar')) == (None, None)
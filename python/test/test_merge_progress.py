@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest as pt
+
+from utils.create_sqlite_db import main as create_sqlite_db
+from utils.merge_progress import MergeProgress
+from utils.utils import connect
+from fakes import FakeClock
+
+
+@pt.fixture(scope="function")
+def conn(tmpdir):
+    db = str(tmpdir.join('test_merge_progress.db'))
+    create_sqlite_db([__name__, db])
+    conn = connect(db)
+    write_pages(conn, [('bar', 1, '2019-01-01 00:00:00'),
+                       ('foo', 1, '2019-01-01 00:00:00'),
+                       ('foo', 2, '2019-01-01 00:00:00')])
+    conn.execute("insert into project_names(project_name, page) "
+                 "values ('baz', 1)")
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+@pt.fixture(scope="function")
+def progress(conn):
+    return MergeProgress(conn, clock=FakeClock()).create()
+
+
+def write_pages(conn, pages, succeeded=1):
+    conn.executemany(
+        """insert or replace into project_names(project_name, page,
+        api_has_been_queried, api_query_succeeded, contributors, ts)
+        values (?, ?, 1, ?, '[]', ?)""",
+        ((name, page, succeeded, ts) for name, page, ts in pages))
+    conn.commit()
+
+
+def test_merge_progress__starts_with_every_project_fetched(progress):
+    assert progress.pending() == {'bar', 'foo'} and len(progress) == 0
+
+
+def test_merge_progress__committed_projects_are_not_pending(progress):
+    progress.pending()
+    assert progress.commit({'bar': 3}) == 1
+    assert progress.commit({}) == 0
+    assert progress.pending() == {'foo'} and len(progress) == 1
+
+
+def test_merge_progress__projects_fetched_after_a_run_are_pending(progress):
+    progress.pending()
+    progress.commit({'bar': 3, 'foo': 2})
+    assert progress.pending() == set()
+    # As if the first run had read the pages in March
+    progress.conn.execute("update merge_progress set read_at = "
+                          "'2019-03-01 00:00:00'")
+    # 'baz' sorts below 'foo', the last project MERGEd, and 'foo' is fetched
+    # again after it was read
+    write_pages(progress.conn, [('baz', 1, '2019-06-01 00:00:00'),
+                                ('foo', 2, '2019-06-01 00:00:00')])
+    assert progress.pending() == {'baz', 'foo'}
+    progress.commit({'baz': 1, 'foo': 2})
+    assert progress.pending() == set()
+
+
+def test_merge_progress__failed_pages_are_not_pending(progress):
+    write_pages(progress.conn, [('baz', 1, '2999-01-01 00:00:00')],
+                succeeded=0)
+    assert 'baz' not in progress.pending()
+
+
+def test_merge_progress__is_kept_per_scope(conn):
+    progress = MergeProgress(conn).create()
+    progress.pending()
+    progress.commit({'bar': 3, 'foo': 2})
+    other = MergeProgress(conn, scope='merged_contributors=-1')
+    assert other.pending() == {'bar', 'foo'} and len(other) == 0
+    other.restart()
+    assert len(progress) == 2
+
+
+def test_merge_progress__commit_again_replaces_count(progress):
+    progress.commit({'foo': 2})
+    progress.commit({'foo': 5})
+    assert progress.conn.execute(
+        "select project_name, contributors from merge_progress"
+    ).fetchall() == [('foo', 5)]
+
+
+def test_merge_progress__restart_forgets_progress(progress):
+    progress.pending()
+    progress.commit({'foo': 2})
+    progress.restart()
+    assert progress.pending() == {'bar', 'foo'} and len(progress) == 0
+
+
+def test_merge_progress__migrates_unscoped_progress(conn):
+    conn.execute("""create table merge_progress (project_name text primary key,
+        contributors integer not null, merged_at real not null) without rowid""")
+    # 2019-01-01 00:00:00 UTC, when the pages of 'bar' were written
+    conn.execute("insert into merge_progress values ('bar', 3, 1546300800)")
+    conn.commit()
+    progress = MergeProgress(conn).create()
+    assert len(progress) == 1 and progress.pending() == {'bar', 'foo'}
+    write_pages(conn, [('bar', 1, '2018-12-31 00:00:00')])
+    assert progress.pending() == {'foo'}
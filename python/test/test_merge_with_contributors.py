@@ -70,3 +70,84 @@ def test_execute_cypher_match_statement_non_empty_graph(G, statement):
 @given(st.just("MATCH (p:Project) return p;"))
 def test_return_Node_from_Cursor_empty_graph(G, statement):
     assert 0
+
+
+class FakeTransaction(object):
+    def __init__(self, statements):
+        self.statements = statements
+
+    def run(self, statement, **kw):
+        self.statements.append((statement, kw))
+
+    def commit(self):
+        self.statements.append(('COMMIT', {}))
+
+    def rollback(self):
+        self.statements.append(('ROLLBACK', {}))
+
+
+class FakeGraph(object):
+    def __init__(self):
+        self.statements = []
+
+    def begin(self, autocommit=False):
+        return FakeTransaction(self.statements)
+
+
+def test_merge_batch_unwind_sends_two_statements_per_batch():
+    g = FakeGraph()
+    foo = project(1, 'foo')
+    batch = tuple((foo, to_contributor({'uuid': str(i), 'name': 'x'}))
+                  for i in range(100))
+    projects, merged = defaultdict(int), set()
+    merge_batch_unwind(g, batch, projects, merged)
+    assert [statement for statement, _ in g.statements] == \
+        [MERGE_CONTRIBUTORS_UNWIND, MERGE_CONTRIBUTES_TO_UNWIND, 'COMMIT']
+    assert len(g.statements[0][1]['rows']) == 100
+    assert g.statements[1][1]['rows'][0] == {'project_id': 1, 'uuid': 0}
+    assert projects[foo] == 100 and merged == set(range(100))
+
+
+def test_merge_batch_unwind_rolls_back_a_transaction_that_raised():
+    class DeadlockedTransaction(FakeTransaction):
+        def run(self, statement, **kw):
+            raise TransientError("deadlock")
+
+    g = FakeGraph()
+    g.begin = lambda autocommit=False: DeadlockedTransaction(g.statements)
+    batch = ((project(1, 'foo'), to_contributor({'uuid': '1'})),)
+    projects, merged = defaultdict(int), set()
+    with pt.raises(TransientError):
+        merge_batch_unwind(g, batch, projects, merged)
+    assert g.statements == [('ROLLBACK', {})]
+    assert not projects and not merged
+
+
+def test_merge_batch_unwind_merges_each_contributor_once_per_run():
+    g = FakeGraph()
+    shared = to_contributor({'uuid': '1', 'name': 'shared'})
+    batch = tuple((project(i, f'project{i}'), shared) for i in range(10))
+    projects, merged = defaultdict(int), set()
+    merge_batch_unwind(g, batch, projects, merged)
+    merge_batch_unwind(g, batch, projects, merged)
+    contributor_rows = [kw['rows'] for statement, kw in g.statements
+                        if statement == MERGE_CONTRIBUTORS_UNWIND]
+    assert contributor_rows == [[shared._asdict()]]
+    assert all(count == 2 for count in projects.values())
+
+
+def test_checkpoint_records_every_project_but_the_last_of_the_batch():
+    from utils.merge_progress import MergeProgress
+    from utils.utils import connect
+    g, progress = FakeGraph(), MergeProgress(connect(':memory:')).create()
+    foo, bar = project(1, 'foo'), project(2, 'bar')
+    projects = defaultdict(int, {bar: 3, foo: 1})
+    merged = "select project_name from merge_progress order by project_name"
+    assert checkpoint(g, progress, projects, foo) == 1
+    assert progress.conn.execute(merged).fetchall() == [('bar',)]
+    assert dict(projects) == {foo: 1} and g.statements == []
+    assert checkpoint(g, progress, projects, None, set_property=True) == 1
+    assert progress.conn.execute(merged).fetchall() == [('bar',), ('foo',)]
+    assert not projects
+    assert g.statements[0] == (SET_MERGED_CONTRIBUTORS_UNWIND,
+                               {'rows': [{'project_id': 1, 'count': 1}]})
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+import pytest as pt
+
+from utils.batch_sizing import BatchSizer
+from utils.parallel_merge import bucket, diagonals, GridWriter, partition
+
+ROWS = [(project, contributor) for project in range(50)
+        for contributor in range(0, 200, 7)]
+
+
+def keys(row):
+    return row
+
+
+@pt.mark.parametrize("partitions", [1, 2, 3, 8])
+def test_diagonals__cells_of_a_diagonal_are_node_disjoint(partitions):
+    cells = partition(ROWS, keys, partitions)
+    written = []
+    for diagonal in diagonals(cells, partitions):
+        projects = [{bucket(p, partitions) for p, _ in cell} for cell in diagonal]
+        contributors = [{bucket(c, partitions) for _, c in cell}
+                        for cell in diagonal]
+        assert all(len(buckets) == 1 for buckets in projects + contributors)
+        assert len(set.union(*projects)) == len(diagonal)
+        assert len(set.union(*contributors)) == len(diagonal)
+        written.extend(row for cell in diagonal for row in cell)
+    assert sorted(written) == sorted(ROWS)
+
+
+def test_grid_writer__writes_every_row_once_in_parallel():
+    lock = threading.Lock()
+    written, in_flight, overlaps = [], set(), []
+
+    def write(rows):
+        nodes = {('p', p) for p, _ in rows} | {('c', c) for _, c in rows}
+        with lock:
+            if nodes & in_flight:
+                overlaps.append(nodes & in_flight)
+            in_flight.update(nodes)
+        time.sleep(0.001)
+        with lock:
+            in_flight.difference_update(nodes)
+            written.extend(rows)
+
+    writer = GridWriter(write, keys, workers=4, batch_size=10)
+    assert writer.run(ROWS) == len(ROWS)
+    assert sorted(written) == sorted(ROWS)
+    assert not overlaps
+
+
+def test_grid_writer__retries_transient_errors():
+    failures = [2]
+
+    class Deadlock(Exception):
+        pass
+
+    def write(rows):
+        if failures[0]:
+            failures[0] -= 1
+            raise Deadlock()
+
+    writer = GridWriter(write, keys, workers=2, batch_size=1000,
+                        transient=(Deadlock,), sleep=lambda s: None)
+    assert writer.run(ROWS) == len(ROWS)
+    assert writer.retried == 2
+
+
+def test_grid_writer__retries_other_writes_alike():
+    class Deadlock(Exception):
+        pass
+
+    attempts = []
+
+    def merge_nodes(rows):
+        attempts.append(rows)
+        if len(attempts) == 1:
+            raise Deadlock()
+
+    writer = GridWriter(lambda rows: None, keys, transient=(Deadlock,),
+                        sleep=lambda s: None)
+    writer.write_with_retries([1, 2], merge_nodes)
+    assert attempts == [[1, 2], [1, 2]] and writer.retried == 1
+
+
+def test_grid_writer__gives_up_after_retries():
+    def write(rows):
+        raise ValueError()
+
+    writer = GridWriter(write, keys, workers=2, retries=1,
+                        transient=(ValueError,), sleep=lambda s: None)
+    with pt.raises(ValueError):
+        writer.run(ROWS)
+
+
+def test_grid_writer__sizes_transactions_with_sizer():
+    sizer = BatchSizer(4, target_seconds=1.0)
+    clock = iter(range(1000)).__next__  # each transaction takes 1s
+    sizes = []
+    writer = GridWriter(lambda rows: sizes.append(len(rows)), keys, workers=1,
+                        sizer=sizer, clock=clock)
+    assert writer.run([(0, c) for c in range(20)]) == 20
+    assert sizes[0] == 4 and sum(sizes) == 20
+    assert sizer.size == 4
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+
+import pytest as pt
+
+from utils.progress import format_seconds, percentile, ProgressReporter
+from fakes import FakeClock
+
+
+@pt.fixture(scope="function")
+def reporter():
+    clock = FakeClock()
+    logger = logging.getLogger('test_progress')
+    return ProgressReporter(logger, 'rows', interval=60, total=10,
+                            total_of='projects', clock=clock)
+
+
+def test_percentile__nearest_rank():
+    values = list(range(1, 101))
+    assert [percentile(values, q) for q in (0, 50, 90, 99, 100)] == \
+        [1, 50, 90, 99, 100]
+    assert percentile([], 50) is None
+
+
+def test_format_seconds():
+    assert format_seconds(59.9) == '0m59s'
+    assert format_seconds(3723) == '1h02m03s'
+
+
+def test_progress_reporter__reports_at_most_once_per_interval(reporter, caplog):
+    with caplog.at_level(logging.INFO, logger='test_progress'):
+        for _ in range(100):
+            reporter.clock.now += 1
+            reporter.update(10, seconds=0.5, projects=0)
+    assert len(caplog.records) == 1
+    assert caplog.records[0].getMessage().startswith(
+        "600 rows, 0 projects so far; 10.0 rows/s in the last 60s")
+
+
+def test_progress_reporter__summary(reporter):
+    reporter.context = lambda: "batch size 4"
+    reporter.clock.now = 10
+    reporter.update(100, seconds=1.0, projects=2)
+    reporter.update(100, seconds=3.0, errors=1, projects=3)
+    assert reporter.summary() == (
+        "200 rows, 5 projects so far; 20.0 rows/s in the last 10s; ETA "
+        "0m10s; batch latency p50/p90/p99 1.00/3.00/3.00s; 1 errors; "
+        "batch size 4")
+
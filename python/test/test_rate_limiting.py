@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+from hypothesis import given, strategies as st
+import pytest as pt
+
+from utils.rate_limiting import parse_seconds, RateGovernor, TokenBucket
+from fakes import FakeClock
+
+
+def test_token_bucket__invalid_rate_raises_ValueError():
+    with pt.raises(ValueError):
+        TokenBucket(calls=0, period=60)
+
+
+def test_token_bucket__first_token_is_free():
+    bucket = TokenBucket(calls=60, period=60, clock=FakeClock())
+    assert bucket.reserve() == 0.
+
+
+@given(st.integers(min_value=1, max_value=100))
+def test_token_bucket__reservations_are_spaced_by_the_rate(n):
+    bucket = TokenBucket(calls=60, period=60, clock=FakeClock())
+    delays = [bucket.reserve() for _ in range(n + 1)]
+    assert delays == pt.approx([float(i) for i in range(n + 1)])
+
+
+def test_token_bucket__refills_while_idle_up_to_capacity():
+    clock = FakeClock()
+    bucket = TokenBucket(calls=60, period=60, capacity=5, clock=clock)
+    for _ in range(5):
+        assert bucket.reserve() == 0.
+    clock.now = 1000.
+    assert bucket.headroom() == 5.
+
+
+def test_token_bucket__acquire_waits_for_token():
+    bucket = TokenBucket(calls=100, period=1)
+
+    async def acquire_3():
+        return await asyncio.gather(*(bucket.acquire() for _ in range(3)))
+
+    loop = asyncio.new_event_loop()
+    delays = loop.run_until_complete(acquire_3())
+    loop.close()
+    assert delays[0] == 0.
+    assert delays[2] > delays[1] > 0.
+
+
+@given(st.floats(min_value=0, max_value=1e6))
+def test_parse_seconds__delta(seconds):
+    assert parse_seconds(str(seconds), now=2e9) == pt.approx(seconds)
+
+
+def test_parse_seconds__unix_timestamp():
+    assert parse_seconds('2000000030', now=2e9) == 30.
+
+
+def test_parse_seconds__http_date():
+    assert parse_seconds('Wed, 18 May 2033 03:33:50 GMT', now=2e9) == 30.
+
+
+def test_parse_seconds__unparseable():
+    assert parse_seconds('soon') is None
+    assert parse_seconds(None) is None
+
+
+def test_rate_governor__retry_after_pauses():
+    clock = FakeClock()
+    governor = RateGovernor(calls=60, period=60, clock=clock)
+    governor.observe(429, {'Retry-After': '30'})
+    assert governor.reserve() == pt.approx(30.)
+    assert governor.waited == pt.approx(30.)
+
+
+def test_rate_governor__429_without_headers_halves_rate_then_recovers():
+    clock = FakeClock()
+    governor = RateGovernor(calls=60, period=60, clock=clock)
+    governor.observe(429, {})
+    assert governor.rate == pt.approx(.5)
+    assert governor.reserve() == pt.approx(60.)
+    for _ in range(30):
+        governor.observe(200, {})
+    assert governor.rate == pt.approx(1.)
+
+
+def test_rate_governor__spreads_remaining_until_reset():
+    clock = FakeClock()
+    governor = RateGovernor(calls=60, period=60, clock=clock)
+    governor.observe(200, {'X-RateLimit-Limit': '60',
+                           'X-RateLimit-Remaining': '50',
+                           'X-RateLimit-Reset': '10'})
+    assert governor.rate == pt.approx(5.)
+
+
+def test_rate_governor__none_remaining_pauses_until_reset():
+    clock = FakeClock()
+    governor = RateGovernor(calls=60, period=60, clock=clock)
+    governor.observe(200, {'X-RateLimit-Limit': '120',
+                           'X-RateLimit-Remaining': '0',
+                           'X-RateLimit-Reset': '20'})
+    assert governor.rate == pt.approx(2.)
+    assert governor.reserve() == pt.approx(20.)
@@ -4,6 +4,7 @@
 
 from itertools import chain
 from string import ascii_letters, digits, printable
+import logging
 import os
 import sys
 import types
@@ -12,6 +13,7 @@ from hypothesis import assume, given, strategies as st
 from hypothesis.provisional import urls
 import pytest as pt
 from requests import get, Request, Session
+from requests.exceptions import ConnectionError, InvalidURL, Timeout
 import responses
 
 from request_libraries_io_load_sqlite import *
@@ -302,3 +304,268 @@ def test_request_with_session__multiple_pages_assert_last_page(pn):
         resp = get(url)
         last_page = resp.links.get('last', None)
         assert last_page['url'] == f'https://libraries.io/api/Pypi/{pn}/contributors?page=3&per_page=100'
+
+
+@responses.activate
+@given(valid_project_name(), st.integers(min_value=2, max_value=10000))
+def test_count_pages__from_last_link(pn, last):
+    url = '?'.join((URL % pn, 'page=1&per_page=100'))
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+        rsps.add(responses.GET,
+                 url,
+                 headers={'Link': f'<https://libraries.io/api/Pypi/{pn}/contributors?page={last}&per_page=100>; rel="last", <https://libraries.io/api/Pypi/{pn}/contributors?page=2&per_page=100>; rel="next"'},
+                 status=200)
+        resp = get(url)
+        assert count_pages(resp) == last
+
+
+@responses.activate
+@given(valid_project_name(), st.integers(min_value=0, max_value=100000))
+def test_count_pages__from_total_header(pn, total):
+    url = '?'.join((URL % pn, 'page=1&per_page=100'))
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+        rsps.add(responses.GET, url, headers={'Total': str(total)}, status=200)
+        resp = get(url)
+        assert count_pages(resp) == max(1, -(-total // 100))
+
+
+@responses.activate
+@given(valid_project_name())
+def test_count_pages__single_page(pn):
+    url = '?'.join((URL % pn, 'page=1&per_page=100'))
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+        rsps.add(responses.GET, url, status=200, json=[])
+        resp = get(url)
+        assert count_pages(resp) == 1
+
+
+@responses.activate
+@pt.mark.parametrize("status, kind", [(200, None), (404, PERMANENT),
+                                      (429, THROTTLED), (500, TRANSIENT),
+                                      (503, TRANSIENT)])
+def test_classify_failure__by_status_code(status, kind):
+    responses.add(responses.GET, URL % 'foobar', status=status)
+    resp = get(URL % 'foobar')
+    assert classify_failure(resp) == kind
+    assert response_status(resp) == str(status)
+
+
+@pt.mark.parametrize("exception, kind", [(Timeout(), TRANSIENT),
+                                         (ConnectionError(), TRANSIENT),
+                                         (InvalidURL(), PERMANENT)])
+def test_classify_failure__exceptions(exception, kind):
+    assert classify_failure(exception) == kind
+    assert response_status(exception) == type(exception).__name__
+
+
+def test_store_pages__records_most_severe_failure_per_project():
+    class Writer(object):
+        written = 0
+
+        def write(self, record, validators=None):
+            pass
+
+        def flush(self):
+            pass
+
+    failures = {}
+    pages = [fetched_page('foo', 1, Timeout()),
+             fetched_page('foo', 2, InvalidURL()),
+             fetched_page('bar', 1, ConnectionError())]
+    store_pages(pages, Writer(), failures=failures)
+    assert failures == {'foo': (PERMANENT, 'InvalidURL'),
+                        'bar': (TRANSIENT, 'ConnectionError')}
+
+
+
+@pt.fixture(scope="function")
+def queue_db(tmpdir):
+    from utils.create_sqlite_db import main as create_sqlite_db
+    db = str(tmpdir.join('test_run_batch.db'))
+    create_sqlite_db([__name__, db])
+    conn = connect(db)
+    conn.executemany("insert into project_names(project_name, page) "
+                     "values (?, 1)", [('bar',), ('baz',), ('foo',)])
+    conn.commit()
+    yield db, conn
+    conn.close()
+
+
+def batch_args(**kwargs):
+    defaults = dict(batch_size=10, table='project_names', write_batch_size=10,
+                    max_buffer_mb=1, storage='raw')
+    return types.SimpleNamespace(**{**defaults, **kwargs})
+
+
+def fetch_one_page(monkeypatch, started=None):
+    """ Have `run_batch` fetch an empty page 1 of each project it starts,
+    calling `started` with the name of each
+    """
+    def fetch_pages(session, keys, names, *args):
+        for name in names:
+            if started is not None:
+                started(name)
+            yield fetched_page(name, 1, get(URL % name))
+    monkeypatch.setattr(sys.modules['request_libraries_io_load_sqlite'],
+                        'fetch_pages', fetch_pages)
+
+
+def queue_rows(conn):
+    return conn.execute("select project_name, done, leased_by, last_status "
+                        "from fetch_queue order by project_name").fetchall()
+
+
+@responses.activate
+def test_run_batch__projects_whose_pages_fail_to_write_are_retried(monkeypatch, queue_db):
+    from utils.work_queue import WorkQueue
+    _, conn = queue_db
+    # Every write of a page fails, as it would if the DB were locked
+    conn.execute("""create trigger fail_writes before insert on project_names
+        when new.project_name = 'foo'
+        begin select raise(abort, 'write failed'); end""")
+    conn.commit()
+    queue = WorkQueue(conn).ensure()
+    for name in ('bar', 'baz', 'foo'):
+        responses.add(responses.GET, URL % name, body='[]', status=200)
+    fetch_one_page(monkeypatch)
+    throughput = ProgressReporter(logging.getLogger(__name__), 'pages', 60)
+    leased, completed, failed, written, _ = run_batch(
+        None, conn, None, queue, batch_args(write_batch_size=1), None, False,
+        throughput, None)
+    assert sorted(leased) == ['bar', 'baz', 'foo']
+    assert sorted(completed) == ['bar', 'baz'] and failed == ['foo']
+    assert written == 2
+    assert queue_rows(conn) == [('bar', 1, None, '200'), ('baz', 1, None, '200'),
+                                ('foo', 0, None, WRITE_FAILED)]
+
+
+@responses.activate
+def test_run_batch__shutdown_releases_projects_not_started(monkeypatch, queue_db):
+    from utils.work_queue import WorkQueue
+    _, conn = queue_db
+    queue = WorkQueue(conn, worker_id='foo').ensure()
+    for name in ('bar', 'baz', 'foo'):
+        responses.add(responses.GET, URL % name, body='[]', status=200)
+    # Without the SIGTERM handler
+    shutdown = Shutdown.__new__(Shutdown)
+    shutdown.requested = False
+
+    def started(name):
+        shutdown.requested = True
+    fetch_one_page(monkeypatch, started)
+    throughput = ProgressReporter(logging.getLogger(__name__), 'pages', 60)
+    leased, completed, failed, _, _ = run_batch(
+        None, conn, None, queue, batch_args(), None, shutdown, throughput,
+        None)
+    assert len(leased) == 3 and completed == leased[:1] and failed == []
+    not_started = sorted(leased[1:])
+    assert [row for row in queue_rows(conn) if not row[1]] == \
+        [(name, 0, None, None) for name in not_started]
+    assert sorted(WorkQueue(conn, worker_id='bar').claim(10)) == not_started
+
+
+def run_main(monkeypatch, db, *options):
+    """ Run `main` with `options`, then restore the handler of SIGTERM that it
+    replaces, which processes forked by later tests would otherwise inherit
+    """
+    import signal
+    monkeypatch.setenv('APIKEY', 'key')
+    monkeypatch.setattr(sys, 'argv', [
+        'request_libraries_io_load_sqlite.py', db, 'project_names', '1',
+        *options])
+    handler = signal.getsignal(signal.SIGTERM)
+    try:
+        return main()
+    finally:
+        signal.signal(signal.SIGTERM, handler)
+
+
+def test_main__until_empty_exits_once_the_queue_is_empty(monkeypatch, queue_db):
+    db, _ = queue_db
+    batches = []
+
+    def run_batch(session, conn, keys, queue, *args):
+        leased = queue.claim(1)
+        queue.complete(leased)
+        batches.append(leased)
+        return leased, leased, [], len(leased), 0
+    monkeypatch.setattr(sys.modules['request_libraries_io_load_sqlite'],
+                        'run_batch', run_batch)
+    assert run_main(monkeypatch, db, '--until_empty') == 0
+    assert batches == [['bar'], ['baz'], ['foo'], []]
+
+
+def test_main__daemon_stops_polling_on_sigterm(monkeypatch, queue_db):
+    import signal
+    import time
+    db, _ = queue_db
+    batches, sleeps = [], []
+
+    def run_batch(session, conn, keys, queue, *args):
+        batches.append([])
+        return [], [], [], 0, 0
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) == 3:
+            os.kill(os.getpid(), signal.SIGTERM)
+    monkeypatch.setattr(sys.modules['request_libraries_io_load_sqlite'],
+                        'run_batch', run_batch)
+    monkeypatch.setattr(time, 'sleep', sleep)
+    assert run_main(monkeypatch, db, '--daemon', '--poll_seconds',
+                    '3600') == 1
+    assert len(batches) == 1 and sleeps == [1, 1, 1]
+
+
+def test_main__releases_projects_when_every_key_is_rejected(monkeypatch, queue_db, caplog):
+    db, conn = queue_db
+
+    def fetch_pages(session, keys, names, *args):
+        for name in names:
+            for key in list(keys.keys):
+                keys.report(key, 401)
+            keys.wait()
+            yield
+    monkeypatch.setattr(sys.modules['request_libraries_io_load_sqlite'],
+                        'fetch_pages', fetch_pages)
+    assert run_main(monkeypatch, db, '--until_empty') == 2
+    assert "Every API key has been rejected by the API: APIKey('key...')" \
+        in caplog.text
+    assert queue_rows(conn) == [(name, 0, None, None)
+                                for name in ('bar', 'baz', 'foo')]
+
+
+@responses.activate
+def test_main__replay_marks_projects_done_in_the_queue(monkeypatch, queue_db, tmpdir):
+    from utils.response_archive import ResponseArchive
+    from utils.work_queue import WorkQueue
+    db, conn = queue_db
+    WorkQueue(conn).ensure()
+    responses.add(responses.GET, URL % 'bar', body='[]', status=200)
+    responses.add(responses.GET, URL % 'baz', body='{}', status=503)
+    path = str(tmpdir.join('archive.db'))
+    with ResponseArchive(path).create() as archive:
+        for name in ('bar', 'baz'):
+            archive.record(fetched_page(name, 1, get(URL % name)))
+    assert run_main(monkeypatch, db, '--replay', path) == 0
+    assert queue_rows(conn) == [('bar', 1, None, '200'), ('baz', 0, None, None),
+                                ('foo', 0, None, None)]
+
+
+@responses.activate
+def test_main__record_archive_is_written_when_a_batch_raises(monkeypatch, queue_db, tmpdir):
+    from utils.response_archive import ResponseArchive
+    db, _ = queue_db
+    responses.add(responses.GET, URL % 'bar', body='[]', status=200)
+
+    def run_batch(session, conn, keys, queue, args, loop, shutdown,
+                  throughput, validators, archive):
+        archive.record(fetched_page('bar', 1, get(URL % 'bar')))
+        raise RuntimeError("interrupted")
+    monkeypatch.setattr(sys.modules['request_libraries_io_load_sqlite'],
+                        'run_batch', run_batch)
+    path = str(tmpdir.join('archive.db'))
+    with pt.raises(RuntimeError):
+        run_main(monkeypatch, db, '--record', path)
+    with ResponseArchive(path) as archive:
+        assert len(archive) == 1
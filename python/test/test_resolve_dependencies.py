@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import csv
+
+from hypothesis import given, strategies as st
+
+from resolve_dependencies import main, normalize, ProjectIDs
+
+
+@given(st.text(alphabet='aB-_.', max_size=10))
+def test_normalize__is_idempotent_and_case_insensitive(name):
+    assert normalize(normalize(name)) == normalize(name)
+    assert normalize(name.upper()) == normalize(name)
+
+
+def test_project_ids__exact_then_unambiguous_normalized():
+    projects = ProjectIDs()
+    for name, id_ in (('Django', 1), ('zope.interface', 2), ('foo-bar', 3),
+                      ('Foo_Bar', 4)):
+        projects.add(name, id_)
+    assert projects.resolve('Django') == 1
+    assert projects.resolve('django') == 1
+    assert projects.resolve('Zope_Interface') == 2
+    assert projects.resolve('Foo_Bar') == 4
+    assert projects.resolve('foo.bar') is None
+    assert projects.resolve('nope') is None
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='') as f:
+        csv.writer(f).writerows(rows)
+    return str(path)
+
+
+def read_csv(path):
+    with open(path, newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_main__resolves_dedups_and_reports(tmpdir):
+    projects = write_csv(tmpdir.join('pypi_projects.csv'),
+                         [['ID', 'Name'], ['1', 'Django'], ['2', 'six']])
+    dependencies = write_csv(
+        tmpdir.join('pypi_dependencies.csv'),
+        [['ID', 'Version_ID', 'Dependency_Name', 'Dependency_Kind',
+          'Dependency_Project_ID'],
+         ['1', '10', 'django', 'runtime', ''],
+         ['2', '10', 'Django', 'test', '1'],
+         ['3', '10', 'six', 'runtime', ''],
+         ['4', '11', 'left-pad', 'runtime', '']])
+    out, unresolved = str(tmpdir.join('out.csv')), str(tmpdir.join('u.csv'))
+    assert main([__name__, projects, dependencies, out,
+                 '--unresolved', unresolved]) == 0
+    assert read_csv(out) == [
+        ['ID', 'Version_ID', 'Dependency_Name', 'Dependency_Kind',
+         'Dependency_Project_ID'],
+        ['1', '10', 'django', 'runtime', '1'],
+        ['3', '10', 'six', 'runtime', '2']]
+    assert read_csv(unresolved)[1:] == [['4', '11', 'left-pad', 'runtime', '']]
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest as pt
+from requests import get
+from requests.exceptions import ReadTimeout
+import responses
+
+from utils.libraries_io_project_contributors_endpoint import fetched_page, \
+    parse_request_response_content, URL
+from utils.response_archive import ResponseArchive
+
+
+@pt.fixture(scope="function")
+def archive():
+    with ResponseArchive('test_archive.db', batch_size=2) as archive:
+        yield archive.create()
+    os.remove('test_archive.db')
+
+
+@responses.activate
+def test_response_archive__replays_what_was_recorded(archive):
+    link = f'<{URL % "foo"}?page=2&per_page=100>; rel="next"'
+    responses.add(responses.GET, URL % 'foo', status=200, json=[{'uuid': 1}],
+                  headers={'Link': link, 'ETag': '"v1"'})
+    responses.add(responses.GET, URL % 'bar', status=404, json={})
+    recorded = [fetched_page('foo', 1, get(URL % 'foo')),
+                fetched_page('bar', 1, get(URL % 'bar'))]
+    for page in recorded:
+        archive.record(page)
+    archive.flush()
+    replayed = list(archive.replay())
+    assert [(name, page) for name, page, _ in replayed] == \
+        [('bar', 1), ('foo', 1)]
+    bar, foo = (r for _, _, r in replayed)
+    assert foo.status_code == 200 and foo.content == recorded[0].response.content
+    assert foo.headers['etag'] == '"v1"'
+    assert foo.links['next']['url'] == f'{URL % "foo"}?page=2&per_page=100'
+    assert parse_request_response_content(foo).error is None
+    assert bar.status_code == 404
+    assert 'HTTPError' in parse_request_response_content(bar).error
+
+
+def test_response_archive__replays_exceptions(archive):
+    archive.record(fetched_page('foo', 1, ReadTimeout('timed out')))
+    archive.flush()
+    (_, _, exception), = archive.replay()
+    assert isinstance(exception, ReadTimeout)
+    assert str(exception) == 'timed out'
+
+
+def test_response_archive__later_recording_replaces_earlier(archive):
+    archive.record(fetched_page('foo', 1, ReadTimeout('timed out')))
+    archive.record(fetched_page('bar', 1, ReadTimeout('timed out')))
+    archive.record(fetched_page('foo', 1, ReadTimeout('again')))
+    archive.flush()
+    assert len(archive) == 2 and archive.recorded == 3
+    (_, _, exception), = archive.replay(['foo'])
+    assert str(exception) == 'again'
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+import pytest as pt
+
+from utils.create_sqlite_db import create_normalized_tables, \
+    main as create_sqlite_db
+from utils.libraries_io_project_contributors_endpoint import content_and_error
+from utils.sqlite_writer import (configure_connection, ContributorsWriter,
+                                 has_normalized_tables, page_record)
+from utils.utils import connect
+
+
+@pt.fixture(scope="function")
+def project_names_db():
+    create_sqlite_db([__name__, 'test_writer.db'])
+    conn = connect('test_writer.db')
+    conn.executemany("insert into project_names(project_name, page) "
+                     "values (?, 1)", [('foo',), ("o'brien",)])
+    conn.commit()
+    yield conn
+    conn.close()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists('test_writer.db' + suffix):
+            os.remove('test_writer.db' + suffix)
+
+
+def test_configure_connection__wal(project_names_db):
+    assert configure_connection(project_names_db) == 'wal'
+    synchronous, = project_names_db.execute("PRAGMA synchronous").fetchone()
+    assert synchronous == 1
+
+
+def test_configure_connection__invalid_synchronous(project_names_db):
+    with pt.raises(ValueError):
+        configure_connection(project_names_db, synchronous='SOMETIMES')
+
+
+def test_page_record__success_and_error():
+    assert page_record('foo', 2, content_and_error(b'[]', None))[:5] == \
+        ('foo', 2, 1, 1, None)
+    assert page_record('foo', 1, content_and_error(None, '{}')) == \
+        ('foo', 1, 1, 0, '{}', None)
+
+
+def test_contributors_writer__updates_page_1_and_inserts_later_pages(project_names_db):
+    with ContributorsWriter(project_names_db, batch_size=2) as writer:
+        for name, page in (('foo', 1), ('foo', 2), ("o'brien", 1)):
+            writer.write(page_record(name, page, content_and_error(b'[]', None)))
+    rows = project_names_db.execute(
+        "select project_name, page, api_has_been_queried, api_query_succeeded "
+        "from project_names order by project_name, page").fetchall()
+    assert rows == [('foo', 1, 1, 1), ('foo', 2, 1, 1), ("o'brien", 1, 1, 1)]
+    assert writer.written == 3
+
+
+@pt.mark.parametrize("n,batch_size", [(1, 1), (5, 2), (50, 7), (3, 20)])
+def test_contributors_writer__flushes_every_batch_size(project_names_db, n, batch_size):
+    writer = ContributorsWriter(project_names_db, batch_size=batch_size)
+    for page in range(n):
+        writer.write(page_record('bar', page, content_and_error(b'[]', None)))
+    assert writer.written == n - n % batch_size
+    assert len(writer.buffer) == n % batch_size
+    writer.flush()
+    assert writer.written == n
+
+
+def test_contributors_writer__flushes_at_max_buffer_bytes(project_names_db):
+    writer = ContributorsWriter(project_names_db, batch_size=100,
+                                max_buffer_bytes=10)
+    writer.write(page_record('bar', 1, content_and_error(b'[1, 2]', None)))
+    assert writer.written == 0 and writer.buffered_bytes == 6
+    writer.write(page_record('bar', 2, content_and_error(b'[3, 4]', None)))
+    assert writer.written == 2 and writer.buffered_bytes == 0
+
+
+def test_contributors_writer__normalized_tables_hold_each_contributor_once(project_names_db):
+    create_normalized_tables(project_names_db)
+    assert has_normalized_tables(project_names_db)
+    shared = {'uuid': '1', 'name': 'shared', 'login': 'shared'}
+    pages = {'foo': [shared, {'uuid': '2', 'name': 'two'}],
+             "o'brien": [shared, {'uuid': None, 'name': 'no uuid'}]}
+    with ContributorsWriter(project_names_db, normalized=True) as writer:
+        for name, contributors in pages.items():
+            content = json.dumps(contributors).encode('utf-8')
+            writer.write(page_record(name, 1, content_and_error(content, None)))
+        writer.write(page_record('bar', 1, content_and_error(None, '{}')))
+    assert project_names_db.execute(
+        "select uuid, name from contributors order by uuid").fetchall() == \
+        [(1, 'shared'), (2, 'two')]
+    assert project_names_db.execute(
+        "select project_name from project_contributors where uuid = 1 "
+        "order by project_name").fetchall() == [('foo',), ("o'brien",)]
+
+
+def test_contributors_writer__records_projects_whose_records_fail(project_names_db):
+    project_names_db.execute("""create trigger fail_foo before insert on
+        project_names when new.project_name = 'foo'
+        begin select raise(abort, 'write failed'); end""")
+    with ContributorsWriter(project_names_db, batch_size=2) as writer:
+        for name, page in (('foo', 1), ('foo', 2), ("o'brien", 1)):
+            writer.write(page_record(name, page, content_and_error(b'[]', None)))
+    assert writer.failed_projects == {'foo'}
+    assert (writer.written, writer.failed) == (1, 2)
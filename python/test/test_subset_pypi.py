@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import os
+import tarfile
+import tempfile
+
+from hypothesis import given, settings, strategies as st
+import pytest as pt
+
+from subset_pypi import end_of_record, main, record_boundaries, rename, \
+    subset_range, subset_rows
+
+PROJECTS = ('ID,Platform,Name,Description,Last synced Timestamp\n'
+            '1,Pypi,foo,"a\nmultiline, quoted description",2018\n'
+            '2,NPM,bar,,2018\n'
+            '3,Pypi,baz,,2018\n')
+VERSIONS = 'ID,Platform,Project Name,Number\n1,Pypi,foo,1.0\n2,NPM,bar,1.0\n'
+DEPENDENCIES = ('ID,Platform,Project Name,Dependency Name,'
+                'Dependency Platform\n'
+                '1,Pypi,foo,baz,Pypi\n'
+                '2,Pypi,foo,left-pad,NPM\n'
+                '3,NPM,bar,left-pad,NPM\n')
+
+
+@pt.fixture(scope="function")
+def archive(tmpdir):
+    path = str(tmpdir.join('open-data.tar.gz'))
+    members = (('projects-1.4.0-2018-12-22.csv', PROJECTS),
+               ('projects_with_repository_fields-1.4.0-2018-12-22.csv',
+                PROJECTS),
+               ('repository_dependencies-1.4.0-2018-12-22.csv', DEPENDENCIES),
+               ('versions-1.4.0-2018-12-22.csv', VERSIONS),
+               ('dependencies-1.4.0-2018-12-22.csv', DEPENDENCIES))
+    with tarfile.open(path, 'w:gz') as tar:
+        for name, content in members:
+            data = content.encode('utf-8')
+            info = tarfile.TarInfo(f'Libraries.io-open-data-1.4.0/{name}')
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return path
+
+
+def read_csv(path):
+    with open(path, newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_rename():
+    assert rename('Project Name') == 'Project_Name'
+    assert rename('Last synced Timestamp') == 'Last_Synced_Timestamp'
+
+
+def test_subset_rows__filters_all_columns_and_cuts():
+    rows = iter([['ID', 'Platform', 'Dependency Platform'],
+                 ['1', 'Pypi', 'Pypi'], ['2', 'Pypi', 'NPM'], ['3']])
+    assert list(subset_rows(rows, ('Platform', 'Dependency_Platform'),
+                            ('Platform', 'Dependency_Platform'), 'Pypi')) == \
+        [['ID'], ['1']]
+
+
+def test_main__writes_pypi_subsets_in_one_pass(tmpdir, archive):
+    out = str(tmpdir.join('out'))
+    assert main([__name__, archive, '--out', out]) == 0
+    assert sorted(os.listdir(out)) == \
+        ['pypi_dependencies.csv', 'pypi_projects.csv', 'pypi_versions.csv']
+    assert read_csv(os.path.join(out, 'pypi_projects.csv')) == [
+        ['ID', 'Name', 'Description', 'Last_Synced_Timestamp'],
+        ['1', 'foo', 'a\nmultiline, quoted description', '2018'],
+        ['3', 'baz', '', '2018']]
+    assert read_csv(os.path.join(out, 'pypi_versions.csv')) == \
+        [['ID', 'Project_Name', 'Number'], ['1', 'foo', '1.0']]
+    assert read_csv(os.path.join(out, 'pypi_dependencies.csv')) == \
+        [['ID', 'Project_Name', 'Dependency_Name'], ['1', 'foo', 'baz']]
+
+
+def test_main__fails_without_members_to_subset(tmpdir):
+    path = str(tmpdir.join('empty.tar'))
+    tarfile.open(path, 'w').close()
+    assert main([__name__, path, '--out', str(tmpdir)]) == 1
+
+
+fields = st.text(alphabet='ab,"\n Pypi', max_size=8)
+
+
+@settings(max_examples=50, deadline=None)
+@given(rows=st.lists(st.tuples(fields, st.sampled_from(['Pypi', 'NPM']),
+                               fields), max_size=30),
+       ranges=st.integers(min_value=1, max_value=20))
+def test_subset_range__byte_ranges_subset_as_whole_file(rows, ranges):
+    with tempfile.TemporaryDirectory() as directory:
+        check_byte_ranges(os.path.join(directory, 'dependencies-x.csv'),
+                          rows, ranges)
+
+
+def check_byte_ranges(path, rows, ranges):
+    with open(path, 'w', newline='') as f:
+        csv.writer(f, lineterminator='\n').writerows(
+            [('Description', 'Platform', 'Name')] + rows)
+    with open(path, newline='') as f:
+        expected = list(subset_rows(csv.reader(f), ('Platform',),
+                                    ('Platform',), 'Pypi'))[1:]
+    with open(path, 'rb') as f:
+        header_end = end_of_record(f, 0, False)
+    boundaries = record_boundaries(path, header_end, ranges)
+    assert boundaries == sorted(set(boundaries))
+    subsets = [subset_range(path, [1], [0, 2], 'Pypi', start, end)
+               for start, end in zip(boundaries, boundaries[1:])]
+    assert sum(rows for _, rows in subsets) == len(expected)
+    assert list(csv.reader(io.StringIO(''.join(text for text, _ in subsets),
+                                       newline=''))) == expected
+
+
+def test_main__filters_extracted_csvs_in_parallel(tmpdir, archive):
+    extracted, out = str(tmpdir.join('extracted')), str(tmpdir.join('out'))
+    with tarfile.open(archive) as tar:
+        tar.extractall(extracted)
+    directory = os.path.join(extracted, 'Libraries.io-open-data-1.4.0')
+    paths = [os.path.join(directory, name) for name in
+             ('projects-1.4.0-2018-12-22.csv', 'dependencies-1.4.0-2018-12-22.csv')]
+    assert main([__name__] + paths + ['--out', out, '--workers', '2']) == 0
+    assert read_csv(os.path.join(out, 'pypi_projects.csv'))[1:] == [
+        ['1', 'foo', 'a\nmultiline, quoted description', '2018'],
+        ['3', 'baz', '', '2018']]
+    assert read_csv(os.path.join(out, 'pypi_dependencies.csv'))[1:] == \
+        [['1', 'foo', 'baz']]
+    assert main([__name__, os.path.join(directory, 'nope.csv'),
+                 '--out', out]) == 1
@@ -8,7 +8,7 @@ from string import printable
 import pytest as pt
 from hypothesis import given, strategies as st
 
-from utils.utils import (return_parser, select_from_sqlite,
+from utils.utils import (merge_join, return_parser, select_from_sqlite,
                          connect, IntegrityError, OperationalError)
 
 
@@ -97,3 +97,22 @@ def test_select_from_sqlite_with_params(sqlitedb, caplog):
 #     res = insert_into_sqlite(sqlitedb, query, params)
 #     assert res is None
 #     assert f'Inserted {len(params)} records\n' in caplog.text
+
+
+def test_merge_join_pairs_each_project_with_its_pages():
+    projects = [('bar', 1), ('baz', 2), ('foo', 3)]
+    rows = [('bar', b'[]'), ('foo', b'[1]'), ('foo', b'[2]'), ('qux', b'[]')]
+    assert [(p[1], row[1]) for p, row in
+            merge_join(projects, rows, lambda p: p[0], lambda r: r[0])] == \
+        [(1, b'[]'), (3, b'[1]'), (3, b'[2]')]
+
+
+@given(st.dictionaries(st.text(alphabet=printable), st.integers()),
+       st.lists(st.tuples(st.text(alphabet=printable), st.integers())))
+def test_merge_join_matches_dict_lookup(left, right):
+    right = sorted(right)
+    expected = [(name, row) for name in sorted(left)
+                for row in right if row[0] == name]
+    joined = merge_join(sorted(left), right, lambda name: name,
+                        lambda row: row[0])
+    assert list(joined) == expected
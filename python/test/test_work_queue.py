@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest as pt
+
+from utils.create_sqlite_db import main as create_sqlite_db
+from utils.libraries_io_project_contributors_endpoint import PERMANENT, \
+    TRANSIENT
+from utils.utils import connect
+from utils.work_queue import WorkQueue
+from fakes import FakeClock
+
+
+@pt.fixture(scope="function")
+def project_names_db():
+    create_sqlite_db([__name__, 'test_queue.db'])
+    conn = connect('test_queue.db')
+    conn.executemany("insert into project_names(project_name, page, "
+                     "api_has_been_queried) values (?, 1, ?)",
+                     [(f'project{i}', None if i < 8 else 1) for i in range(10)])
+    conn.commit()
+    yield conn
+    conn.close()
+    os.remove('test_queue.db')
+
+
+def test_work_queue__ensure_seeds_unqueried_projects_once(project_names_db):
+    queue = WorkQueue(project_names_db).ensure()
+    assert queue.remaining() == 8
+    project_names_db.execute("insert into project_names(project_name, page) "
+                             "values ('new', 1)")
+    assert WorkQueue(project_names_db).ensure().remaining() == 8
+    assert queue.seed() == 1
+
+
+def test_work_queue__workers_claim_disjoint_projects(project_names_db):
+    clock = FakeClock()
+    other_conn = connect('test_queue.db')
+    foo = WorkQueue(project_names_db, worker_id='foo', clock=clock).ensure()
+    bar = WorkQueue(other_conn, worker_id='bar', clock=clock).ensure()
+    foo_names, bar_names = foo.claim(5), bar.claim(5)
+    other_conn.close()
+    assert len(foo_names) == 5 and len(bar_names) == 3
+    assert not set(foo_names) & set(bar_names)
+    assert foo.claim(5) == []
+
+
+def test_work_queue__expired_leases_are_reclaimed(project_names_db):
+    clock = FakeClock()
+    foo = WorkQueue(project_names_db, worker_id='foo', lease_seconds=60,
+                    clock=clock).ensure()
+    bar = WorkQueue(project_names_db, worker_id='bar', lease_seconds=60,
+                    clock=clock)
+    names = foo.claim(8)
+    clock.now = 59.
+    assert bar.claim(8) == []
+    clock.now = 61.
+    assert sorted(bar.claim(8)) == sorted(names)
+
+
+def test_work_queue__completed_projects_are_not_claimed(project_names_db):
+    clock = FakeClock()
+    queue = WorkQueue(project_names_db, lease_seconds=60, clock=clock).ensure()
+    names = queue.claim(3)
+    queue.complete(names)
+    clock.now = 1000.
+    assert not set(queue.claim(8)) & set(names)
+    assert queue.remaining() == 5
+
+
+def test_work_queue__released_projects_are_claimed_at_once(project_names_db):
+    queue = WorkQueue(project_names_db, clock=FakeClock()).ensure()
+    names = queue.claim(8)
+    queue.release(names[:2])
+    assert sorted(queue.claim(8)) == sorted(names[:2])
+
+
+def test_work_queue__permanent_failures_are_not_claimed_again(project_names_db):
+    clock = FakeClock()
+    queue = WorkQueue(project_names_db, clock=clock).ensure()
+    names = queue.claim(2)
+    assert queue.fail({names[0]: (PERMANENT, '404'),
+                       names[1]: (TRANSIENT, '503')}) == 1
+    clock.now = 10 ** 9
+    assert names[0] not in queue.claim(8)
+    assert queue.remaining() == 7
+
+
+def test_work_queue__retries_are_claimed_first_once_due(project_names_db):
+    clock = FakeClock()
+    queue = WorkQueue(project_names_db, retry_seconds=60, clock=clock).ensure()
+    name, = queue.claim(1)
+    queue.fail({name: (TRANSIENT, 'ReadTimeout')})
+    assert name not in queue.claim(1)
+    clock.now = 60.
+    assert queue.claim(1) == [name]
+    attempts, last_status, next_attempt_at = project_names_db.execute(
+        "select attempts, last_status, next_attempt_at from fetch_queue "
+        "where project_name = ?", (name,)).fetchone()
+    assert (attempts, last_status, next_attempt_at) == (1, 'ReadTimeout', 60.)
+
+
+def test_work_queue__backoff_doubles_up_to_max_attempts(project_names_db):
+    clock = FakeClock()
+    queue = WorkQueue(project_names_db, max_attempts=3, retry_seconds=60,
+                      clock=clock).ensure()
+    assert [queue.backoff(n) for n in (1, 2, 3)] == [60, 120, 240]
+    name, = queue.claim(1)
+    for now in (60., 180.):
+        queue.fail({name: (TRANSIENT, '500')})
+        clock.now = now
+        assert queue.claim(1) == [name]
+    assert queue.fail({name: (TRANSIENT, '500')}) == 0
+    done, attempts = project_names_db.execute(
+        "select done, attempts from fetch_queue where project_name = ?",
+        (name,)).fetchone()
+    assert (done, attempts) == (1, 3)
+
+
+def test_work_queue__adds_retry_columns_to_existing_queue(project_names_db):
+    project_names_db.execute("""create table fetch_queue (
+        project_name text primary key, leased_by text,
+        lease_expires_at real not null default 0,
+        done integer not null default 0)""")
+    WorkQueue(project_names_db).ensure()
+    columns = {row[1] for row in
+               project_names_db.execute("PRAGMA table_info(fetch_queue)")}
+    assert {'attempts', 'next_attempt_at', 'last_status'} <= columns
+
+
+def test_work_queue__refresh_requeues_only_successful_projects(project_names_db):
+    queue = WorkQueue(project_names_db, clock=FakeClock()).ensure()
+    names = queue.claim(3)
+    queue.complete(names[:2])
+    queue.fail({names[2]: (PERMANENT, '404')})
+    assert queue.refresh() == 2
+    assert sorted(queue.claim(8)) == sorted(set(names[:2]) | {
+        f'project{i}' for i in range(8)} - set(names))
+
+
+def test_work_queue__renewed_leases_are_not_reclaimed(project_names_db):
+    clock = FakeClock()
+    foo = WorkQueue(project_names_db, worker_id='foo', lease_seconds=60,
+                    clock=clock).ensure()
+    bar = WorkQueue(project_names_db, worker_id='bar', lease_seconds=60,
+                    clock=clock)
+    name, = foo.claim(1)
+    clock.now = 50.
+    assert foo.renew(name)
+    clock.now = 100.
+    assert name not in bar.claim(8)
+
+
+def test_work_queue__expired_lease_is_lost_to_another_worker(project_names_db, caplog):
+    clock = FakeClock()
+    foo = WorkQueue(project_names_db, worker_id='foo', lease_seconds=60,
+                    clock=clock).ensure()
+    bar = WorkQueue(project_names_db, worker_id='bar', lease_seconds=60,
+                    clock=clock)
+    first, second = foo.claim(2)
+    clock.now = 61.
+    assert sorted(bar.claim(2)) == sorted([first, second])
+    assert not foo.renew(first)
+    foo.complete([first])
+    foo.fail({second: (TRANSIENT, '503')})
+    assert 'Only 0 of 1 projects completed' in caplog.text
+    assert f"Failure of project '{second}' not recorded" in caplog.text
+    assert project_names_db.execute(
+        "select done, leased_by, attempts from fetch_queue where project_name "
+        "in (?, ?)", (first, second)).fetchall() == [(0, 'bar', 0)] * 2
+
+
+def test_work_queue__mark_done_leaves_projects_leased_to_a_worker(project_names_db):
+    clock = FakeClock()
+    queue = WorkQueue(project_names_db, lease_seconds=60, clock=clock).ensure()
+    leased, = queue.claim(1)
+    others = [f'project{i}' for i in range(8) if f'project{i}' != leased][:2]
+    assert queue.mark_done([leased] + others) == 2
+    clock.now = 61.
+    assert queue.mark_done([leased]) == 1
+    assert queue.remaining() == 5
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import csv
+import json
+import os
+
+import pytest as pt
+
+from utils.create_sqlite_db import create_normalized_tables, \
+    main as create_sqlite_db
+from utils.utils import connect
+from write_import_files import main, project_contributors, to_boolean
+
+PROJECTS = [['ID', 'Name', 'SourceRank', 'Versions_Count', 'Language'],
+            ['1', 'foo', '10', '2', 'Python'],
+            ['2', 'bar', '5', '1', 'C'],
+            ['1', 'foo', '10', '2', 'Python'],
+            ['3', 'baz', '', '', '']]
+VERSIONS = [['ID', 'Project_Name', 'Project_ID', 'Number'],
+            ['10', 'foo', '1', '1.0'],
+            ['11', 'foo', '1', '1.1'],
+            ['12', 'qux', '99', '0.1'],
+            ['10', 'foo', '1', '1.0']]
+DEPENDENCIES = [['ID', 'Version_ID', 'Dependency_Name', 'Dependency_Kind',
+                 'Optional_Dependency'],
+                ['1', '10', 'bar', 'runtime', 'false'],
+                ['2', '10', 'bar', 'test', 'true'],
+                ['3', '11', 'qux', 'runtime', 'false'],
+                ['4', '99', 'bar', 'runtime', 'false'],
+                ['5', '11', 'baz', 'extra', 'True']]
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='') as f:
+        csv.writer(f).writerows(rows)
+    return str(path)
+
+
+def read_csv(path):
+    with open(path, newline='') as f:
+        return list(csv.reader(f))
+
+
+@pt.fixture(scope="function")
+def inputs(tmpdir):
+    return [write_csv(tmpdir.join(f'{name}.csv'), rows) for name, rows in
+            (('projects', PROJECTS), ('versions', VERSIONS),
+             ('dependencies', DEPENDENCIES))]
+
+
+def pages_db(path, normalized):
+    create_sqlite_db([__name__, path])
+    conn = connect(path)
+    pages = [('foo', 1, [{'uuid': 7, 'name': 'ann'}, {'uuid': 8}]),
+             ('foo', 2, [{'uuid': 7, 'name': 'ann'}]),
+             ('bar', 1, [{'uuid': 7, 'name': 'ann'}]),
+             ('qux', 1, [{'uuid': 9}])]
+    conn.executemany("insert into project_names(project_name, page, "
+                     "api_has_been_queried, api_query_succeeded, "
+                     "contributors) values (?, ?, 1, 1, ?)",
+                     [(name, page, json.dumps(contributors).encode())
+                      for name, page, contributors in pages])
+    if normalized:
+        create_normalized_tables(conn)
+        conn.executemany("insert or ignore into contributors(uuid, name) "
+                         "values (?, ?)", [(7, 'ann'), (8, None), (9, None)])
+        conn.executemany("insert into project_contributors values (?, ?)",
+                         [('foo', 7), ('foo', 8), ('bar', 7), ('qux', 9)])
+    conn.commit()
+    return conn
+
+
+def test_to_boolean():
+    assert [to_boolean(v) for v in ('', 'false', 'True', 't', '0')] == \
+        ['', 'false', 'true', 'true', 'false']
+
+
+@pt.mark.parametrize("normalized", [False, True])
+def test_project_contributors__reads_pages_or_normalized_tables(tmpdir,
+                                                                normalized):
+    conn = pages_db(str(tmpdir.join('test.db')), normalized)
+    rows = [(name, row[0], row[1]) for name, row in project_contributors(conn)]
+    conn.close()
+    assert ('foo', 7, 'ann') in rows and ('qux', 9, None) in rows
+    assert {name for name, _, _ in rows} == {'bar', 'foo', 'qux'}
+
+
+def test_main__writes_each_node_and_relationship_once(tmpdir, inputs, capsys):
+    out = tmpdir.join('import')
+    conn = pages_db(str(tmpdir.join('test.db')), False)
+    conn.close()
+    assert main([__name__] + inputs +
+                [str(out), '--DB', str(tmpdir.join('test.db'))]) == 0
+    files = {name[:-4]: read_csv(os.path.join(str(out), name))
+             for name in os.listdir(str(out))}
+    assert files['projects'] == [
+        [':ID(Project)', 'name', 'ID:int', 'sourcerank:int',
+         'versions_count:int'],
+        ['1', 'foo', '1', '10', '2'], ['2', 'bar', '2', '5', '1'],
+        ['3', 'baz', '3', '', '']]
+    assert files['platforms'][1:] == [['Pypi', 'Pypi']]
+    assert files['languages'][1:] == [['Python', 'Python'], ['C', 'C']]
+    assert files['has_default_language'][1:] == [['Pypi', 'Python']]
+    assert files['hosts'][1:] == [['Pypi', '1'], ['Pypi', '2'], ['Pypi', '3']]
+    assert files['is_written_in'][1:] == [['1', 'Python'], ['2', 'C']]
+    assert [row[0] for row in files['versions'][1:]] == ['10', '11', '12']
+    assert files['has_version'][1:] == [['1', '10'], ['1', '11']]
+    assert files['depends_on'][1:] == [['10', '2', 'runtime', 'false'],
+                                       ['11', '3', 'extra', 'true']]
+    assert sorted(row[0] for row in files['contributors'][1:]) == ['7', '8']
+    assert sorted(files['contributes_to'][1:]) == \
+        [['7', '1'], ['7', '2'], ['8', '1']]
+    command, _ = capsys.readouterr()
+    assert command.startswith(
+        'neo4j-admin import --mode=csv --database=graph.db')
+    assert f"--nodes:Project={os.path.join(str(out), 'projects.csv')}" \
+        in command
+    assert '--relationships:CONTRIBUTES_TO=' in command
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" A pool of Libraries.io API keys, each with its own rate limit, so that
+requests can be spread over several keys. Each request is sent with the key
+that has the most headroom in its RateGovernor at that moment.
+
+A key that the API rejects with 401 is dropped from rotation for good; one
+that is throttled with 429 is paused by its RateGovernor, which leaves it with
+no headroom, so that the other keys are chosen until the pause is over.
+"""
+
+import logging
+import os
+import sys
+import time
+
+from utils.rate_limiting import CALLS, PERIOD, RateGovernor
+
+APIKEY, APIKEYS = "APIKEY", "APIKEYS"
+UNAUTHORIZED, TOO_MANY_REQUESTS = 401, 429
+logger = logging.getLogger(__name__)
+
+
+class NoAPIKeyAvailable(Exception):
+    """ Raised when every key of an APIKeyPool has been rejected by the API """
+
+
+class APIKey(object):
+    __slots__ = ("key", "bucket", "revoked")
+
+    def __init__(self, key, bucket):
+        self.key = key
+        self.bucket = bucket
+        self.revoked = False
+
+    def __repr__(self):
+        return f"APIKey('{self.key[:4]}...')"
+
+
+class APIKeyPool(object):
+    """ Route requests to whichever of `keys` has the most headroom, each key
+    being limited to `calls` per `period` seconds on its own.
+    """
+    def __init__(self, keys, calls=CALLS, period=PERIOD, clock=time.monotonic):
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            raise ValueError("At least one API key is required")
+        self.keys = {key: APIKey(key, RateGovernor(calls, period, clock=clock))
+                     for key in keys}
+
+    @classmethod
+    def from_environment(cls, **kwargs):
+        """ Build a pool from the comma-separated keys in the `APIKEYS`
+        environment variable, or else the single key in `APIKEY`
+        """
+        keys = [key.strip() for key in
+                (os.environ.get(APIKEYS) or os.environ.get(APIKEY) or '').split(',')
+                if key.strip()]
+        if not keys:
+            print(f"Neither '{APIKEYS}' nor '{APIKEY}' is among environment "
+                  "variables!", file=sys.stderr)
+            sys.exit(1)
+        return cls(keys, **kwargs)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def rate(self):
+        """ (float): the combined current rate of the keys in rotation, in
+        requests per second
+        """
+        return sum(k.bucket.rate for k in self.available())
+
+    @property
+    def waited(self):
+        """ (float): the total seconds requests have waited on any key """
+        return sum(k.bucket.waited for k in self.keys.values())
+
+    def available(self):
+        """ Return the keys currently in rotation """
+        return [k for k in self.keys.values() if not k.revoked]
+
+    def revoked(self):
+        """ Return the keys taken out of rotation """
+        return [k for k in self.keys.values() if k.revoked]
+
+    def choose(self):
+        """ Return the key in rotation with the most headroom
+        Raises:
+            NoAPIKeyAvailable: if every key has been revoked
+        """
+        in_rotation = self.available()
+        if not in_rotation:
+            raise NoAPIKeyAvailable("Every API key has been rejected by the API")
+        return max(in_rotation, key=lambda k: k.bucket.headroom())
+
+    def wait(self):
+        """ Block until a request may be sent, returning the key to send it
+        with
+        """
+        api_key = self.choose()
+        api_key.bucket.wait()
+        return api_key.key
+
+    async def acquire(self):
+        """ Suspend the calling coroutine until a request may be sent,
+        returning the key to send it with
+        """
+        api_key = self.choose()
+        await api_key.bucket.acquire()
+        return api_key.key
+
+    def report(self, key, status_code, headers=None):
+        """ Pass the response to a request sent with `key` to the key's
+        RateGovernor, taking the key out of rotation for good if the API
+        rejected it with 401
+        Args:
+            key (str): the API key the request was sent with
+            status_code (int): the status code of the response
+            headers (Mapping): the headers of the response
+        """
+        api_key = self.keys[key]
+        if status_code == UNAUTHORIZED and not api_key.revoked:
+            logger.warning(f"{api_key} was rejected with {status_code}; "
+                           "dropping it from rotation")
+            api_key.revoked = True
+        elif status_code == TOO_MANY_REQUESTS:
+            logger.warning(f"{api_key} was throttled with {status_code}")
+        api_key.bucket.observe(status_code, headers or {})
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Concurrent fetching of the Libraries.io API Project Contributors endpoint.
+A pool of `concurrency` workers keeps requests in flight for many projects at
+once, each worker waiting on the APIKeyPool shared by all of them for a key
+with headroom before it sends, so that the time spent waiting on the network
+overlaps with the time spent waiting on the rate limit instead of adding to
+it.
+
+Once page 1 of a project arrives, the number of pages is read from it and
+pages 2..N are all scheduled at once, ahead of projects not yet started, so
+the pages of a large project are fetched concurrently rather than by
+following 'next' links one after another.
+
+`requests` is blocking, so the requests are sent from a thread pool owned by
+the fetcher; the event loop only schedules them.
+"""
+
+import asyncio
+import itertools as it
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.api_keys import NoAPIKeyAvailable, TOO_MANY_REQUESTS
+from utils.libraries_io_project_contributors_endpoint import \
+    build_get_request, count_pages, fetched_page, project_page, URL
+
+logger = logging.getLogger(__name__)
+_DONE = object()
+# Pages of projects already started are sent before new projects
+STARTED, NEW = 0, 1
+
+
+class _Pages(object):
+    """ Book-keeping of the pages of each project in flight, shared by the
+    feeder and the workers
+    """
+    def __init__(self, concurrency, per_page, validators=None):
+        self.validators = validators
+        self.jobs = asyncio.PriorityQueue()
+        self.projects_in_flight = asyncio.Semaphore(concurrency)
+        self.outstanding = {}
+        self.num_pages = {}
+        self.per_page = per_page
+        self._order = it.count()
+
+    def put(self, priority, page):
+        self.jobs.put_nowait((priority, next(self._order), page))
+
+    async def start(self, project_name):
+        await self.projects_in_flight.acquire()
+        self.outstanding[project_name] = 1
+        self.num_pages[project_name] = None
+        self.put(NEW, project_page(project_name, 1))
+
+    def finish(self, page, response):
+        """ Record that `page` has been fetched, scheduling the remaining pages
+        of its project if `page` is the first to say how many there are
+        """
+        if not isinstance(response, Exception) and response.ok:
+            if page.page != 1:
+                num_pages = self.num_pages[page.project_name]
+            elif self.validators is not None:
+                num_pages = self.validators.count_pages(
+                    response, page.project_name, self.per_page)
+            else:
+                num_pages = count_pages(response, self.per_page)
+            if num_pages is None:
+                # The page count is unknown; follow the 'next' link instead
+                if response.links.get('next', None) is not None:
+                    self.outstanding[page.project_name] += 1
+                    self.put(STARTED, page._replace(page=page.page + 1))
+            elif page.page == 1:
+                self.num_pages[page.project_name] = num_pages
+                self.outstanding[page.project_name] += num_pages - 1
+                for n in range(2, num_pages + 1):
+                    self.put(STARTED, project_page(page.project_name, n))
+
+        self.outstanding[page.project_name] -= 1
+        if not self.outstanding[page.project_name]:
+            del self.outstanding[page.project_name]
+            self.num_pages.pop(page.project_name, None)
+            self.projects_in_flight.release()
+
+
+async def _work(session, pages, results, keys, executor):
+    """ Send the requests for the pages on `pages.jobs`, putting a
+    `fetched_page` onto `results` for each. If sending raises, the exception
+    takes the place of the response; if no API key is left to send with, the
+    exception is put onto `results` itself.
+    """
+    loop = asyncio.get_event_loop()
+    try:
+        while True:
+            _, _, page = await pages.jobs.get()
+            key = await keys.acquire()
+            try:
+                headers = None if pages.validators is None else \
+                    pages.validators.conditional_headers(*page)
+                request = build_get_request(URL % page.project_name, False,
+                                            pages.per_page, page.page, key,
+                                            headers)
+                prepared_request = session.prepare_request(request)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Sending request for project "
+                                 f"'{page.project_name}', page {page.page}")
+                response = await loop.run_in_executor(
+                    executor, session.send, prepared_request)
+            except Exception as e:
+                logger.warning(f"Request for project '{page.project_name}', "
+                               f"page {page.page} raised {e!r}")
+                response = e
+            else:
+                keys.report(key, response.status_code, response.headers)
+
+            if getattr(response, 'status_code', None) == TOO_MANY_REQUESTS:
+                # Throttled, not failed: send it again once the rate allows
+                response.close()
+                pages.put(STARTED, page)
+            else:
+                pages.finish(page, response)
+                await results.put(fetched_page(page.project_name, page.page,
+                                               response))
+            pages.jobs.task_done()
+    except NoAPIKeyAvailable as e:
+        await results.put(e)
+
+
+async def fetch_contributors(session, project_names, keys, concurrency=8,
+                             per_page=100, validators=None):
+    """ Request every page of contributors of each of `project_names`, with up
+    to `concurrency` requests in flight, each sent once one of `keys` allows.
+    Given `validators`, requests for pages that have been stored before are
+    conditional on the page having changed.
+
+    Args:
+        session (requests.Session): session in which to send requests
+        project_names (iterable): names of the projects to request
+        keys (utils.api_keys.APIKeyPool): the API keys to send requests with
+        concurrency (int): the number of requests that may be in flight
+        per_page (int): the number of contributors to request per page
+        validators (utils.http_cache.ValidatorCache): the stored validators
+    Yields:
+        (fetched_page): (project_name, page, requests.Response or Exception),
+        in the order in which the responses arrive
+    """
+    loop = asyncio.get_event_loop()
+    pages = _Pages(concurrency, per_page, validators)
+    results = asyncio.Queue(maxsize=concurrency)
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def feed_then_finish():
+        try:
+            for project_name in project_names:
+                await pages.start(project_name)
+            await pages.jobs.join()
+        except Exception as e:
+            await results.put(e)
+        else:
+            await results.put(_DONE)
+
+    workers = [loop.create_task(_work(session, pages, results, keys,
+                                      executor))
+               for _ in range(concurrency)]
+    feeder = loop.create_task(feed_then_finish())
+    try:
+        while True:
+            result = await results.get()
+            if result is _DONE:
+                break
+            elif isinstance(result, Exception):
+                raise result
+            yield result
+    finally:
+        for task in workers + [feeder]:
+            task.cancel()
+        await asyncio.gather(*workers, feeder, return_exceptions=True)
+        executor.shutdown(wait=True)
+
+
+def iterate_async(async_iterator, loop):
+    """ Consume `async_iterator` from synchronous code by running `loop` until
+    each of its items is ready; the loop only runs while an item is awaited.
+    Args:
+        async_iterator (async generator): the source of items
+        loop (asyncio.AbstractEventLoop): the loop on which to run it
+    Yields:
+        the items of `async_iterator`
+    """
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(async_iterator.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(async_iterator.aclose())
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Sizing of write transactions to a target latency. Transactions that are
+too small waste round trips, while those that are too large use a lot of heap
+on the server and hold their locks for long, so the number of rows per
+transaction is steered toward the size that commits in `target_seconds`.
+
+After each commit, the rows per second it achieved give the size that would
+have taken `target_seconds`, which the size moves part of the way toward
+(never more than doubling or halving at once). A transaction that fails
+halves the size, and its rows are handed out again. The size settled on,
+the median of the last sizes used, is what to start from next time.
+"""
+
+import itertools as it
+import logging
+import statistics
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class TooManyFailures(Exception):
+    """ Raised when the same rows have failed to be written too many times """
+
+
+class BatchSizer(object):
+    """ Hand out batches of rows, `size` at a time, adjusting `size` to the
+    latency of each transaction as reported to `record`. Without a
+    `target_seconds`, the size stays fixed, but failed batches are still
+    handed out again, up to `max_failures` (if not None) times in a row.
+    """
+    def __init__(self, size, target_seconds=None, minimum=1, maximum=100000,
+                 smoothing=0.5, max_failures=5, history=20):
+        self.size = max(minimum, min(size, maximum))
+        self.target_seconds = target_seconds
+        self.minimum = minimum
+        self.maximum = maximum
+        self.smoothing = smoothing
+        self.max_failures = max_failures
+        self.history = history
+        self.sizes = []
+        self.failures = 0
+        self.consecutive_failures = 0
+        self._pending = []
+        self._lock = threading.Lock()
+
+    @property
+    def settled(self):
+        """ (int): the median of the last `history` sizes used """
+        with self._lock:
+            return int(statistics.median(self.sizes)) if self.sizes \
+                else self.size
+
+    def record(self, rows, seconds):
+        """ Adjust the size to a transaction of `rows` rows that committed in
+        `seconds`
+        """
+        with self._lock:
+            self.consecutive_failures = 0
+            self.sizes = (self.sizes + [rows])[-self.history:]
+            if self.target_seconds is None or rows < self.size:
+                # The last batch of the input says nothing about the size
+                return
+            ideal = rows * self.target_seconds / max(seconds, 1e-6)
+            size = self.size + self.smoothing * (ideal - self.size)
+            size = max(self.size / 2, min(size, self.size * 2))
+            self.size = int(max(self.minimum, min(size, self.maximum)))
+        logger.debug(f"{rows} rows committed in {seconds:.3f}s; batch size "
+                     f"is now {self.size}")
+
+    def failed(self, batch=None):
+        """ Halve the size after a transaction failed, handing out the rows of
+        its `batch`, if given, again first
+        Raises:
+            TooManyFailures: after `max_failures` failures in a row
+        """
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.max_failures is not None \
+                    and self.consecutive_failures > self.max_failures:
+                raise TooManyFailures(f"{self.consecutive_failures} "
+                                      "transactions failed in a row")
+            if self.target_seconds is not None:
+                self.size = max(self.minimum, self.size // 2)
+            if batch is not None:
+                self._pending = list(batch) + self._pending
+        logger.warning(f"Transaction failed; batch size is now {self.size}")
+
+    def batches(self, iterable):
+        """ Yield lists of up to `size` rows of `iterable`, as `size` is when
+        each is taken, rows handed back to `failed` first
+        """
+        iterator = iter(iterable)
+        while True:
+            size = self.size
+            batch, self._pending = self._pending[:size], self._pending[size:]
+            batch.extend(it.islice(iterator, size - len(batch)))
+            if not batch:
+                return
+            yield batch
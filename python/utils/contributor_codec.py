@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" A compact format in which to store pages of contributors in the
+`contributors` field of SQLite. The Libraries.io API returns a dozen or so
+fields for each contributor, but only those in `FIELDS` are ever read (by
+`merge_contributors.create_contributor_node`), so the compact format keeps
+only those, as one JSON array per contributor rather than an object, and
+compresses the page with zlib.
+
+Compact pages begin with `MAGIC`, which raw JSON never does, so that
+`decode_contributors` reads either format; pages stored raw before the
+compact format was turned on need not be converted.
+"""
+
+import json
+import logging
+import zlib
+
+FIELDS = ('uuid', 'name', 'github_id', 'login', 'host_type')
+MAGIC = b'\x00LIOC1'
+STORAGE_FORMATS = ('raw', 'compact')
+logger = logging.getLogger(__name__)
+
+
+def project_contributors(contributors):
+    """ Return the values of `FIELDS` of each of `contributors`
+    Args:
+        contributors (list): of dicts, as returned by the API
+    Returns:
+        (list): of lists, in the order of `FIELDS`
+    """
+    return [[contributor.get(field) for field in FIELDS]
+            for contributor in contributors]
+
+
+def encode_compact(content, level=6):
+    """ Given the raw `content` of a page of contributors, return it in the
+    compact format; content that is not a JSON array of objects is returned
+    as it is
+    Args:
+        content (bytes): the content of the response
+        level (int): the zlib compression level
+    Returns:
+        (bytes): the compact page, or `content`
+    """
+    try:
+        contributors = json.loads(bytes(content))
+        rows = project_contributors(contributors)
+    except (AttributeError, TypeError, ValueError):
+        logger.warning("Content is not a page of contributors; storing as is")
+        return content
+    data = json.dumps(rows, separators=(',', ':')).encode('utf-8')
+    return MAGIC + zlib.compress(data, level)
+
+
+def decode_contributors(blob):
+    """ Return the contributors in `blob`, whether it is stored raw or in the
+    compact format
+    Args:
+        blob (bytes): the `contributors` field of SQLite
+    Returns:
+        (list): of dicts; in the compact format, with only the keys `FIELDS`
+    """
+    blob = bytes(blob)
+    if not blob.startswith(MAGIC):
+        return json.loads(blob)
+    rows = json.loads(zlib.decompress(blob[len(MAGIC):]).decode('utf-8'))
+    return [dict(zip(FIELDS, row)) for row in rows]
+
+
+def encoder(storage):
+    """ Return the function that encodes content for `storage`, one of
+    `STORAGE_FORMATS`, or None if it is stored as it is
+    """
+    if storage not in STORAGE_FORMATS:
+        raise ValueError(f"storage must be one of {STORAGE_FORMATS}")
+    return encode_compact if storage == 'compact' else None
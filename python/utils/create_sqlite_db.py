@@ -5,11 +5,38 @@ import sys
 import traceback
 from sqlite3 import connect, OperationalError
 
+NORMALIZED = '--normalized'
+NORMALIZED_TABLES = ('contributors', 'project_contributors')
+
+
+def create_normalized_tables(conn):
+    """ Create, if they do not exist, the tables of contributors, keyed by
+    uuid, and of which contributors contribute to which projects, indexed
+    both ways, that the fetcher fills alongside `project_names`
+    Args:
+        conn (sqlite3.Connection): connection to the DB in which to create them
+    """
+    with conn:
+        conn.execute("""create table if not exists contributors (
+            uuid integer primary key,
+            name text,
+            github_id text,
+            login text,
+            host_type text)""")
+        conn.execute("""create table if not exists project_contributors (
+            project_name text not null,
+            uuid integer not null,
+            PRIMARY KEY(project_name, uuid)) without rowid""")
+        conn.execute("""create index if not exists project_contributors_uuid
+            on project_contributors(uuid, project_name)""")
+
 
 def main(argv=None):
     if argv is None:
         argv = sys.argv
 
+    normalized = NORMALIZED in argv
+    argv = [arg for arg in argv if arg != NORMALIZED]
     try:
         dbname = argv[1]
     except IndexError:
@@ -17,6 +44,9 @@ def main(argv=None):
         return 1
 
     with connect(dbname) as conn:
+        if normalized:
+            create_normalized_tables(conn)
+            print("Normalized tables created successfully", file=sys.stderr)
         c = conn.cursor()
         try:
             c.execute("""create table project_names (
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" The HTTP validators (`ETag` and `Last-Modified`) of each page of
+contributors that has been fetched, kept in the SQLite DB so that a refresh
+can send a conditional request (`If-None-Match` / `If-Modified-Since`) for
+the page. The API answers 304 Not Modified, with no body, for a page that has
+not changed, which is then neither parsed nor written again.
+
+The validators of a page are written in the same transaction as the page
+itself (see `utils.sqlite_writer.ContributorsWriter`), so they never claim a
+page that was not stored. A page that failed is stored with no validators,
+so that it is requested in full next time.
+"""
+
+from collections import namedtuple
+import logging
+
+from utils.libraries_io_project_contributors_endpoint import count_pages, \
+    TOTAL_HEADERS
+
+NOT_MODIFIED = 304
+VALIDATORS_TABLE = 'http_validators'
+validators = namedtuple("Validators", ["etag", "last_modified"])
+logger = logging.getLogger(__name__)
+
+
+def response_validators(response):
+    """ Return the validators of `response`, or (None, None) if it failed """
+    if isinstance(response, Exception) or not response.ok:
+        return validators(None, None)
+    return validators(response.headers.get('ETag', None),
+                      response.headers.get('Last-Modified', None))
+
+
+def is_not_modified(response):
+    """ Return whether `response` says that the page has not changed """
+    return getattr(response, 'status_code', None) == NOT_MODIFIED
+
+
+class ValidatorCache(object):
+    """ Look up and store the validators of each (project_name, page) in the
+    table `name` of the SQLite DB connected to by `conn`
+    """
+    def __init__(self, conn, name=VALIDATORS_TABLE):
+        self.conn = conn
+        self.name = name
+        self.query = f"""insert into {name}(project_name, page, etag,
+            last_modified) values (?, ?, ?, ?)
+            on conflict(project_name, page) do update set
+            etag = excluded.etag, last_modified = excluded.last_modified"""
+
+    def create(self):
+        """ Create the table of validators, if it does not exist """
+        with self.conn:
+            self.conn.execute(f"""create table if not exists {self.name} (
+                project_name text not null,
+                page integer not null,
+                etag text,
+                last_modified text,
+                primary key (project_name, page))""")
+        return self
+
+    def conditional_headers(self, project_name, page):
+        """ Return the headers that make the request for `page` of
+        `project_name` conditional on its having changed since it was stored
+        Returns:
+            (dict): `If-None-Match` and/or `If-Modified-Since`; empty if the
+            page has no validators
+        """
+        row = self.conn.execute(
+            f"""select etag, last_modified from {self.name}
+            where project_name = ? and page = ?""",
+            (project_name, page)).fetchone()
+        if row is None:
+            return {}
+        return {header: value for header, value in
+                (('If-None-Match', row[0]), ('If-Modified-Since', row[1]))
+                if value is not None}
+
+    def num_pages(self, project_name):
+        """ Return the number of pages of `project_name` that have been
+        stored, or None if none has
+        """
+        return self.conn.execute(
+            f"select max(page) from {self.name} where project_name = ?",
+            (project_name,)).fetchone()[0]
+
+    def count_pages(self, response, project_name, per_page=100):
+        """ As `count_pages`, but for a 304 that gives no page count of its
+        own, return the number of pages stored for `project_name`, as it is
+        page 1 that has not changed
+        """
+        says = 'last' in response.links or \
+            any(header in response.headers for header in TOTAL_HEADERS)
+        if is_not_modified(response) and not says:
+            return self.num_pages(project_name) or count_pages(response,
+                                                               per_page)
+        return count_pages(response, per_page)
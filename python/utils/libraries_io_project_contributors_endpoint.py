@@ -25,16 +25,25 @@ import os
 import sys
 import traceback
 from collections import namedtuple
+from urllib.parse import parse_qs, urlparse
 
 from requests import Request, Session
-from requests.exceptions import HTTPError
+from requests.exceptions import ConnectionError, HTTPError, RequestException, \
+    Timeout
 
 URL = "https://libraries.io/api/Pypi/%s/contributors"
+TOTAL_HEADERS = ("Total", "X-Total", "X-Total-Count")
 content_and_error = namedtuple("ContentAndError", ["content", "error"])
+project_page = namedtuple("ProjectPage", ["project_name", "page"])
+fetched_page = namedtuple("FetchedPage", ["project_name", "page", "response"])
+# Kinds of failure: a permanent one is never requested again, the others are
+# retried later
+PERMANENT, THROTTLED, TRANSIENT = "permanent", "throttled", "transient"
 logger = logging.getLogger(__name__)
 
 
-def build_get_request(url, get_api_key=True, per_page=100, page=None):
+def build_get_request(url, get_api_key=True, per_page=100, page=None,
+                      api_key=None, headers=None):
     """ Given url, return requests.get object that is prepared with
     the keywords 'url', 'params' passed. N.b. the params are created
     internally because they are taken from ENV variables or user input.
@@ -44,6 +53,8 @@ def build_get_request(url, get_api_key=True, per_page=100, page=None):
         get_api_key (bool): whether to get 'APIKEY' from ENV vars
         per_page (int): the number of results to fetch
         page (int): the ith set of `per_page` results to fetch, i > 0
+        api_key (str): the API key to send; takes precedence over 'APIKEY'
+        headers (dict): headers to send, e.g. to make the request conditional
     Returns:
         (requests.Request): the requests.Request object with params set
     """
@@ -57,21 +68,94 @@ def build_get_request(url, get_api_key=True, per_page=100, page=None):
 
     params = {k: v for k, v in (("per_page", per_page), ("page", page))
               if v is not None}
-    if get_api_key:
+    if api_key is not None:
+        params["api_key"] = api_key
+    elif get_api_key:
         params["api_key"] = get_api_key_()
-    return Request("GET", url=url, params=params)
+    return Request("GET", url=url, params=params, headers=headers)
+
+
+def count_pages(response, per_page=100):
+    """ Given the response to the request for a page of results, return the
+    total number of pages of results, taken from the page number of the
+    'last' link of the response or, failing that, from a header giving the
+    total number of results.
+    Args:
+        response (requests.Response): response to a request for any page
+        per_page (int): the number of results per page that was requested
+    Returns:
+        (int): the number of pages, or None if the response does not say
+    """
+    last_page = response.links.get('last', None)
+    if last_page is not None:
+        query = parse_qs(urlparse(last_page['url']).query)
+        try:
+            return int(query['page'][0])
+        except (KeyError, ValueError):
+            logger.warning(f"No page number in 'last' link {last_page['url']}")
+
+    for header in TOTAL_HEADERS:
+        total = response.headers.get(header, None)
+        if total is not None and total.isdigit():
+            return max(1, -(-int(total) // per_page))
+
+    if response.links.get('next', None) is None:
+        return 1
+    return None
+
+
+def response_status(r):
+    """ Return the status of the response (or exception) `r` as stored in the
+    work queue: the status code, or else the name of the exception
+    """
+    if isinstance(r, Exception):
+        return type(r).__name__
+    return str(r.status_code)
+
+
+def classify_failure(r):
+    """ Given a `requests.Response`, or the exception raised instead of one,
+    return the kind of failure it is:
+      - PERMANENT: 404 or 410, i.e. the project is unknown to the API, or any
+        other 4xx, or a request that could not be made at all
+      - THROTTLED: 429
+      - TRANSIENT: 5xx, 401 or 403 (which concern the API key rather than the
+        project), a timeout or a connection error
+    Args:
+        r (requests.Response or Exception): the outcome of a request
+    Returns:
+        (str): the kind of failure, or None if the request succeeded
+    """
+    if isinstance(r, (Timeout, ConnectionError)):
+        return TRANSIENT
+    elif isinstance(r, RequestException):
+        return PERMANENT
+    elif isinstance(r, Exception):
+        return TRANSIENT
+    elif r.ok:
+        return None
+    elif r.status_code == 429:
+        return THROTTLED
+    elif r.status_code >= 500 or r.status_code in (401, 403):
+        return TRANSIENT
+    return PERMANENT
 
 
 def parse_request_response_content(r):
     """ Given a `requests.Response` object, execute the GET request and return
     namedtuple with the first field None in the case of exception having arisen,
     but r.content if no exception, and second field the exception that arose,
-    or None in the case of no exception.
+    or None in the case of no exception. If `r` is itself the exception that
+    was raised while sending the request, it is reported the same way.
     Args:
         r (requests.Reponse): response from requests.get operation
     Returns:
         (namedtuple): tuple of the form (r.content, Exception from r)
     """
+    if isinstance(r, Exception):
+        logger.warning(f"Exception occurred: {str(r)}")
+        return content_and_error(None, json.dumps({"Exception": str(r)}))
+
     try:
         r.raise_for_status()
     except HTTPError as h:
@@ -83,7 +167,8 @@ def parse_request_response_content(r):
         to_return = content_and_error(None,
                                       json.dumps({"Exception": str(e)}))
     else:
-        logger.info(f"Request to {r.url.split('?')[0]} was successful")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Request to {r.url.split('?')[0]} was successful")
         to_return = content_and_error(r.content, None)
     finally:
         r.close()
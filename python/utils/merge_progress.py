@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" A checkpoint of the progress of `merge_contributors.py`, kept in the
+SQLite DB the contributors are read from, instead of on the Project nodes of
+the graph.
+
+After each batch, the projects it completed are written to the
+`merge_progress` table in one transaction, with their contributor counts and
+the time (as SQLite keeps the `ts` of pages) at which the run began reading
+the pages. A run only MERGEs the projects that are pending: those with pages
+of contributors that are not in the table, or that have a page written since
+they were read, e.g. because it was fetched again or only succeeded on a
+retry. A run that stops, for whatever reason, so picks up where it stopped,
+at the cost of MERGEing (idempotently) the last project of the batch that was
+in flight again, and a later run picks up whatever was fetched in between.
+
+Progress is kept per `scope`, e.g. per value of the `merged_contributors`
+property that the projects are filtered by, so runs that MERGE different
+projects do not take each other's projects for done.
+"""
+
+import logging
+import time
+
+PROGRESS_TABLE = 'merge_progress'
+PENDING_TABLE = 'merge_pending'
+logger = logging.getLogger(__name__)
+
+
+class MergeProgress(object):
+    """ The projects whose contributors have been MERGEd in `scope`, in
+    `conn`
+    """
+    def __init__(self, conn, scope='', table=PROGRESS_TABLE, clock=time.time):
+        self.conn = conn
+        self.scope = scope
+        self.table = table
+        self.clock = clock
+        self.read_at = None
+
+    def create(self):
+        """ Create the table of progress, if it does not exist, or migrate
+        one kept before progress was scoped, taking its projects to have been
+        read when they were MERGEd
+        """
+        columns = {row[1] for row in self.conn.execute(
+            f"PRAGMA table_info({self.table})")}
+        with self.conn:
+            if columns and 'scope' not in columns:
+                self.conn.execute(
+                    f"alter table {self.table} rename to {self.table}_old")
+            self.conn.execute(f"""create table if not exists {self.table} (
+                scope text not null,
+                project_name text not null,
+                contributors integer not null,
+                merged_at real not null,
+                read_at text not null,
+                primary key (scope, project_name)) without rowid""")
+            if columns and 'scope' not in columns:
+                self.conn.execute(
+                    f"""insert into {self.table} select '', project_name,
+                    contributors, merged_at, datetime(merged_at, 'unixepoch')
+                    from {self.table}_old""")
+                self.conn.execute(f"drop table {self.table}_old")
+        return self
+
+    def pending(self, table='project_names'):
+        """ Fill the temporary table `PENDING_TABLE` with the names of the
+        projects of `table` whose contributors are yet to be MERGEd in
+        `scope`: those with successful pages that were never MERGEd, or that
+        have a page written since they were last read. Pages written from now
+        on are taken to be unread.
+        Returns:
+            (set): the names of the projects pending
+        """
+        self.read_at, = self.conn.execute(
+            "select current_timestamp").fetchone()
+        with self.conn:
+            self.conn.execute(f"drop table if exists temp.{PENDING_TABLE}")
+            self.conn.execute(
+                f"""create temp table {PENDING_TABLE} as
+                select n.project_name from {table} n
+                left join {self.table} m
+                on m.scope = ? and m.project_name = n.project_name
+                where n.api_has_been_queried = 1
+                and n.api_query_succeeded = 1
+                group by n.project_name
+                having max(m.read_at) is null or max(n.ts) >= max(m.read_at)""",
+                (self.scope,))
+        return {row[0] for row in self.conn.execute(
+            f"select project_name from {PENDING_TABLE}")}
+
+    def commit(self, counts):
+        """ Record the projects of `counts` as MERGEd in a single transaction
+        Args:
+            counts (dict): project_name: number of contributors MERGEd
+        Returns:
+            (int): the number of projects recorded
+        """
+        if not counts:
+            return 0
+        merged_at = self.clock()
+        read_at = self.read_at or self.conn.execute(
+            "select current_timestamp").fetchone()[0]
+        with self.conn:
+            self.conn.executemany(
+                f"insert or replace into {self.table} values (?, ?, ?, ?, ?)",
+                ((self.scope, name, count, merged_at, read_at)
+                 for name, count in counts.items()))
+        logger.debug(f"Checkpointed {len(counts)} projects")
+        return len(counts)
+
+    def restart(self):
+        """ Forget every project MERGEd in `scope`, so that the next run
+        starts over
+        """
+        with self.conn:
+            self.conn.execute(f"delete from {self.table} where scope = ?",
+                              (self.scope,))
+
+    def __len__(self):
+        return self.conn.execute(
+            f"select count(*) from {self.table} where scope = ?",
+            (self.scope,)).fetchone()[0]
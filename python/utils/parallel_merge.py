@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Parallel writing of relationships to Neo4j such that no two concurrent
+transactions ever lock the same node.
+
+Each relationship row has two node keys (e.g. the project and the contributor
+it joins). Hashing each key into one of `partitions` buckets puts the row in
+a cell (i, j) of a `partitions` x `partitions` grid. The cells of a diagonal,
+{(i, (i + k) % partitions) for every i}, share neither a bucket of the first
+key nor one of the second, so the transactions writing them can run at the
+same time without contending for locks. The grid is written one diagonal
+after another, each diagonal's cells by a pool of `partitions` workers.
+
+Deadlocks cannot arise between the cells of a diagonal, but other writers
+may still cause them, so transient errors are retried with exponential
+backoff. The number of rows per transaction is taken from a
+`utils.batch_sizing.BatchSizer` shared by the workers, to which the latency
+of each transaction is reported.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
+
+from utils.batch_sizing import BatchSizer
+
+logger = logging.getLogger(__name__)
+
+
+def bucket(key, partitions):
+    """ Return the bucket of the integer `key` among `partitions` buckets,
+    scrambling `key` first so that sequential keys are spread evenly
+    """
+    return (key * 2654435761 % 2 ** 32) % partitions
+
+
+def partition(rows, keys, partitions):
+    """ Sort `rows` into a grid of cells by the buckets of their two node keys
+    Args:
+        rows (iterable): the relationship rows
+        keys (function): returns the two (integer) node keys of a row
+        partitions (int): the number of buckets of each key
+    Returns:
+        (dict): (i, j): list of rows
+    """
+    cells = {}
+    for row in rows:
+        a, b = keys(row)
+        cells.setdefault((bucket(a, partitions), bucket(b, partitions)),
+                         []).append(row)
+    return cells
+
+
+def diagonals(cells, partitions):
+    """ Yield, for each diagonal of the grid, the (non-empty) cells on it, no
+    two of which share a bucket of either key
+    """
+    for k in range(partitions):
+        diagonal = [cells[(i, (i + k) % partitions)] for i in range(partitions)
+                    if (i, (i + k) % partitions) in cells]
+        if diagonal:
+            yield diagonal
+
+
+class GridWriter(object):
+    """ Write rows with `write`, a function that writes a list of rows in a
+    single transaction of its own (and that may be called from several
+    threads at once), `batch_size` rows per transaction (or as many as
+    `sizer` says), from a pool of `workers` threads writing node-disjoint
+    cells in parallel. A transaction that raises one of `transient` is
+    retried up to `retries` times.
+    """
+    def __init__(self, write, keys, workers=4, batch_size=1000, retries=5,
+                 transient=(Exception,), backoff=0.1, sleep=time.sleep,
+                 sizer=None, clock=time.monotonic):
+        self.write = write
+        self.keys = keys
+        self.workers = workers
+        self.sizer = sizer or BatchSizer(batch_size, max_failures=None)
+        self.clock = clock
+        self.retries = retries
+        self.transient = transient
+        self.backoff = backoff
+        self.sleep = sleep
+        self.retried = 0
+
+    def write_with_retries(self, rows, write=None):
+        """ Write `rows` in one transaction with `write` (by default, the
+        writer's own), retrying it as the writer retries its own
+        transactions
+        """
+        write = write or self.write
+        for attempt in range(self.retries + 1):
+            try:
+                return write(rows)
+            except self.transient as e:
+                if attempt == self.retries:
+                    raise
+                self.retried += 1
+                self.sizer.failed()
+                delay = self.backoff * 2 ** attempt
+                logger.warning(f"Transaction of {len(rows)} rows raised "
+                               f"{e!r}; retrying in {delay:.2f}s")
+                self.sleep(delay)
+
+    def _write_cell(self, rows):
+        start = 0
+        while start < len(rows):
+            batch = rows[start:start + self.sizer.size]
+            began = self.clock()
+            self.write_with_retries(batch)
+            self.sizer.record(len(batch), self.clock() - began)
+            start += len(batch)
+        return len(rows)
+
+    def run(self, rows):
+        """ Write all of `rows`, one diagonal of the grid at a time
+        Returns:
+            (int): the number of rows written
+        """
+        cells = partition(rows, self.keys, self.workers)
+        written = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for diagonal in diagonals(cells, self.workers):
+                written += sum(executor.map(self._write_cell, diagonal))
+        return written
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Progress reporting for long-running loops that costs next to nothing per
+item. Counters are only added to as the loop goes; a summary (the counts, the
+rate over the last interval, the ETA, percentiles of the latency of recent
+batches and the errors) is logged at most once every `interval` seconds, so a
+run of millions of items logs a line a minute rather than a line per item.
+"""
+
+from collections import deque
+import time
+
+
+def percentile(values, q):
+    """ Return the `q`th percentile (0 <= q <= 100) of the sorted `values`,
+    by the nearest rank, or None if there are none
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))]
+
+
+def format_seconds(seconds):
+    """ Return `seconds` as e.g. '1h02m03s' """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours \
+        else f"{minutes}m{seconds:02d}s"
+
+
+class ProgressReporter(object):
+    """ Count the `unit`s a loop has processed, and other `counters`, and log
+    a summary to `logger` at most once every `interval` seconds
+    Args:
+        logger (logging.Logger): e.g. as returned by `logger.return_logger`
+        unit (str): what the main count counts, e.g. 'rows'
+        interval (float): the least number of seconds between summaries
+        total (int): how many of `total_of` there are to process, if known,
+            to estimate the time left
+        total_of (str): the counter `total` is of; default: `unit`
+        context (function): returns a string to append to each summary
+        history (int): the number of recent batch latencies to keep
+        clock (function): returns the time in seconds
+    """
+    def __init__(self, logger, unit='rows', interval=60, total=None,
+                 total_of=None, context=None, history=1000,
+                 clock=time.monotonic):
+        self.logger = logger
+        self.unit = unit
+        self.interval = interval
+        self.total = total
+        self.total_of = total_of or unit
+        self.context = context
+        self.clock = clock
+        self.started = self.last = clock()
+        self.count = self.errors = 0
+        self.counters = {}
+        self.latencies = deque(maxlen=history)
+        self._count = 0
+
+    def update(self, count=0, seconds=None, errors=0, **counters):
+        """ Add `count` units, `errors` and `counters` to the counts, and the
+        latency `seconds` of the batch they were processed in, if given,
+        logging a summary if `interval` seconds have passed since the last
+        """
+        self.count += count
+        self.errors += errors
+        for name, n in counters.items():
+            self.counters[name] = self.counters.get(name, 0) + n
+        if seconds is not None:
+            self.latencies.append(seconds)
+        now = self.clock()
+        if now - self.last >= self.interval:
+            self.report(now)
+
+    def eta(self, now):
+        """ Return the seconds left to process `total`, at the rate so far,
+        or None if it cannot be estimated
+        """
+        done = self.count if self.total_of == self.unit \
+            else self.counters.get(self.total_of, 0)
+        if self.total is None or not done:
+            return None
+        return max(self.total - done, 0) * (now - self.started) / done
+
+    def summary(self, now=None):
+        """ Return the summary of the counts at `now` """
+        now = self.clock() if now is None else now
+        elapsed = max(now - self.last, 1e-9)
+        parts = [f"{self.count} {self.unit}"] + \
+            [f"{n} {name}" for name, n in sorted(self.counters.items())]
+        summary = (f"{', '.join(parts)} so far; "
+                   f"{(self.count - self._count) / elapsed:.1f} {self.unit}/s "
+                   f"in the last {elapsed:.0f}s")
+        eta = self.eta(now)
+        if eta is not None:
+            summary += f"; ETA {format_seconds(eta)}"
+        if self.latencies:
+            latencies = sorted(self.latencies)
+            summary += "; batch latency p50/p90/p99 " + "/".join(
+                f"{percentile(latencies, q):.2f}" for q in (50, 90, 99)) + "s"
+        if self.errors:
+            summary += f"; {self.errors} errors"
+        if self.context is not None:
+            summary += f"; {self.context()}"
+        return summary
+
+    def report(self, now=None):
+        """ Log the summary at INFO level and start a new interval """
+        now = self.clock() if now is None else now
+        self.logger.info(self.summary(now))
+        self.last, self._count = now, self.count
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Rate limiting primitives for requesting the Libraries.io API, which
+allows 60 requests per minute per API key.
+"""
+
+import asyncio
+import time
+from email.utils import parsedate_to_datetime
+
+CALLS = 59
+PERIOD = 59
+
+
+class TokenBucket(object):
+    """ Token bucket that hands out one token per request at a steady `rate`
+    of `calls` per `period` seconds, allowing a burst of at most `capacity`
+    tokens to accumulate while idle.
+
+    Tokens are reserved rather than waited for: `reserve` takes a token
+    immediately (letting the balance go negative) and returns how long the
+    caller must wait before using it, so that concurrent callers are served
+    in the order in which they asked, without a lock.
+    """
+    def __init__(self, calls=CALLS, period=PERIOD, capacity=1,
+                 clock=time.monotonic):
+        if calls <= 0 or period <= 0:
+            raise ValueError("`calls` and `period` must both be positive")
+        self.calls = calls
+        self.period = period
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock()
+
+    @property
+    def rate(self):
+        """ (float): tokens added to the bucket per second """
+        return self.calls / self.period
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def headroom(self):
+        """ Return the number of tokens currently available (negative if
+        callers are already waiting on reserved tokens)
+        """
+        self._refill()
+        return self.tokens
+
+    def reserve(self):
+        """ Take one token from the bucket, returning the number of seconds
+        the caller must wait before the token is valid.
+        Returns:
+            (float): seconds to wait; 0 if a token was available
+        """
+        self._refill()
+        self.tokens -= 1
+        return 0. if self.tokens >= 0 else -self.tokens / self.rate
+
+    def wait(self):
+        """ Block until a token is available """
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    async def acquire(self):
+        """ Suspend the calling coroutine until a token is available """
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        return delay
+
+
+def _first_header(headers, names):
+    for name in names:
+        value = headers.get(name, None)
+        if value is not None:
+            return value.strip()
+    return None
+
+
+def parse_seconds(value, now=None):
+    """ Parse a `Retry-After` or rate limit reset header value into a number of
+    seconds from now. The value may be a number of seconds, a Unix timestamp
+    or an HTTP date.
+    Args:
+        value (str): the header value
+        now (float): the current Unix time; default: time.time()
+    Returns:
+        (float): seconds from now, never negative; None if unparseable
+    """
+    if value is None:
+        return None
+    now = time.time() if now is None else now
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - now
+        except (TypeError, ValueError):
+            return None
+    else:
+        # Values this large can only be Unix timestamps, not durations
+        if seconds > 1e9:
+            seconds -= now
+    return max(seconds, 0.)
+
+
+class RateGovernor(TokenBucket):
+    """ TokenBucket whose rate follows what the API says about its rate limit
+    in the headers of each response, as passed to `observe`:
+      - `Retry-After` pauses sending for as long as it says
+      - `X-RateLimit-Remaining` and `X-RateLimit-Reset` (or the `RateLimit-*`
+        equivalents) spread the remaining requests evenly until the reset,
+        which may be faster than the nominal rate when the server allows it
+      - `X-RateLimit-Limit` sets the nominal rate, as that many per `period`
+      - otherwise, a 429 halves the rate (pausing for one period if there is
+        no `Retry-After`), and the rate recovers additively with each response
+        after that, back up to the nominal rate.
+
+    `rate` is the current rate in requests per second and `waited` the total
+    seconds callers have been told to wait.
+    """
+    LIMIT_HEADERS = ("X-RateLimit-Limit", "RateLimit-Limit")
+    REMAINING_HEADERS = ("X-RateLimit-Remaining", "RateLimit-Remaining")
+    RESET_HEADERS = ("X-RateLimit-Reset", "RateLimit-Reset")
+    MIN_RATE = 1 / 60.
+
+    def __init__(self, calls=CALLS, period=PERIOD, capacity=1,
+                 clock=time.monotonic):
+        self._rate = self.nominal_rate = calls / period
+        super().__init__(calls, period, capacity, clock)
+        self.waited = 0.
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def reserve(self):
+        delay = super().reserve()
+        self.waited += delay
+        return delay
+
+    def pause(self, seconds):
+        """ Make the next reservation wait at least `seconds` """
+        self._refill()
+        self.tokens = min(self.tokens, 1 - seconds * self._rate)
+
+    def observe(self, status_code, headers):
+        """ Adjust the rate to the response to a request
+        Args:
+            status_code (int): the status code of the response
+            headers (Mapping): the headers of the response
+        """
+        self._refill()
+        limit = _first_header(headers, self.LIMIT_HEADERS)
+        remaining = _first_header(headers, self.REMAINING_HEADERS)
+        reset = parse_seconds(_first_header(headers, self.RESET_HEADERS))
+        retry_after = parse_seconds(headers.get("Retry-After", None))
+        if limit is not None and limit.isdigit() and int(limit):
+            self.nominal_rate = int(limit) / self.period
+
+        if remaining is not None and remaining.isdigit() and reset:
+            if int(remaining):
+                self._rate = max(int(remaining) / reset, self.MIN_RATE)
+            else:
+                self._rate = self.nominal_rate
+                self.pause(reset)
+        elif status_code == 429:
+            self._rate = max(self._rate / 2, self.MIN_RATE)
+            if retry_after is None:
+                self.pause(self.period)
+        else:
+            self._rate = min(self.nominal_rate,
+                             self._rate + self.nominal_rate / self.calls)
+
+        if retry_after is not None:
+            self.pause(retry_after)
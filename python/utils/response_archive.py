@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" An archive of the raw responses of the Libraries.io API Project
+Contributors endpoint, so that the pipeline can be run again from what was
+fetched, without sending a single request.
+
+The archive is a SQLite file of its own, with one row per (project_name,
+page), keyed (and so indexed) on both and holding the status code, the headers
+and the body of the response, each compressed with zlib. When recording, the
+exceptions raised in place of a response are archived too, by name and
+message. When replaying, each row is turned back into a `requests.Response`
+(or the exception), in the order of the key, and fed to the same code that
+stores fetched pages, so that only the time spent decompressing and writing
+is left.
+"""
+
+from http.client import responses as reasons
+import json
+import logging
+from sqlite3 import Binary, connect
+import time
+import zlib
+
+from requests import Response
+from requests import exceptions
+from requests.structures import CaseInsensitiveDict
+
+from utils.libraries_io_project_contributors_endpoint import fetched_page, URL
+
+logger = logging.getLogger(__name__)
+
+
+def _compress(data, level):
+    return Binary(zlib.compress(data, level))
+
+
+def rebuild_response(project_name, page, status_code, headers, body):
+    """ Return the `requests.Response` for `page` of `project_name` that had
+    `status_code`, the (zlib-compressed JSON) `headers` and the
+    (zlib-compressed) `body`
+    """
+    response = Response()
+    response.status_code = status_code
+    response.reason = reasons.get(status_code, '')
+    response.headers = CaseInsensitiveDict(
+        json.loads(zlib.decompress(headers).decode('utf-8')))
+    response.url = f"{URL % project_name}?page={page}"
+    response._content = zlib.decompress(body)
+    response._content_consumed = True
+    response.encoding = 'utf-8'
+    return response
+
+
+def rebuild_exception(error, body):
+    """ Return the exception named `error` (one of `requests.exceptions`, or
+    else a `RequestException`) with the (zlib-compressed) message `body`
+    """
+    cls = getattr(exceptions, error, None)
+    if not (isinstance(cls, type) and issubclass(cls, Exception)):
+        cls = exceptions.RequestException
+    return cls(zlib.decompress(body).decode('utf-8'))
+
+
+def _rows_of(conn, query, project_names):
+    """ Yield the rows of `query` for each of `project_names` in turn """
+    for project_name in project_names:
+        yield from conn.execute(query, (project_name,))
+
+
+class ResponseArchive(object):
+    """ Record `fetched_page`s to, and replay them from, the archive at
+    `path`. Recorded pages are written `batch_size` at a time; use as a
+    context manager to write what is left and close the archive on exit.
+    """
+    def __init__(self, path, batch_size=500, level=6, clock=time.time):
+        self.path = path
+        self.conn = connect(path)
+        self.batch_size = batch_size
+        self.level = level
+        self.clock = clock
+        self.buffer = []
+        self.recorded = 0
+
+    def create(self):
+        """ Create the table of responses, if it does not exist """
+        with self.conn:
+            self.conn.execute("""create table if not exists responses (
+                project_name text not null,
+                page integer not null,
+                status_code integer,
+                error text,
+                headers blob,
+                body blob,
+                recorded_at real not null,
+                primary key (project_name, page)) without rowid""")
+        return self
+
+    def record(self, page):
+        """ Buffer the response (or exception) of the `fetched_page` `page`,
+        replacing any that was recorded for the same page before
+        """
+        response = page.response
+        if isinstance(response, Exception):
+            row = (page.project_name, page.page, None, type(response).__name__,
+                   None, _compress(str(response).encode('utf-8'), self.level),
+                   self.clock())
+        else:
+            headers = json.dumps(dict(response.headers)).encode('utf-8')
+            row = (page.project_name, page.page, response.status_code, None,
+                   _compress(headers, self.level),
+                   _compress(response.content or b'', self.level),
+                   self.clock())
+        self.buffer.append(row)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ Write the buffered responses in a single transaction """
+        if not self.buffer:
+            return 0
+        batch, self.buffer = self.buffer, []
+        logger.debug(f"Archiving {len(batch)} responses")
+        with self.conn:
+            self.conn.executemany(
+                "insert or replace into responses values (?, ?, ?, ?, ?, ?, ?)",
+                batch)
+        self.recorded += len(batch)
+        return len(batch)
+
+    def __len__(self):
+        return self.conn.execute("select count(*) from responses").fetchone()[0]
+
+    def replay(self, project_names=None):
+        """ Yield every page recorded, or only those of `project_names`, as
+        the `fetched_page` it was recorded from
+        Args:
+            project_names (iterable): the names of the projects to replay;
+                default: every project in the archive
+        Yields:
+            (fetched_page): (project_name, page, requests.Response or
+            Exception), by project name and page
+        """
+        query = """select project_name, page, status_code, error, headers, body
+            from responses"""
+        if project_names is None:
+            rows = self.conn.execute(query + " order by project_name, page")
+        else:
+            rows = _rows_of(self.conn, query + " where project_name = ? "
+                            "order by page", project_names)
+        for project_name, page, status_code, error, headers, body in rows:
+            if error is not None:
+                response = rebuild_exception(error, body)
+            else:
+                response = rebuild_response(project_name, page, status_code,
+                                            headers, body)
+            yield fetched_page(project_name, page, response)
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
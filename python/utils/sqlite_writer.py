@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Batched writing of fetched contributor pages to the SQLite table of
+project names. Every page, whether page 1 (the row for which was inserted
+when the table was populated) or a later page (which has no row yet), is
+written by the same parameterized upsert, and the writes are committed in
+batches rather than one transaction per row. The HTTP validators of each
+page, if kept, are written in the same transaction as the page, as are its
+contributors, if the DB has the normalized tables of contributors.
+"""
+
+import json
+import logging
+from sqlite3 import Binary, IntegrityError, OperationalError
+
+from utils.contributor_codec import project_contributors
+from utils.create_sqlite_db import NORMALIZED_TABLES
+from utils.utils import craft_sqlite_project_names_upsert
+
+logger = logging.getLogger(__name__)
+SYNCHRONOUS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+CONTRIBUTORS_UPSERT = """insert into contributors(uuid, name, github_id,
+    login, host_type) values (?, ?, ?, ?, ?)
+    on conflict(uuid) do update set name = excluded.name,
+    github_id = excluded.github_id, login = excluded.login,
+    host_type = excluded.host_type"""
+PROJECT_CONTRIBUTORS_INSERT = """insert or ignore into
+    project_contributors(project_name, uuid) values (?, ?)"""
+
+
+def has_normalized_tables(conn):
+    """ Return whether the DB of `conn` has the normalized tables of
+    contributors, as created by `create_sqlite_db.py --normalized`
+    """
+    tables = {row[0] for row in conn.execute(
+        "select name from sqlite_master where type='table'")}
+    return set(NORMALIZED_TABLES) <= tables
+
+
+def configure_connection(conn, journal_mode='WAL', synchronous='NORMAL'):
+    """ Set the journal mode and synchronous setting of `conn`. In WAL mode
+    with synchronous=NORMAL, a commit appends to the write-ahead log without
+    an fsync, which only happens at checkpoints; the database stays consistent
+    on power loss, but the last commits may be rolled back.
+    Args:
+        conn (sqlite3.Connection): the connection to configure
+        journal_mode (str): the `journal_mode` pragma to set
+        synchronous (str): the `synchronous` pragma to set
+    Returns:
+        (str): the journal mode in effect
+    """
+    if synchronous.upper() not in SYNCHRONOUS:
+        raise ValueError(f"synchronous must be one of {SYNCHRONOUS}")
+    mode, = conn.execute(f"PRAGMA journal_mode={journal_mode}").fetchone()
+    conn.execute(f"PRAGMA synchronous={synchronous}")
+    return mode
+
+
+def normalized_rows(project_name, content):
+    """ Return the rows of the contributors table, and of the
+    project_contributors table, for the contributors in `content`, the raw
+    content of a page of contributors to `project_name`. Contributors whose
+    uuid is not an integer are left out.
+    """
+    try:
+        rows = project_contributors(json.loads(bytes(content)))
+    except (AttributeError, TypeError, ValueError):
+        logger.warning(f"Content for project '{project_name}' is not a page "
+                       "of contributors")
+        return [], []
+    contributors = []
+    for row in rows:
+        try:
+            contributors.append((int(row[0]),) + tuple(row[1:]))
+        except (TypeError, ValueError):
+            logger.warning(f"Contributor to project '{project_name}' with "
+                           f"uuid {row[0]!r} left out")
+    return contributors, [(project_name, row[0]) for row in contributors]
+
+
+def page_record(project_name, page, content_and_error):
+    """ Return the parameters of the upsert for the page `page` of
+    `project_name`, given its content and error
+    """
+    content, error = content_and_error
+    return (project_name, page, 1, 1 if error is None else 0, error,
+            Binary(content) if content is not None else None)
+
+
+class ContributorsWriter(object):
+    """ Buffer records for the `table` of project names, writing them with one
+    `executemany` of the upsert per `batch_size` records, each batch in its
+    own transaction. The buffer is also flushed as soon as the contributors
+    it holds add up to `max_buffer_bytes`, so that its memory is bounded
+    however large the pages are. Use as a context manager to flush what is
+    left on exit.
+
+    If given `validators` (a `utils.http_cache.ValidatorCache`), the
+    validators of each record are written alongside it. If given `encode`
+    (see `utils.contributor_codec.encoder`), the contributors of each record
+    are stored as it encodes them. If `normalized`, the contributors of each
+    record are also written to the contributors and project_contributors
+    tables; edges are only ever added, never removed. `unchanged` counts the
+    pages found not to have changed, which are not written at all, and
+    `failed_projects` holds the names of the projects some of whose records
+    could not be written.
+    """
+    def __init__(self, conn, table='project_names', batch_size=500,
+                 max_buffer_bytes=64 * 2 ** 20, validators=None, encode=None,
+                 normalized=False):
+        self.conn = conn
+        self.query = craft_sqlite_project_names_upsert(table)
+        self.validators = validators
+        self.encode = encode
+        self.normalized = normalized
+        self.contributors_buffer = []
+        self.edges_buffer = []
+        self.batch_size = batch_size
+        self.max_buffer_bytes = max_buffer_bytes
+        self.buffer = []
+        self.validators_buffer = []
+        self.buffered_bytes = 0
+        self.written = 0
+        self.failed = 0
+        self.failed_projects = set()
+        self.unchanged = 0
+
+    def write(self, record, validators=(None, None)):
+        """ Buffer `record`, flushing the buffer if it is full
+        Args:
+            record (tuple): (project_name, page, api_has_been_queried,
+                api_query_succeeded, execution_error, contributors)
+            validators (tuple): (ETag, Last-Modified) of the response that
+                `record` is of
+        """
+        if self.validators is not None:
+            self.validators_buffer.append(record[:2] + tuple(validators))
+        if self.normalized and record[-1] is not None:
+            contributors, edges = normalized_rows(record[0], record[-1])
+            self.contributors_buffer.extend(contributors)
+            self.edges_buffer.extend(edges)
+        if self.encode is not None and record[-1] is not None:
+            record = record[:-1] + (Binary(self.encode(record[-1])),)
+        self.buffer.append(record)
+        self.buffered_bytes += len(record[-1]) if record[-1] is not None else 0
+        if len(self.buffer) >= self.batch_size \
+                or self.buffered_bytes >= self.max_buffer_bytes:
+            self.flush()
+
+    def flush(self):
+        """ Write the buffered records in a single transaction, rolling back
+        if any of them cannot be written
+        Returns:
+            (int): the number of records written
+        """
+        if not self.buffer:
+            return 0
+        batch, self.buffer, self.buffered_bytes = self.buffer, [], 0
+        validators, self.validators_buffer = self.validators_buffer, []
+        contributors, self.contributors_buffer = self.contributors_buffer, []
+        edges, self.edges_buffer = self.edges_buffer, []
+        logger.debug(f"Writing {len(batch)} records")
+        try:
+            with self.conn:
+                self.conn.executemany(self.query, batch)
+                if validators:
+                    self.conn.executemany(self.validators.query, validators)
+                if contributors:
+                    self.conn.executemany(CONTRIBUTORS_UPSERT, contributors)
+                    self.conn.executemany(PROJECT_CONTRIBUTORS_INSERT, edges)
+        except (IntegrityError, OperationalError):
+            logger.error(f'SQLite error occurred writing {len(batch)} records; '
+                         'rolled back', exc_info=True)
+            self.failed += len(batch)
+            self.failed_projects.update(record[0] for record in batch)
+            return 0
+        else:
+            self.written += len(batch)
+            return len(batch)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
@@ -5,7 +5,7 @@ from functools import reduce
 import itertools as it
 import logging
 from argparse import ArgumentParser, RawTextHelpFormatter
-from sqlite3 import connect, IntegrityError, OperationalError, Binary, Row
+from sqlite3 import connect, IntegrityError, OperationalError
 
 from utils.get_pypi_python_projects_from_neo4j import URI
 
@@ -21,7 +21,8 @@ def return_parser():
         formatter_class=RawTextHelpFormatter,
         epilog='N.b. to avoid being prompted for Graph DB password and '
         'Libraries.io API key, set the ENV variables `GRAPHDBPASS` and `APIKEY`'
-        ', respectively'
+        ', respectively. To spread requests over several API keys, set '
+        '`APIKEYS` to the keys, separated by commas'
     )
     p.add_argument('DB', type=str,
                    help='The sqlite DB containing project_names that have '
@@ -31,10 +32,70 @@ def return_parser():
                    help='The name of the table in the sqlite DB specified '
                    'in the `DB` argument')
     p.add_argument('batch_size', type=int,
-                   help='The amount of API calls to execute before sleeping; '
-                   'n.b. the API has a rate limit of 60 per minute')
+                   help='The number of projects to lease from the work queue '
+                   'and request; n.b. the API has a rate limit of 60 per '
+                   'minute')
     # p.add_argument('time_to_sleep', type=int,
     #                help='Time (s) for script to pause between API batches')
+    p.add_argument('--async', dest='asynchronous', action='store_true',
+                   help='Send requests concurrently from a pool of workers '
+                   'sharing the rate limit, instead of one at a time')
+    p.add_argument('--concurrency', type=int, default=8, required=False,
+                   help='The number of requests in flight at once when '
+                   'sending requests with `--async`; default: %(default)s')
+    p.add_argument('--daemon', action='store_true',
+                   help='Keep leasing and requesting batches of projects, '
+                   'polling the work queue when it is empty, until SIGTERM')
+    p.add_argument('--until_empty', '--until-empty', action='store_true',
+                   help='Keep leasing and requesting batches of projects '
+                   'until the work queue is empty')
+    p.add_argument('--refresh', action='store_true',
+                   help='Put every project fetched successfully back in the '
+                   'work queue first; its pages are requested again only if '
+                   'they have changed since they were stored')
+    p.add_argument('--record', type=str, required=False, metavar='ARCHIVE',
+                   help='Also write every response to the (compressed) '
+                   'response archive ARCHIVE, to be replayed later')
+    p.add_argument('--replay', type=str, required=False, metavar='ARCHIVE',
+                   help='Instead of requesting the API, store every response '
+                   'in the response archive ARCHIVE, marking the projects '
+                   'stored done in the work queue')
+    p.add_argument('--poll_seconds', type=int, default=60, required=False,
+                   help='How long (s) to wait before polling an empty work '
+                   'queue again with `--daemon`; default: %(default)s')
+    p.add_argument('--report_seconds', type=int, default=60, required=False,
+                   help='How often (s) to log throughput; default: %(default)s')
+    p.add_argument('--worker_id', type=str, required=False,
+                   help='The name under which this process leases projects '
+                   'from the work queue; default: <hostname>:<pid>')
+    p.add_argument('--lease_seconds', type=int, default=3600, required=False,
+                   help='How long (s) a leased project is reserved for this '
+                   'process, from when it is claimed and again from when it '
+                   'is started, before another may claim it; '
+                   'default: %(default)s')
+    p.add_argument('--max_attempts', type=int, default=5, required=False,
+                   help='The number of times to request a project that fails '
+                   'with a 5xx, 429 or timeout before giving up on it; '
+                   'default: %(default)s')
+    p.add_argument('--retry_seconds', type=int, default=60, required=False,
+                   help='How long (s) to wait before retrying a failed '
+                   'project, doubling with each attempt; default: %(default)s')
+    p.add_argument('--write_batch_size', type=int, default=500,
+                   required=False,
+                   help='The number of records written to SQLite per '
+                   'transaction; default: %(default)s')
+    p.add_argument('--max_buffer_mb', type=int, default=64, required=False,
+                   help='The most contributor data (MB) to hold in memory '
+                   'before writing it to SQLite; default: %(default)s')
+    p.add_argument('--storage', type=str, default='raw',
+                   choices=['raw', 'compact'],
+                   help='How to store contributors: as the API returns them, '
+                   'or only the fields merged into Neo4j, compressed; '
+                   'default: %(default)s')
+    p.add_argument('--synchronous', type=str, default='NORMAL',
+                   choices=['OFF', 'NORMAL', 'FULL', 'EXTRA'],
+                   help='The SQLite `synchronous` setting to write with, in '
+                   'WAL journal mode; default: %(default)s')
     p.add_argument("-l", "--log", dest="log_level", default='INFO',
                    choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                    help="Set the logging level; default: %(default)s")
@@ -49,61 +110,26 @@ def return_parser():
     return p
 
 
-def craft_sqlite_project_names_insert():
-    """ Return an insert statement corresponding to project_names to pass to
-    sqlite3.Connection.cursor.execute()
+def craft_sqlite_project_names_upsert(table='project_names'):
+    """ Return a parameterized statement that inserts a record of `table`,
+    or updates it if there already is a record for its project_name and page,
+    to pass to sqlite3.Connection.executemany()
     """
-
-    insert_query = """INSERT INTO project_names (
+    upsert_query = f"""INSERT INTO {table} (
                     project_name,
                     page,
                     api_has_been_queried,
                     api_query_succeeded,
                     execution_error,
                     contributors,
-                    ts) VALUES (?, ?, ?, ?, ?, ?, current_timestamp);"""
-    return insert_query
-
-
-def craft_sqlite_project_names_update(project_name,
-                                      page,
-                                      api_has_been_queried,
-                                      api_query_succeeded):
-    """ Given values for each field of the `project_names` table,
-    return a tuple of the parameterized update statement and the record
-    to pass to sqlite3.Connection.cursor.execute()
-    """
-    update_query = f"""UPDATE project_names SET
-                    api_has_been_queried={api_has_been_queried},
-                    api_query_succeeded={api_query_succeeded},
-                    execution_error=?,
-                    contributors=?,
-                    ts=current_timestamp
-                    WHERE project_name='{project_name}'
-                    AND page={page}"""
-    return update_query
-
-
-def execute_sqlite_query(conn, query, params=None):
-    execute_args = (query, params) if params is not None else (query,)
-    logger.debug(f'Executing query:\n{query}')
-    try:
-        cur = conn.cursor()
-        cur.execute(*execute_args)
-    except (IntegrityError, OperationalError):
-        logger.error('SQLite error occurred; rolling back', exc_info=True)
-        conn.rollback()
-        return
-    except:
-        logger.error('Exception occurred; rolling back', exc_info=True)
-        conn.rollback()
-        return
-    else:
-        conn.commit()
-        logger.debug(f'{cur.rowcount} records changed')
-        return 0
-    finally:
-        cur.close()
+                    ts) VALUES (?, ?, ?, ?, ?, ?, current_timestamp)
+                    ON CONFLICT(project_name, page) DO UPDATE SET
+                    api_has_been_queried=excluded.api_has_been_queried,
+                    api_query_succeeded=excluded.api_query_succeeded,
+                    execution_error=excluded.execution_error,
+                    contributors=excluded.contributors,
+                    ts=excluded.ts;"""
+    return upsert_query
 
 
 def select_from_sqlite(conn, query, params=None, num_retries=3):
@@ -130,19 +156,6 @@ def select_from_sqlite(conn, query, params=None, num_retries=3):
         return
 
 
-def partition(pred, iterable):
-    '''Use a predicate to partition entries into true entries and false entries.
-    From https://docs.python.org/3/library/itertools.html#itertools-recipes
-    Args:
-        pred (callable): the determiner of truthiness for each element of `iterable`
-        iterable (iterable): the iterable to separate by truthiness
-    Returns:
-        (tuple): of iterables, each an iterator of elements from `iterable`
-    '''
-    t1, t2 = it.tee(iterable)
-    return filter(pred, t1), it.filterfalse(pred, t2)
-
-
 def chunk(i, n):
     """ Return an iterable representing `i` split into `n`-sized chunks.
     Credit to https://stackoverflow.com/a/22049333
@@ -158,3 +171,27 @@ def chunk(i, n):
 
 def compose(*functions):
     return reduce(lambda f, g: lambda x: f(g(x)), functions, lambda x: x)
+
+
+def merge_join(left, right, left_key, right_key):
+    """ Join the iterables `left` and `right`, both sorted ascending by their
+    key, in a single pass over each, pairing every item of `right` with the
+    item of `left` that has the same key. Items of either without a match are
+    skipped; the keys of `left` are assumed to be unique.
+    Args:
+        left (iterable): sorted by `left_key`
+        right (iterable): sorted by `right_key`
+        left_key (function): returns the key of an item of `left`
+        right_key (function): returns the key of an item of `right`
+    Yields:
+        (tuple): (item of `left`, item of `right`)
+    """
+    right = iter(right)
+    r = next(right, None)
+    for l in left:
+        key = left_key(l)
+        while r is not None and right_key(r) < key:
+            r = next(right, None)
+        while r is not None and right_key(r) == key:
+            yield l, r
+            r = next(right, None)
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" A queue, in the SQLite DB, of the projects whose contributors are yet to
+be requested, from which several fetch processes can claim work at once.
+
+Each process claims a batch of projects by taking a lease on them, which
+lasts `lease_seconds`, and renews the lease on each project as it starts on
+it, so that a batch may take longer than a lease. Claiming is a single write
+transaction, so two processes can never lease the same project, and a project
+whose lease has expired (e.g. because the process holding it crashed) can be
+claimed again. Once a project's pages have been written, it is marked done.
+
+A project that failed is either done for good, if the failure is permanent
+(e.g. the API does not know the project), or scheduled to be retried once its
+`next_attempt_at` comes, backing off exponentially with its `attempts`, until
+`max_attempts` have been made. Its lease is released until then, so that due
+retries are claimed alongside new projects without anyone having to re-run the
+fetcher for the failures.
+
+A partial index covers only the projects not yet done, ordered by when their
+lease expires, so claiming reads only the claimable head of the queue rather
+than scanning and grouping the whole `project_names` table.
+"""
+
+import logging
+import os
+import socket
+import time
+
+from utils.libraries_io_project_contributors_endpoint import PERMANENT
+
+logger = logging.getLogger(__name__)
+QUEUE_TABLE = 'fetch_queue'
+COLUMNS = (('attempts', 'integer not null default 0'),
+           ('next_attempt_at', 'real not null default 0'),
+           ('last_status', 'text'))
+
+
+def default_worker_id():
+    """ Return an identifier for this process, unique across hosts """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkQueue(object):
+    """ Claim, lease, and complete projects in the queue table `name` of the
+    SQLite DB connected to by `conn`.
+    """
+    def __init__(self, conn, name=QUEUE_TABLE, worker_id=None,
+                 lease_seconds=3600, max_attempts=5, retry_seconds=60,
+                 max_retry_seconds=24 * 3600, clock=time.time):
+        self.conn = conn
+        self.name = name
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self.clock = clock
+
+    def exists(self):
+        query = "select 1 from sqlite_master where type='table' and name=?"
+        return self.conn.execute(query, (self.name,)).fetchone() is not None
+
+    def create(self):
+        """ Create the queue table and its partial index, if they do not exist
+        Returns:
+            (bool): whether the table was created
+        """
+        if self.exists():
+            self._add_missing_columns()
+            return False
+        with self.conn:
+            self.conn.execute(f"""create table {self.name} (
+                project_name text primary key,
+                leased_by text,
+                lease_expires_at real not null default 0,
+                done integer not null default 0,
+                {', '.join(' '.join(column) for column in COLUMNS)})""")
+            self.conn.execute(f"""create index {self.name}_claimable
+                on {self.name}(lease_expires_at) where done = 0""")
+        logger.info(f"Created queue table {self.name}")
+        return True
+
+    def _add_missing_columns(self):
+        """ Add the retry schedule columns to a queue table created without
+        them
+        """
+        existing = {row[1] for row in
+                    self.conn.execute(f"PRAGMA table_info({self.name})")}
+        with self.conn:
+            for column, definition in COLUMNS:
+                if column not in existing:
+                    self.conn.execute(f"alter table {self.name} "
+                                      f"add column {column} {definition}")
+
+    def seed(self, table='project_names'):
+        """ Add to the queue each project of `table` that has not been
+        requested yet
+        Returns:
+            (int): the number of projects added
+        """
+        with self.conn:
+            cur = self.conn.execute(
+                f"""insert or ignore into {self.name}(project_name)
+                select distinct project_name from {table}
+                where api_has_been_queried is null""")
+        logger.info(f"Added {cur.rowcount} projects to queue {self.name}")
+        return cur.rowcount
+
+    def ensure(self, table='project_names'):
+        """ Create the queue, seeding it from `table`, if it does not exist """
+        if self.create():
+            self.seed(table)
+        return self
+
+    def refresh(self):
+        """ Put every project that was fetched successfully back in the queue,
+        so that it is requested again; projects that failed for good stay done
+        Returns:
+            (int): the number of projects put back
+        """
+        with self.conn:
+            cur = self.conn.execute(
+                f"""update {self.name} set done = 0, leased_by = null,
+                lease_expires_at = 0, next_attempt_at = 0, attempts = 0
+                where done = 1 and last_status = '200'""")
+        logger.info(f"Put {cur.rowcount} projects back in queue {self.name}")
+        return cur.rowcount
+
+    def claim(self, n):
+        """ Lease up to `n` projects that are not done and not leased (or
+        whose lease has expired) to this worker, in a single transaction.
+        Projects due to be retried, and those whose lease has expired, are
+        claimed first, and the rest of the batch is made up of projects not
+        yet attempted.
+        Returns:
+            (list): the names of the projects leased
+        """
+        now = self.clock()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            names = [row[0] for row in self.conn.execute(
+                f"""select project_name from {self.name}
+                where done = 0 and lease_expires_at > 0
+                and lease_expires_at <= ?
+                order by lease_expires_at limit ?""", (now, n))]
+            names += [row[0] for row in self.conn.execute(
+                f"""select project_name from {self.name}
+                where done = 0 and lease_expires_at = 0 limit ?""",
+                (n - len(names),))]
+            self.conn.executemany(
+                f"""update {self.name} set leased_by = ?, lease_expires_at = ?
+                where project_name = ?""",
+                ((self.worker_id, now + self.lease_seconds, name)
+                 for name in names))
+        except Exception:
+            self.conn.rollback()
+            raise
+        else:
+            self.conn.commit()
+        logger.info(f"{self.worker_id} leased {len(names)} projects")
+        return names
+
+    def renew(self, name):
+        """ Extend the lease of this worker on the project `name` by
+        `lease_seconds` from now
+        Returns:
+            (bool): whether this worker still held the lease, which it does
+            not if the lease expired and another worker claimed the project
+        """
+        with self.conn:
+            cur = self.conn.execute(
+                f"""update {self.name} set lease_expires_at = ?
+                where project_name = ? and leased_by = ? and done = 0""",
+                (self.clock() + self.lease_seconds, name, self.worker_id))
+        if not cur.rowcount:
+            logger.warning(f"{self.worker_id} lost its lease on project "
+                           f"'{name}'")
+        return bool(cur.rowcount)
+
+    def complete(self, names, status='200'):
+        """ Mark the projects `names`, leased by this worker, as done """
+        names = list(names)
+        with self.conn:
+            cur = self.conn.executemany(
+                f"""update {self.name} set done = 1, leased_by = null,
+                attempts = attempts + 1, last_status = ?
+                where project_name = ? and leased_by = ?""",
+                ((status, name, self.worker_id) for name in names))
+        if cur.rowcount < len(names):
+            logger.warning(f"Only {cur.rowcount} of {len(names)} projects "
+                           f"completed were still leased by {self.worker_id}")
+
+    def mark_done(self, names, status='200'):
+        """ Mark the projects `names` as done, whose pages were stored other
+        than by leasing them (e.g. replayed from an archive), unless a worker
+        holds an unexpired lease on them
+        Returns:
+            (int): the number of projects marked done
+        """
+        now = self.clock()
+        with self.conn:
+            cur = self.conn.executemany(
+                f"""update {self.name} set done = 1, leased_by = null,
+                lease_expires_at = 0, last_status = ?
+                where project_name = ? and done = 0
+                and (leased_by is null or lease_expires_at <= ?)""",
+                ((status, name, now) for name in names))
+        return cur.rowcount
+
+    def backoff(self, attempts):
+        """ Return how long (s) to wait before the next attempt at a project
+        that has failed `attempts` times
+        """
+        return min(self.retry_seconds * 2 ** (attempts - 1),
+                   self.max_retry_seconds)
+
+    def fail(self, failures):
+        """ Record the failures of projects leased by this worker: a project
+        whose failure is permanent, or that has failed `max_attempts` times,
+        is done; any other is released until its next attempt is due.
+        Args:
+            failures (dict): project name: (kind of failure, status), as
+                given by `classify_failure` and `response_status`
+        Returns:
+            (int): the number of projects scheduled to be retried
+        """
+        now, retries = self.clock(), 0
+        with self.conn:
+            for name, (kind, status) in failures.items():
+                row = self.conn.execute(
+                    f"""select attempts from {self.name}
+                    where project_name = ? and leased_by = ?""",
+                    (name, self.worker_id)).fetchone()
+                if row is None:
+                    logger.warning(f"Failure of project '{name}' not "
+                                   "recorded, as it is no longer leased by "
+                                   f"{self.worker_id}")
+                    continue
+                attempts = row[0] + 1
+                if kind == PERMANENT or attempts >= self.max_attempts:
+                    logger.warning(f"Giving up on project '{name}' after "
+                                   f"{attempts} attempt(s); last status "
+                                   f"{status} ({kind})")
+                    self.conn.execute(
+                        f"""update {self.name} set done = 1, leased_by = null,
+                        attempts = ?, last_status = ? where project_name = ?""",
+                        (attempts, status, name))
+                    continue
+                next_attempt_at = now + self.backoff(attempts)
+                self.conn.execute(
+                    f"""update {self.name} set leased_by = null,
+                    lease_expires_at = ?, next_attempt_at = ?, attempts = ?,
+                    last_status = ? where project_name = ?""",
+                    (next_attempt_at, next_attempt_at, attempts, status, name))
+                retries += 1
+        logger.info(f"{retries} of {len(failures)} failed projects scheduled "
+                    "to be retried")
+        return retries
+
+    def release(self, names):
+        """ Give up the leases on `names` so that they can be claimed again
+        at once
+        """
+        with self.conn:
+            self.conn.executemany(
+                f"""update {self.name} set leased_by = null,
+                lease_expires_at = 0
+                where project_name = ? and leased_by = ?""",
+                ((name, self.worker_id) for name in names))
+
+    def remaining(self):
+        """ Return the number of projects not yet done """
+        return self.conn.execute(
+            f"select count(*) from {self.name} where done = 0").fetchone()[0]
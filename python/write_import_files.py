@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Write the node and relationship files with which `neo4j-admin import`
+builds the whole graph offline, in place of `projects_apoc.cypher`,
+`versions_apoc.cypher`, `dependencies_apoc.cypher` and
+`merge_contributors.py`.
+
+The Pypi subset CSVs are streamed once each, in the order projects, versions,
+dependencies, and then the contributors are read from SQLite. Every node is
+written once, with an `:ID` in the ID space of its label, and every
+relationship once, between IDs resolved in-process: dependencies name the
+project they depend on, which is looked up among the projects written (see
+`resolve_dependencies.py`), and
+relationships to projects or versions that were not written are left out, as
+the MATCH of the Cypher scripts would leave them out.
+"""
+
+from argparse import ArgumentParser
+import csv
+import logging
+import os
+import sys
+from typing import Dict, Iterator, List, Set
+
+from logger import return_logger
+from resolve_dependencies import ProjectIDs
+from utils.contributor_codec import decode_contributors, FIELDS
+from utils.sqlite_writer import has_normalized_tables
+from utils.utils import connect
+
+# name: (node label or relationship type, header)
+NODE_FILES: Dict[str, tuple] = {
+    'platforms': ('Platform', [':ID(Platform)', 'name']),
+    'languages': ('Language', [':ID(Language)', 'name']),
+    'projects': ('Project', [':ID(Project)', 'name', 'ID:int',
+                             'sourcerank:int', 'versions_count:int']),
+    'versions': ('Version', [':ID(Version)', 'number', 'ID:int']),
+    'contributors': ('Contributor', [':ID(Contributor)', 'uuid:int', 'name',
+                                     'github_id', 'login', 'host_type']),
+}
+RELATIONSHIP_FILES: Dict[str, tuple] = {
+    'has_default_language': ('HAS_DEFAULT_LANGUAGE',
+                             [':START_ID(Platform)', ':END_ID(Language)']),
+    'hosts': ('HOSTS', [':START_ID(Platform)', ':END_ID(Project)']),
+    'is_written_in': ('IS_WRITTEN_IN',
+                      [':START_ID(Project)', ':END_ID(Language)']),
+    'has_version': ('HAS_VERSION', [':START_ID(Project)', ':END_ID(Version)']),
+    'depends_on': ('DEPENDS_ON', [':START_ID(Version)', ':END_ID(Project)',
+                                  'kind', 'optional:boolean']),
+    'contributes_to': ('CONTRIBUTES_TO',
+                       [':START_ID(Contributor)', ':END_ID(Project)']),
+}
+logger = logging.getLogger(__name__)
+
+
+def read_csv(path: str) -> Iterator[Dict]:
+    """ Yield each row of the CSV at `path` as a dict of its header """
+    with open(path, newline='', encoding='utf-8') as f:
+        yield from csv.DictReader(f)
+
+
+def to_int(value: str):
+    """ Return `value` as an int, or None if it is not one """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_boolean(value: str) -> str:
+    """ Return `value` as `neo4j-admin import` reads a boolean, as
+    `apoc.convert.toBoolean` would convert it, or '' if it is empty
+    """
+    if not value:
+        return ''
+    return 'false' if value.strip().lower() in ('false', 'f', 'no', 'n', '0') \
+        else 'true'
+
+
+class ImportFiles(object):
+    """ The node and relationship files in `directory`, each opened with its
+    header the first time it is written to, counting the rows written to and
+    left out of each
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.files: Dict[str, object] = {}
+        self.writers: Dict[str, object] = {}
+        self.written: Dict[str, int] = {}
+        self.skipped: Dict[str, int] = {}
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.csv")
+
+    def write(self, name: str, row: List) -> None:
+        if name not in self.writers:
+            _, header = {**NODE_FILES, **RELATIONSHIP_FILES}[name]
+            self.files[name] = open(self.path(name), 'w', newline='',
+                                    encoding='utf-8')
+            self.writers[name] = csv.writer(self.files[name])
+            self.writers[name].writerow(header)
+            self.written[name] = 0
+        self.writers[name].writerow(row)
+        self.written[name] += 1
+
+    def skip(self, name: str) -> None:
+        self.skipped[name] = self.skipped.get(name, 0) + 1
+
+    def command(self, database: str) -> str:
+        """ Return the `neo4j-admin import` command, as of Neo4j 3.5, that
+        imports the files written into `database`
+        """
+        arguments = [f"--nodes:{label}={self.path(name)}"
+                     for name, (label, _) in NODE_FILES.items()
+                     if name in self.written] + \
+            [f"--relationships:{type_}={self.path(name)}"
+             for name, (type_, _) in RELATIONSHIP_FILES.items()
+             if name in self.written]
+        return " \\\n    ".join(
+            [f"neo4j-admin import --mode=csv --database={database}"]
+            + arguments)
+
+    def close(self) -> None:
+        for f in self.files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_projects(rows: Iterator[Dict], files: ImportFiles, platform: str,
+                   default_language: str) -> Dict[str, int]:
+    """ Write `platform`, its `default_language` and the relationship between
+    them, then each project of `rows` once, as a node and with its HOSTS and
+    IS_WRITTEN_IN relationships, and the Platform and Language nodes they
+    need
+    Args:
+        rows (iterable): of the rows of `pypi_projects.csv`
+        files (ImportFiles): the files to write to
+        platform (str): the platform of rows without a `Platform` column
+        default_language (str): the default language of `platform`
+    Returns:
+        (dict): project name: ID of every project written
+    """
+    projects: Dict[str, int] = {}
+    ids: Set[int] = set()
+    platforms: Set[str] = {platform}
+    languages: Set[str] = {default_language}
+    files.write('platforms', [platform, platform])
+    files.write('languages', [default_language, default_language])
+    files.write('has_default_language', [platform, default_language])
+    for row in rows:
+        name, id_ = row.get('Name'), to_int(row.get('ID'))
+        # Project.name and Project.ID are both unique
+        if not name or id_ is None or name in projects or id_ in ids:
+            files.skip('projects')
+            continue
+        projects[name] = id_
+        ids.add(id_)
+        files.write('projects', [id_, name, id_, row.get('SourceRank', ''),
+                                 row.get('Versions_Count', '')])
+        host = row.get('Platform') or platform
+        if host not in platforms:
+            platforms.add(host)
+            files.write('platforms', [host, host])
+        files.write('hosts', [host, id_])
+        language = row.get('Language')
+        if language:
+            if language not in languages:
+                languages.add(language)
+                files.write('languages', [language, language])
+            files.write('is_written_in', [id_, language])
+    return projects
+
+
+def write_versions(rows: Iterator[Dict], files: ImportFiles,
+                   project_ids: Set[int]) -> Set[int]:
+    """ Write each version of `rows` once, as a node and with the HAS_VERSION
+    relationship from its project, if that was written
+    Returns:
+        (set): the IDs of the versions written
+    """
+    versions: Set[int] = set()
+    for row in rows:
+        id_ = to_int(row.get('ID'))
+        if id_ is None or id_ in versions:
+            files.skip('versions')
+            continue
+        versions.add(id_)
+        files.write('versions', [id_, row.get('Number', ''), id_])
+        project_id = to_int(row.get('Project_ID'))
+        if project_id in project_ids:
+            files.write('has_version', [project_id, id_])
+        else:
+            files.skip('has_version')
+    return versions
+
+
+def write_dependencies(rows: Iterator[Dict], files: ImportFiles,
+                       projects: Dict[str, int], versions: Set[int]) -> None:
+    """ Write the DEPENDS_ON relationship of each row of `rows` from its
+    version to the project it names (by its exact or, if unambiguous,
+    normalized name), once per pair, with the kind and optionality of the
+    first row of the pair, as `ON CREATE SET` would
+    """
+    ids = ProjectIDs()
+    for name, id_ in projects.items():
+        ids.add(name, id_)
+    pairs: Set[tuple] = set()
+    for row in rows:
+        version_id = to_int(row.get('Version_ID'))
+        project_id = ids.resolve(row.get('Dependency_Name') or '')
+        if version_id not in versions or project_id is None \
+                or (version_id, project_id) in pairs:
+            files.skip('depends_on')
+            continue
+        pairs.add((version_id, project_id))
+        files.write('depends_on', [version_id, project_id,
+                                   row.get('Dependency_Kind', ''),
+                                   to_boolean(row.get('Optional_Dependency'))])
+
+
+def project_contributors(conn) -> Iterator[tuple]:
+    """ Yield (project_name, contributor row in the order of `FIELDS`) for
+    every contributor of every project in SQLite, from the normalized tables
+    if they exist, or else from the pages stored in `project_names`
+    """
+    if has_normalized_tables(conn):
+        yield from ((row[0], row[1:]) for row in conn.execute(
+            f"""select pc.project_name, {', '.join(f'c.{f}' for f in FIELDS)}
+            from project_contributors pc join contributors c using (uuid)
+            order by pc.project_name"""))
+        return
+    for project_name, content in conn.execute(
+            """select project_name, contributors from project_names
+            where api_has_been_queried=1 and api_query_succeeded=1
+            order by project_name, page"""):
+        try:
+            contributors = decode_contributors(content)
+        except (TypeError, ValueError):
+            logger.warning(f"Content for project '{project_name}' is not a "
+                           "page of contributors")
+            continue
+        for contributor in contributors:
+            yield project_name, tuple(contributor.get(f) for f in FIELDS)
+
+
+def write_contributors(rows: Iterator[tuple], files: ImportFiles,
+                       projects: Dict[str, int]) -> None:
+    """ Write each contributor of `rows` once, as a node, and its
+    CONTRIBUTES_TO relationship to each project written, once per project
+    Args:
+        rows (iterable): of (project_name, contributor row), by project name
+        files (ImportFiles): the files to write to
+        projects (dict): project name: ID of every project written
+    """
+    contributors: Set[int] = set()
+    project_name, uuids = None, set()
+    for name, row in rows:
+        if name != project_name:
+            # The rows of a project are consecutive
+            project_name, uuids = name, set()
+        uuid = to_int(row[0])
+        project_id = projects.get(name)
+        if uuid is None or project_id is None or uuid in uuids:
+            files.skip('contributes_to')
+            continue
+        uuids.add(uuid)
+        if uuid not in contributors:
+            contributors.add(uuid)
+            files.write('contributors', [uuid, uuid] + [
+                '' if value is None else value for value in row[1:]])
+        files.write('contributes_to', [uuid, project_id])
+
+
+def return_parser() -> ArgumentParser:
+    p = ArgumentParser(
+        description='Write the node and relationship files with which '
+        '`neo4j-admin import` builds the graph from the Pypi subset CSVs and '
+        'the contributors in SQLite, in one offline import.')
+    p.add_argument('projects', type=str, help='The path to pypi_projects.csv')
+    p.add_argument('versions', type=str, help='The path to pypi_versions.csv')
+    p.add_argument('dependencies', type=str,
+                   help='The path to pypi_dependencies.csv')
+    p.add_argument('out', type=str,
+                   help='The directory in which to write the import files')
+    p.add_argument('--DB', type=str, required=False,
+                   help='The sqlite DB containing the contributors requested '
+                   'from the Libraries.io API; default: no contributors')
+    p.add_argument('--platform', type=str, default='Pypi',
+                   help='The platform hosting projects, if the projects CSV '
+                   'has no `Platform` column; default: %(default)s')
+    p.add_argument('--default_language', type=str, default='Python',
+                   help='The language of the HAS_DEFAULT_LANGUAGE '
+                   'relationship of the platform; default: %(default)s')
+    p.add_argument('--database', type=str, default='graph.db',
+                   help='The database for `neo4j-admin import` to create; '
+                   'default: %(default)s')
+    p.add_argument("-l", "--log", dest="log_level", default='INFO',
+                   choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                   help="Set the logging level; default: %(default)s")
+    p.add_argument('--logfile', type=str, required=False,
+                   help='The log file to which to write logging')
+    p.add_argument('--logfile_level', type=str, required=False,
+                   default='DEBUG',
+                   help='The level of logging to write to `logfile`')
+    return p
+
+
+def main(argv=None):
+    if argv is None:
+        argv: List = sys.argv
+
+    args = return_parser().parse_args(argv[1:])
+    return_logger(__name__, args.log_level, args.logfile, args.logfile_level)
+    os.makedirs(args.out, exist_ok=True)
+    with ImportFiles(args.out) as files:
+        logger.info(f"Reading projects from {args.projects}")
+        projects: Dict[str, int] = write_projects(
+            read_csv(args.projects), files, args.platform,
+            args.default_language)
+        logger.info(f"Reading versions from {args.versions}")
+        versions: Set[int] = write_versions(read_csv(args.versions), files,
+                                            set(projects.values()))
+        logger.info(f"Reading dependencies from {args.dependencies}")
+        write_dependencies(read_csv(args.dependencies), files, projects,
+                           versions)
+        if args.DB:
+            logger.info(f"Reading contributors from {args.DB}")
+            with connect(args.DB) as conn:
+                write_contributors(project_contributors(conn), files,
+                                   projects)
+
+    for name in list(NODE_FILES) + list(RELATIONSHIP_FILES):
+        logger.info(f"{name}: {files.written.get(name, 0)} written, "
+                    f"{files.skipped.get(name, 0)} duplicate or unresolved "
+                    "rows left out")
+    print(files.command(args.database))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())